@@ -0,0 +1,211 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+import sim_realsense
+from frame_codecs import get_codec
+from frame_writer import FrameWriter
+from multi_device_manager import MultiDeviceManager
+from profiling import StageProfiler, percentiles_ms
+from recording import RecordingWriter
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='Capture throughput of the simulated or replayed rig')
+    parser.add_argument('--cameras', default='1,2,4', help='comma separated camera counts, e.g. 1,2,3,4,5,6,7,8')
+    parser.add_argument('--camera_workers', default='1,0',
+                        help='comma separated MultiDeviceManager num_workers, 1 is sequential and 0 one thread per camera')
+    parser.add_argument('--resolutions', default='1024x768:1920x1080',
+                        help='comma separated depth:color resolutions, e.g. 640x480:1280x720')
+    parser.add_argument('--save', default='none,png,raw', help='comma separated save modes: none, png, raw')
+    parser.add_argument('--duration', default=10.0, type=float, help='seconds measured per run')
+    parser.add_argument('--warmup', default=10, type=int, help='sets discarded before measuring')
+    parser.add_argument('--fps', default=30, type=int)
+    parser.add_argument('--jitter_ms', default=0.5, type=float)
+    parser.add_argument('--drop_rate', default=0.0, type=float)
+    parser.add_argument('--replay', default=None, help='replay this raw recording instead of synthetic frames')
+    parser.add_argument('--poll', action='store_true', default=False)
+    parser.add_argument('--sync_tolerance_ms', default=16.0, type=float)
+    parser.add_argument('--writer_workers', default=2, type=int)
+    parser.add_argument('--writer_queue', default=64, type=int)
+    parser.add_argument('--color_codec', default='png')
+    parser.add_argument('--depth_codec', default='png')
+    parser.add_argument('--output_dir', default=None, help='where frames are written, a temporary directory by default')
+    parser.add_argument('--output', default=None, help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+    return args
+
+
+def parse_resolution(text):
+    width, height = text.split('x')
+    return int(width), int(height)
+
+
+def make_config(device_serial, depth_resolution, color_resolution, fps):
+    config = sim_realsense.config()
+    config.enable_stream(sim_realsense.stream.depth, *depth_resolution, sim_realsense.format.z16, fps)
+    config.enable_stream(sim_realsense.stream.infrared, *depth_resolution, sim_realsense.format.y8, fps)
+    config.enable_stream(sim_realsense.stream.color, *color_resolution, sim_realsense.format.bgr8, fps)
+    return config
+
+
+def run_case(args, num_cameras, depth_resolution, color_resolution, save, num_workers=1):
+    sim_realsense.set_rig(sim_realsense.SimRig(num_devices=num_cameras, fps=args.fps,
+                                               depth_resolution=depth_resolution, color_resolution=color_resolution,
+                                               jitter_ms=args.jitter_ms, drop_rate=args.drop_rate,
+                                               recording=args.replay))
+    profiler = StageProfiler()
+    root = tempfile.mkdtemp(prefix='capture_benchmark_', dir=args.output_dir)
+    writer = None
+    recorder = None
+    if save == 'png' and args.writer_workers > 0:
+        writer = FrameWriter(args.writer_workers, args.writer_queue, profiler=profiler)
+    elif save == 'raw':
+        recorder = RecordingWriter(os.path.join(root, 'recording'))
+    manager = MultiDeviceManager(sim_realsense.context(),
+                                 partial(make_config, depth_resolution=depth_resolution,
+                                         color_resolution=color_resolution, fps=args.fps),
+                                 writer=writer, recorder=recorder, backend=sim_realsense, profiler=profiler,
+                                 preview=False, num_workers=num_workers, color_codec=get_codec(args.color_codec, 'color'),
+                                 depth_codec=get_codec(args.depth_codec, 'depth'))
+    try:
+        manager.enable_all_devices()
+        for i in range(num_cameras):
+            os.makedirs(os.path.join(root, 'images', f'view{i}'), exist_ok=True)
+            os.makedirs(os.path.join(root, 'depths', f'view{i}'), exist_ok=True)
+        if not args.poll:
+            manager.start_capture_engine(sync_tolerance_ms=args.sync_tolerance_ms or None)
+        for _ in range(args.warmup):
+            manager.get_frames(root, save=False, no_count=True).release()
+        profiler.reset()
+
+        latencies = []
+        frame_numbers = [[] for _ in range(num_cameras)]
+        timestamps = [[] for _ in range(num_cameras)]
+        start = time.time()
+        while time.time() - start < args.duration:
+            # Held buffers would slow the devices down, release every set like the capture scripts do
+            manager.get_frames(root, save=save != 'none').release()
+            # Frame timestamps are in the global (host) time domain
+            latencies.append(time.time() - min(manager.last_timestamps) / 1000)
+            for i, (frame_number, timestamp) in enumerate(zip(manager.last_frame_numbers, manager.last_timestamps)):
+                frame_numbers[i].append(frame_number)
+                timestamps[i].append(timestamp)
+        elapsed = time.time() - start
+        flush_start = time.time()
+        if writer is not None:
+            writer.close()
+        flush = time.time() - flush_start
+    finally:
+        manager.disable_streams()
+        if recorder is not None:
+            recorder.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+    sets = len(latencies)
+    cameras = []
+    for numbers, camera_timestamps in zip(frame_numbers, timestamps):
+        gaps = np.diff(numbers) - 1 if len(numbers) > 1 else np.zeros(0)
+        skipped = int(gaps[gaps > 0].sum())
+        span_s = (camera_timestamps[-1] - camera_timestamps[0]) / 1000 if len(camera_timestamps) > 1 else 0
+        cameras.append({
+            # Frames the camera delivered during the run, the ones taken and the ones skipped in between
+            'fps': (len(numbers) + skipped) / elapsed,
+            # From the camera's own frame numbers and timestamps, independent of the consumer
+            'device_fps': (numbers[-1] - numbers[0]) / span_s if span_s > 0 else None,
+            'frames_skipped': skipped,
+        })
+    engine = manager.capture_engine
+    result = {
+        'cameras': num_cameras,
+        'depth_resolution': list(depth_resolution),
+        'color_resolution': list(color_resolution),
+        'save': save,
+        'camera_workers': num_workers,
+        'duration_s': elapsed,
+        'sets': sets,
+        'set_fps': sets / elapsed,
+        'dropped_sets': max(0, int(round(elapsed * args.fps)) - sets),
+        'latency': percentiles_ms(latencies),
+        'per_camera': cameras,
+        'stages': profiler.summary(),
+        'writer_flush_s': flush,
+    }
+    if writer is not None:
+        result['writer'] = writer.stats()
+    if engine is not None and engine.synchronizer is not None:
+        result['sync'] = engine.synchronizer.stats()
+    return result
+
+
+def scaling_table(runs):
+    """
+    Camera frames per second against the number of cameras, for every resolution, save mode and worker setting
+    """
+    table = {}
+    for run in runs:
+        key = (f"{'x'.join(map(str, run['depth_resolution']))}:{'x'.join(map(str, run['color_resolution']))} "
+               f"save={run['save']} workers={run['camera_workers']}")
+        table.setdefault(key, {})[run['cameras']] = run['set_fps'] * run['cameras']
+    for key, frames_per_second in table.items():
+        print(key + ': ' + ', '.join(f"{cameras} cams {fps:.0f} frames/s" for cameras, fps in frames_per_second.items()))
+    return table
+
+
+def worker_speedup(runs):
+    """
+    Set rate with concurrent camera workers relative to the sequential run (workers=1) of the same case
+    """
+    sequential = {(run['cameras'], tuple(run['depth_resolution']), tuple(run['color_resolution']), run['save']):
+                  run['set_fps'] for run in runs if run['camera_workers'] == 1}
+    speedup = {}
+    for run in runs:
+        case = (run['cameras'], tuple(run['depth_resolution']), tuple(run['color_resolution']), run['save'])
+        if run['camera_workers'] == 1 or case not in sequential:
+            continue
+        key = (f"{run['cameras']} cams {'x'.join(map(str, case[1]))}:{'x'.join(map(str, case[2]))} "
+               f"save={run['save']} workers={run['camera_workers']}")
+        speedup[key] = run['set_fps'] / sequential[case]
+        print(f"{key}: {speedup[key]:.2f}x the sequential set rate")
+    return speedup
+
+
+if __name__ == "__main__":
+    args = parse_config()
+    if os.cpu_count() < 2 and any(int(n) != 1 for n in args.camera_workers.split(',')):
+        print(f"Only {os.cpu_count()} CPU, concurrent camera workers cannot be faster than sequential processing here")
+    runs = []
+    cases = itertools.product([int(n) for n in args.cameras.split(',')],
+                              [resolution.split(':') for resolution in args.resolutions.split(',')],
+                              args.save.split(','), [int(n) for n in args.camera_workers.split(',')])
+    for num_cameras, (depth_resolution, color_resolution), save, num_workers in cases:
+        result = run_case(args, num_cameras, parse_resolution(depth_resolution), parse_resolution(color_resolution),
+                          save, num_workers)
+        print(f"{num_cameras} cameras {depth_resolution}/{color_resolution} save={save} workers={num_workers}: "
+              f"{result['set_fps']:.1f} sets/s, p95 latency {result['latency'].get('p95_ms', 0):.1f} ms",
+              flush=True)
+        runs.append(result)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'config': vars(args),
+        'runs': runs,
+        'scaling': scaling_table(runs),
+        'worker_speedup': worker_speedup(runs),
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,73 @@
+import argparse
+import time
+
+import numpy as np
+
+from frame_codecs import CODECS, get_codec
+
+
+def parse_config():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', default=10, type=int)
+    parser.add_argument('--color_codecs', default='png:1,png:3,png:6,jpeg:95,jpeg:80,raw,lz4,zstd:1,zstd:3')
+    parser.add_argument('--depth_codecs', default='png:1,png:3,png:6,raw,lz4,zstd:1,zstd:3')
+    args = parser.parse_args()
+    return args
+
+
+def synthetic_depth(width=1024, height=768, seed=0):
+    # Smooth scene geometry in 0.25 mm units with sensor noise and invalid (zero) pixels
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    depth = 8000 + 4000 * np.sin(x / 150) * np.cos(y / 120) + 3 * x
+    depth += rng.normal(0, 8, depth.shape)
+    depth[rng.random(depth.shape) < 0.03] = 0
+    return np.clip(depth, 0, 65535).astype(np.uint16)
+
+
+def synthetic_color(width=1920, height=1080, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [128 + 100 * np.sin(x / (60 + 20 * c) + y / (90 + 10 * c)) for c in range(3)]
+    color = np.stack(channels, axis=-1) + rng.normal(0, 4, (height, width, 3))
+    return np.clip(color, 0, 255).astype(np.uint8)
+
+
+def benchmark(codec, image, repeat):
+    data = codec.encode(image)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = codec.encode(image)
+    encode = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decoded = codec.decode(data)
+    decode = (time.perf_counter() - start) / repeat
+    lossless = np.array_equal(decoded, image)
+    megabytes = image.nbytes / 1e6
+    return {
+        'encode_mb_s': megabytes / encode,
+        'decode_mb_s': megabytes / decode,
+        'ratio': image.nbytes / len(data),
+        'lossless': lossless,
+    }
+
+
+def run(name, image, specs, repeat):
+    print(f"{name} {image.shape} {image.dtype}, {image.nbytes / 1e6:.1f} MB")
+    for spec in specs.split(','):
+        try:
+            codec = get_codec(spec, name)
+        except ImportError as e:
+            print(f"  {spec:<8} skipped: {e}")
+            continue
+        result = benchmark(codec, image, repeat)
+        print(f"  {spec:<8} encode {result['encode_mb_s']:8.1f} MB/s  decode {result['decode_mb_s']:8.1f} MB/s  "
+              f"ratio {result['ratio']:5.2f}  {'lossless' if result['lossless'] else 'lossy'}")
+
+
+if __name__ == "__main__":
+    args = parse_config()
+    print(f"Available codecs: {list(CODECS)}")
+    run('depth', synthetic_depth(), args.depth_codecs, args.repeat)
+    run('color', synthetic_color(), args.color_codecs, args.repeat)
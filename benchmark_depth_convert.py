@@ -0,0 +1,41 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from depth_convert import UINT16_MAX, DepthConverter, legacy_convert
+
+
+def parse_config():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', default=1024, type=int)
+    parser.add_argument('--height', default=768, type=int)
+    parser.add_argument('--repeat', default=200, type=int)
+    parser.add_argument('--scales', default='0.25,1.0,0.1', help='comma separated depth scales in mm per unit')
+    args = parser.parse_args()
+    return args
+
+
+def benchmark(raw, depth_scale, repeat):
+    converter = DepthConverter(depth_scale)
+    out = np.empty_like(raw)
+    # The legacy cast of depths beyond the uint16 range is platform dependent, the converter saturates them
+    in_range = raw.astype(np.float32) * np.float32(depth_scale) <= UINT16_MAX
+    expected = np.where(in_range, legacy_convert(raw, depth_scale), UINT16_MAX)
+    assert np.array_equal(converter.convert(raw, out), expected), depth_scale
+
+    legacy = min(timeit.repeat(lambda: legacy_convert(raw, depth_scale), number=repeat, repeat=3)) / repeat
+    preallocated = min(timeit.repeat(lambda: converter.convert(raw, out), number=repeat, repeat=3)) / repeat
+    return converter.mode, legacy, preallocated
+
+
+if __name__ == "__main__":
+    args = parse_config()
+    rng = np.random.default_rng(0)
+    # Typical L515 range of up to 9 m at 0.25 mm per unit
+    raw = rng.integers(0, 36000, (args.height, args.width), dtype=np.uint16)
+    print(f"z16 {args.width}x{args.height}, {args.repeat} conversions per run")
+    for depth_scale in [float(scale) for scale in args.scales.split(',')]:
+        mode, legacy, preallocated = benchmark(raw, depth_scale, args.repeat)
+        print(f"scale {depth_scale:<6} mode {mode:<8} legacy {legacy * 1e3:.3f} ms  "
+              f"preallocated {preallocated * 1e3:.3f} ms  speedup {legacy / preallocated:.1f}x")
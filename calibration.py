@@ -0,0 +1,210 @@
+import argparse
+import glob
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+from pointcloud import ALIGNED_STREAM, load_intrinsics
+
+EXTRINSICS_VERSION = 1
+EXTRINSICS_FILE = 'extrinsic.json'
+
+
+class CheckerboardTarget:
+    """
+    Plain checkerboard, columns x rows inner corners with square_size meters between them
+    """
+    def __init__(self, columns=9, rows=6, square_size=0.025):
+        self.pattern_size = (columns, rows)
+        grid = np.mgrid[0:columns, 0:rows].T.reshape(-1, 2)
+        self.object_points = np.zeros((columns * rows, 3), np.float32)
+        self.object_points[:, :2] = grid * square_size
+        self.description = {'board': 'checkerboard', 'columns': columns, 'rows': rows, 'square_size': square_size}
+
+    def detect(self, gray):
+        """
+        Return:
+        -----------
+        points : tuple of np.ndarray or None
+                 Object points (Nx3) and image points (Nx2) of the detected corners
+        """
+        flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+        found, corners = cv2.findChessboardCorners(gray, self.pattern_size, flags=flags)
+        if not found:
+            return None
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+        corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+        return self.object_points, corners.reshape(-1, 2)
+
+
+class CharucoTarget:
+    """
+    ChArUco board of columns x rows squares, works with partially visible boards
+    """
+    def __init__(self, columns=7, rows=5, square_size=0.04, marker_size=0.03, dictionary='DICT_5X5_100',
+                 min_corners=6):
+        board_dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, dictionary))
+        self.board = cv2.aruco.CharucoBoard((columns, rows), square_size, marker_size, board_dictionary)
+        self.detector = cv2.aruco.CharucoDetector(self.board)
+        self.min_corners = min_corners
+        self.description = {'board': 'charuco', 'columns': columns, 'rows': rows, 'square_size': square_size,
+                            'marker_size': marker_size, 'dictionary': dictionary}
+
+    def detect(self, gray):
+        corners, ids, _, _ = self.detector.detectBoard(gray)
+        if ids is None or len(ids) < self.min_corners:
+            return None
+        object_points = np.asarray(self.board.getChessboardCorners(), np.float32)[ids.ravel()]
+        return object_points, corners.reshape(-1, 2)
+
+
+def camera_matrix(intrinsics):
+    return np.array([[intrinsics['fx'], 0, intrinsics['cx']],
+                     [0, intrinsics['fy'], intrinsics['cy']],
+                     [0, 0, 1]], np.float64)
+
+
+def board_pose(target, image, intrinsics):
+    """
+    Pose of the board in the camera frame
+
+    Return:
+    -----------
+    pose : tuple or None
+           4x4 board-to-camera transform and the RMS reprojection error in pixels
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    detection = target.detect(gray)
+    if detection is None:
+        return None
+    object_points, image_points = detection
+    matrix = camera_matrix(intrinsics)
+    coeffs = np.asarray(intrinsics.get('coeffs', [0.0] * 5), np.float64)
+    ok, rvec, tvec = cv2.solvePnP(object_points, image_points, matrix, coeffs)
+    if not ok:
+        return None
+    projected, _ = cv2.projectPoints(object_points, rvec, tvec, matrix, coeffs)
+    error = float(np.sqrt(np.mean(np.sum((projected.reshape(-1, 2) - image_points) ** 2, axis=1))))
+    transform = np.eye(4)
+    transform[:3, :3] = cv2.Rodrigues(rvec)[0]
+    transform[:3, 3] = tvec.ravel()
+    return transform, error
+
+
+def average_transforms(transforms):
+    """
+    Mean of rigid transforms, the rotation is projected back onto SO(3)
+    """
+    transforms = np.asarray(transforms)
+    u, _, vt = np.linalg.svd(transforms[:, :3, :3].sum(axis=0))
+    rotation = u @ vt
+    if np.linalg.det(rotation) < 0:
+        u[:, -1] *= -1
+        rotation = u @ vt
+    average = np.eye(4)
+    average[:3, :3] = rotation
+    average[:3, 3] = transforms[:, :3, 3].mean(axis=0)
+    return average
+
+
+def snapshot_images(root, num_views):
+    """
+    Color snapshots of the capture scripts by frame number: {frame: [path of view 0, path of view 1, ...]}
+    """
+    pattern = re.compile(r'(\d+)_img\.')
+    snapshots = {}
+    for view in range(num_views):
+        for path in glob.glob(os.path.join(root, 'images', f'view{view}', '*_img.*')):
+            match = pattern.match(os.path.basename(path))
+            if match is not None:
+                snapshots.setdefault(int(match.group(1)), [None] * num_views)[view] = path
+    return dict(sorted(snapshots.items()))
+
+
+def calibrate(root, target, reference_view=0, stream=ALIGNED_STREAM):
+    """
+    Camera-to-camera extrinsics from board snapshots taken with the capture scripts
+
+    Every view is expressed in the color camera frame of reference_view. A view needs at least one snapshot
+    in which both it and the reference view see the board; the poses of all such snapshots are averaged.
+
+    Return:
+    -----------
+    extrinsics : dict
+                 In the format written by save_extrinsics
+    """
+    intrinsics = load_intrinsics(os.path.join(root, 'intrinsic.json'), stream)
+    num_views = len(intrinsics)
+    relative = [[] for _ in range(num_views)]
+    errors = [[] for _ in range(num_views)]
+    for frame, paths in snapshot_images(root, num_views).items():
+        poses = [None] * num_views
+        for view, path in enumerate(paths):
+            image = cv2.imread(path) if path is not None else None
+            if image is not None:
+                poses[view] = board_pose(target, image, intrinsics[view])
+        if poses[reference_view] is None:
+            continue
+        reference_pose = poses[reference_view][0]
+        for view, pose in enumerate(poses):
+            if pose is not None:
+                # camera -> board -> reference camera
+                relative[view].append(reference_pose @ np.linalg.inv(pose[0]))
+                errors[view].append(pose[1])
+
+    views = {}
+    for view in range(num_views):
+        if not relative[view]:
+            raise RuntimeError(f"View {view} never saw the board together with view {reference_view}")
+        views[str(view)] = {
+            'camera_to_world': average_transforms(relative[view]).tolist(),
+            'snapshots': len(relative[view]),
+            'reprojection_rms_px': float(np.mean(errors[view])),
+        }
+    return {'version': EXTRINSICS_VERSION, 'reference_view': reference_view, 'stream': stream,
+            'target': target.description, 'views': views}
+
+
+def save_extrinsics(root, extrinsics):
+    path = os.path.join(root, EXTRINSICS_FILE)
+    with open(path, 'w') as json_file:
+        json.dump(extrinsics, json_file, indent=2)
+    return path
+
+
+def load_extrinsics(path):
+    """
+    4x4 camera-to-world transform of every view, in view order
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, EXTRINSICS_FILE)
+    with open(path) as json_file:
+        extrinsics = json.load(json_file)
+    if extrinsics.get('version') != EXTRINSICS_VERSION:
+        raise ValueError(f"Unsupported extrinsics version {extrinsics.get('version')} in {path}")
+    views = extrinsics['views']
+    return [np.array(views[view]['camera_to_world'], np.float32) for view in sorted(views, key=int)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Register the cameras of a rig from board snapshots')
+    parser.add_argument('root', help='experiment directory with intrinsic.json and images/viewN snapshots')
+    parser.add_argument('--board', default='checkerboard', choices=['checkerboard', 'charuco'])
+    parser.add_argument('--columns', default=9, type=int, help='inner corners of a checkerboard, squares of a ChArUco board')
+    parser.add_argument('--rows', default=6, type=int)
+    parser.add_argument('--square_size', default=0.025, type=float, help='meters')
+    parser.add_argument('--marker_size', default=0.018, type=float, help='meters, ChArUco only')
+    parser.add_argument('--dictionary', default='DICT_5X5_100', help='ChArUco only')
+    parser.add_argument('--reference_view', default=0, type=int)
+    args = parser.parse_args()
+    if args.board == 'charuco':
+        target = CharucoTarget(args.columns, args.rows, args.square_size, args.marker_size, args.dictionary)
+    else:
+        target = CheckerboardTarget(args.columns, args.rows, args.square_size)
+    extrinsics = calibrate(args.root, target, args.reference_view)
+    for view, info in extrinsics['views'].items():
+        print(f"view{view}: {info['snapshots']} snapshots, {info['reprojection_rms_px']:.2f} px RMS")
+    print(f"Saved {save_extrinsics(args.root, extrinsics)}")
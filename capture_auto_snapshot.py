@@ -1,5 +1,8 @@
-import pyrealsense2 as rs
-import cv2
+try:
+    import pyrealsense2 as rs
+except ImportError:
+    rs = None  # --simulate still works without the SDK
+import sim_realsense
 import os
 import argparse
 import numpy as np
@@ -7,10 +10,31 @@ import time
 
 from collections import defaultdict
 from device_manager import DeviceManager
+from frame_codecs import get_codec
+from frame_writer import FrameIndex, FrameWriter, DROP_POLICIES
+from preview import LivePreview
+from startup import WARMUP_MODES, RigStartup
+from snapshot_service import SnapshotService, start_trigger_server
 def parse_config():
     parser = argparse.ArgumentParser()
     parser.add_argument('--exp_name', default='default')
-    parser.add_argument('--interval', default='4', type=int)
+    parser.add_argument('--simulate', action='store_true', default=False,
+                        help='run against 2 simulated cameras instead of the devices, e.g. on CI')
+    parser.add_argument('--interval', default='4', type=float, help='seconds between the snapshots')
+    parser.add_argument('--color_codec', default='png', help="png[:level], jpeg[:quality], raw, lz4 or zstd[:level]")
+    parser.add_argument('--depth_codec', default='png', help="png[:level], raw, lz4 or zstd[:level]")
+    parser.add_argument('--writer_workers', default=2, type=int, help='0 writes the images inline')
+    parser.add_argument('--writer_queue', default=64, type=int)
+    parser.add_argument('--drop_policy', default='block', choices=DROP_POLICIES)
+    parser.add_argument('--writer_processes', action='store_true', default=False)
+    parser.add_argument('--trigger_port', default=0, type=int,
+                        help='also take a snapshot for every line sent to this local TCP port, 0 disables it')
+    parser.add_argument('--warmup', default='exposure', choices=WARMUP_MODES,
+                        help='discard a fixed number of frames or wait for the auto exposure to settle before capturing')
+    parser.add_argument('--max_warmup_frames', default=300, type=int)
+    parser.add_argument('--no_preview', action='store_true', default=False, help='headless capture without a window')
+    parser.add_argument('--preview_fps', default=10.0, type=float)
+    parser.add_argument('--preview_scale', default=0.25, type=float)
     args = parser.parse_args()
     return args
 
@@ -24,6 +48,14 @@ def capture(root):
     rgb_width = 1920
     rgb_height = 1080
     dispose_frames_for_stablisation = 30  # frames
+    writer = None
+    if args.writer_workers > 0:
+        writer = FrameWriter(args.writer_workers, args.writer_queue, args.drop_policy, args.writer_processes)
+    # frames.jsonl lists the snapshots whose views are all on disk
+    frame_index = FrameIndex(root)
+    preview = None if args.no_preview else LivePreview(args.preview_fps, args.preview_scale)
+    service = None
+    trigger_server = None
     try:
         # Enable the streams from all the intel realsense devices
         first_rs_config = rs.config()
@@ -37,25 +69,43 @@ def capture(root):
         second_rs_config.enable_stream(rs.stream.color, rgb_width, rgb_height, rs.format.bgr8, L515_frame_rate)
 
         # Use the device manager class to enable the devices and get the frames
-        device_manager = DeviceManager(rs.context(), first_rs_config, second_rs_config)
-        device_manager.enable_all_devices()
+        device_manager = DeviceManager(rs.context(), first_rs_config, second_rs_config, writer=writer, backend=rs, frame_index=frame_index, preview=preview,
+                                       color_codec=get_codec(args.color_codec, 'color'), depth_codec=get_codec(args.depth_codec, 'depth'))
+        # Starts, configures and warms up all cameras at once and reports when each one is ready
+        RigStartup(device_manager, args.warmup, dispose_frames_for_stablisation, args.max_warmup_frames).run()
+        # Depth scale, intrinsics and extrinsics of every device, read once from the active stream profiles
+        device_manager.metadata.save(root)
+        # Streams in the background, the timer saves the latest set every interval
+        service = SnapshotService(device_manager, root)
+        service.start()
+        if args.trigger_port > 0:
+            trigger_server = start_trigger_server(service, args.trigger_port)
         print("Start")
-        while True:
-            frames = device_manager.get_frames(root, save=True)
-            time.sleep(args.interval)
-            print("Saved")
+        service.start_timer(args.interval).join()
 
 
     except KeyboardInterrupt:
         print("The program was interupted by the user. Closing the program...")
 
     finally:
+        if trigger_server is not None:
+            trigger_server.shutdown()
+        if service is not None:
+            service.stop()
         device_manager.disable_streams()
-        cv2.destroyAllWindows()
+        if writer is not None:
+            writer.close()
+            print("Writer", writer.stats())
 
 
 if __name__ == "__main__":
     args = parse_config()
+    if args.simulate:
+        # The configs, the manager and the warm-up all take the simulated backend in place of pyrealsense2
+        rs = sim_realsense
+        sim_realsense.set_rig(sim_realsense.SimRig(num_devices=2))
+    elif rs is None:
+        raise SystemExit("pyrealsense2 is not installed, use --simulate to run without cameras")
     exp_name = args.exp_name
     root = f'./{exp_name}'
     if not os.path.exists(root):
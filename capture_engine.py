@@ -0,0 +1,162 @@
+import threading
+
+from frame_buffer import BufferPolicy, FrameBuffer
+from frame_sync import FrameSynchronizer, frameset_timestamp
+
+
+class CaptureEngine:
+    """
+    Per-device capture threads feeding bounded frame buffers
+
+    Every enabled device gets a thread that blocks in pipeline.wait_for_frames and pushes each complete
+    frameset into a FrameBuffer with the device's BufferPolicy. The consumer sleeps until every camera has
+    a frameset, so nothing spins while the devices are between frames.
+
+    Parameters:
+    -----------
+    devices : dict
+              Serial number -> Device, as kept by the device managers
+    buffer_size : int
+                  Number of framesets kept per camera when no buffer policy is given, the oldest one is dropped
+                  when the buffer is full
+    timeout_ms : int
+                 Timeout of a single wait_for_frames call, bounds how long stop() takes
+    sync_tolerance_ms : float or None
+                        Emit only sets whose frameset timestamps lie within this tolerance, see FrameSynchronizer.
+                        None pairs the oldest buffered frameset of every camera
+    metrics : CaptureMetrics or None
+              Count the complete and incomplete framesets of every camera
+    buffer_policies : BufferPolicy, dict or None
+                      For every device or keyed by serial number, see frame_buffer. When synchronizing, the
+                      newest matched set is handed out only if every device keeps the latest frameset
+    """
+    def __init__(self, devices, buffer_size=2, timeout_ms=1000, sync_tolerance_ms=None, metrics=None,
+                 buffer_policies=None):
+        self._devices = dict(devices)
+        self.metrics = metrics
+        self._condition = threading.Condition()
+        self._buffers = {}
+        for serial in self._devices:
+            policy = buffer_policies.get(serial) if isinstance(buffer_policies, dict) else buffer_policies
+            self._buffers[serial] = FrameBuffer(policy if policy is not None else BufferPolicy(buffer_size),
+                                                self._condition)
+        self.synchronizer = None
+        if sync_tolerance_ms is not None:
+            # The synchronizer needs a few frames of history per camera to find partners
+            history = max([buffer.policy.capacity for buffer in self._buffers.values()] + [4])
+            self.synchronizer = FrameSynchronizer(self._devices, sync_tolerance_ms, history)
+        self._keep_latest = all(buffer.policy.mode == 'keep_latest' for buffer in self._buffers.values())
+        self._timeout_ms = timeout_ms
+        self._threads = []
+        self._running = False
+        self.superseded_sets = 0
+        self.errors = {serial: 0 for serial in self._devices}
+
+    @property
+    def dropped(self):
+        return {serial: buffer.dropped for serial, buffer in self._buffers.items()}
+
+    def buffer_stats(self):
+        return {serial: buffer.stats() for serial, buffer in self._buffers.items()}
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for serial, device in self._devices.items():
+            thread = threading.Thread(target=self._run, args=(serial, device), name=f"capture-{serial}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._running = False
+        for buffer in self._buffers.values():
+            buffer.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, serial, device):
+        num_streams = len(device.pipeline_profile.get_streams())
+        buffer = self._buffers[serial]
+        while self._running:
+            try:
+                frameset = device.pipeline.wait_for_frames(self._timeout_ms)
+            except RuntimeError:
+                # Timeout, check whether we are still running and wait again
+                self.errors[serial] += 1
+                continue
+            if frameset.size() != num_streams:
+                if self.metrics is not None:
+                    self.metrics.inc(serial, 'incomplete_framesets')
+                continue
+            if self.metrics is not None:
+                self.metrics.inc(serial, 'frames_polled')
+            # Detach the frames from the pipeline's internal queue while they sit in our buffer
+            frameset.keep()
+            dropped = buffer.dropped
+            # Blocks here under the block policy until the consumer made room
+            buffer.push(frameset)
+            if self.metrics is not None and buffer.dropped > dropped:
+                self.metrics.inc(serial, 'buffer_dropped', buffer.dropped - dropped)
+
+    def get_framesets(self, timeout=None):
+        """
+        Block until every camera has a frameset and pop one of each, or a timestamp-matched set when
+        synchronizing; the oldest one or the newest one as the buffer policies keep
+
+        Return:
+        -----------
+        framesets : dict
+        keys  : serial
+                Serial number of the device
+        values: rs::composite_frame
+                Frameset of the corresponding device
+        """
+        with self._condition:
+            if self.synchronizer is not None:
+                return self._get_synced_framesets(timeout)
+            ready = self._condition.wait_for(
+                lambda: not self._running or all(len(buffer) > 0 for buffer in self._buffers.values()), timeout)
+            if not ready:
+                raise TimeoutError("Not every camera delivered a frameset in time")
+            if not self._running:
+                raise RuntimeError("CaptureEngine is not running")
+            framesets = {}
+            for serial, buffer in self._buffers.items():
+                superseded = buffer.superseded
+                framesets[serial] = buffer.pop()
+                if self.metrics is not None and buffer.superseded > superseded:
+                    self.metrics.inc(serial, 'buffer_superseded', buffer.superseded - superseded)
+            return framesets
+
+    def _get_synced_framesets(self, timeout):
+        matched = None
+
+        def synced():
+            nonlocal matched
+            for serial, buffer in self._buffers.items():
+                # Under the block policy what does not fit into the history waits in the buffer instead of being
+                # dropped from the history
+                limit = self.synchronizer.room(serial) if buffer.policy.drop_policy == 'block' else None
+                for frameset in buffer.drain(limit):
+                    timestamp, domain = frameset_timestamp(frameset)
+                    self.synchronizer.push(serial, timestamp, frameset, domain)
+            matched = self.synchronizer.pop()
+            if self._keep_latest:
+                newer = self.synchronizer.pop() if matched is not None else None
+                while newer is not None:
+                    self.superseded_sets += 1
+                    matched, newer = newer, self.synchronizer.pop()
+            return not self._running or matched is not None
+
+        if not self._condition.wait_for(synced, timeout):
+            raise TimeoutError("No synchronized set of framesets arrived in time")
+        if matched is None:
+            raise RuntimeError("CaptureEngine is not running")
+        return {serial: frameset for serial, (_, frameset) in matched[0].items()}
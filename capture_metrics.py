@@ -0,0 +1,154 @@
+import json
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COUNTERS = {
+    'frames_polled': 'Complete framesets received from the device',
+    'incomplete_framesets': 'Framesets skipped because a stream was missing',
+    'loop_retries': 'Polls of the busy-loop that returned no frameset for the camera',
+    'buffer_dropped': 'Framesets dropped by the capture buffer when it was full',
+    'buffer_superseded': 'Framesets skipped by a keep-latest capture buffer for a newer one',
+    'poll_overwritten': 'Polled framesets replaced by a newer one while the poll loop waited for the other cameras',
+}
+RECORDING_CAMERA = 'recording'  # camera label of the bytes of a raw recording, which holds all cameras
+
+
+class CaptureMetrics:
+    """
+    Per-camera counters and stage timings of the capture loop
+
+    The manager and the capture engine only touch this object when it is given to them, so a disabled
+    instrumentation costs a None check. The writer queue depth and the bytes on disk, per camera, are read from
+    the attached writer, recorder and manager, for the images it wrote inline, whenever a snapshot is taken.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._timings = defaultdict(lambda: defaultdict(lambda: [0, 0.0, 0.0]))  # count, sum, max
+        self.sets = 0
+        self.writer = None
+        self.recorder = None
+        self.manager = None
+
+    def attach(self, writer=None, recorder=None, manager=None):
+        self.writer = writer
+        self.recorder = recorder
+        self.manager = manager
+
+    def inc(self, camera, name, n=1):
+        with self._lock:
+            self._counters[camera][name] += n
+
+    def observe(self, camera, stage, seconds):
+        with self._lock:
+            timing = self._timings[camera][stage]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count_set(self):
+        with self._lock:
+            self.sets += 1
+
+    def snapshot(self):
+        with self._lock:
+            cameras = {}
+            for camera in set(self._counters) | set(self._timings):
+                cameras[camera] = {name: self._counters[camera].get(name, 0) for name in COUNTERS}
+                cameras[camera]['stages'] = {stage: {'count': count, 'sum_s': total, 'max_s': peak}
+                                             for stage, (count, total, peak) in self._timings[camera].items()}
+            snapshot = {'sets': self.sets, 'cameras': cameras}
+        camera_bytes = {}
+        camera_queues = {}
+        if self.writer is not None:
+            writer = self.writer.stats()
+            snapshot['writer'] = writer
+            for camera, counts in writer['cameras'].items():
+                camera_bytes[camera] = counts['bytes_written']
+                camera_queues[camera] = counts['queue_depth']
+        if self.manager is not None:
+            for camera, nbytes in dict(self.manager.camera_inline_bytes).items():
+                camera_bytes[camera] = camera_bytes.get(camera, 0) + nbytes
+        if self.recorder is not None:
+            camera_bytes[RECORDING_CAMERA] = self.recorder.bytes_written
+        for camera, values in cameras.items():
+            values['bytes_written'] = camera_bytes.get(camera, 0)
+            values['writer_queue_depth'] = camera_queues.get(camera, 0)
+        snapshot['camera_bytes_written'] = camera_bytes
+        snapshot['camera_writer_queue_depth'] = camera_queues
+        bytes_written = 0
+        if self.writer is not None:
+            bytes_written += self.writer.bytes_written
+        if self.recorder is not None:
+            bytes_written += self.recorder.bytes_written
+        if self.manager is not None:
+            bytes_written += self.manager.inline_bytes
+        snapshot['bytes_written'] = bytes_written
+        return snapshot
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE capture_sets_total counter', f"capture_sets_total {snapshot['sets']}"]
+        for name, description in COUNTERS.items():
+            lines.append(f'# HELP capture_{name}_total {description}')
+            lines.append(f'# TYPE capture_{name}_total counter')
+            for camera, values in sorted(snapshot['cameras'].items()):
+                lines.append(f'capture_{name}_total{{camera="{camera}"}} {values[name]}')
+        lines.append('# TYPE capture_stage_seconds summary')
+        for camera, values in sorted(snapshot['cameras'].items()):
+            for stage, timing in sorted(values['stages'].items()):
+                labels = f'camera="{camera}",stage="{stage}"'
+                lines.append(f"capture_stage_seconds_count{{{labels}}} {timing['count']}")
+                lines.append(f"capture_stage_seconds_sum{{{labels}}} {timing['sum_s']}")
+        if 'writer' in snapshot:
+            writer = snapshot['writer']
+            lines.append('# TYPE capture_writer_queue_depth gauge')
+            for camera, depth in sorted(snapshot['camera_writer_queue_depth'].items()):
+                lines.append(f'capture_writer_queue_depth{{camera="{camera}"}} {depth}')
+            lines.append('# TYPE capture_writer_dropped_total counter')
+            for camera, counts in sorted(writer['cameras'].items()):
+                lines.append(f'capture_writer_dropped_total{{camera="{camera}"}} {counts["dropped"]}')
+            lines.append('# TYPE capture_writer_errors_total counter')
+            lines.append(f"capture_writer_errors_total {writer['errors']}")
+        # A recording holds all cameras, its bytes are reported under the camera label RECORDING_CAMERA
+        lines.append('# TYPE capture_bytes_written_total counter')
+        for camera, nbytes in sorted(snapshot['camera_bytes_written'].items()):
+            lines.append(f'capture_bytes_written_total{{camera="{camera}"}} {nbytes}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(metrics, port, host='127.0.0.1'):
+    """
+    Serve /metrics (Prometheus text format) and /metrics.json from a daemon thread
+
+    Return:
+    -----------
+    server : ThreadingHTTPServer
+             Call server.shutdown() to stop it
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = metrics.prometheus_text().encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(metrics.snapshot()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    print(f"Serving capture metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
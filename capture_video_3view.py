@@ -1,15 +1,58 @@
-import pyrealsense2 as rs
-import cv2
+try:
+    import pyrealsense2 as rs
+except ImportError:
+    rs = None  # --simulate still works without the SDK
+import sim_realsense
 import os
 import json
-from pynput.keyboard import Listener
+import time
 import argparse
 from view3_manager import View3Manager
+from frame_buffer import BUFFER_PRESETS
+from frame_codecs import get_codec
+from frame_writer import FrameIndex, FrameWriter, DROP_POLICIES
+from preview import LivePreview
+from startup import WARMUP_MODES, RigStartup
+from recording import RecordingWriter
+from recording_session import SegmentedRecorder
+from capture_metrics import CaptureMetrics, start_metrics_server
 
 def parse_config():
     parser = argparse.ArgumentParser()
     parser.add_argument('--exp_name', default='test')
+    parser.add_argument('--simulate', action='store_true', default=False,
+                        help='run against 3 simulated cameras instead of the devices, e.g. on CI')
     parser.add_argument('--no_save', action='store_true', default=False)
+    parser.add_argument('--poll', action='store_true', default=False,
+                        help='use the poll_for_frames busy-loop instead of one capture thread per camera')
+    parser.add_argument('--sync_tolerance_ms', default=16.0, type=float,
+                        help='largest timestamp difference within a multi-view set, 0 disables the matching')
+    parser.add_argument('--buffering', default='default', choices=list(BUFFER_PRESETS),
+                        help="per-camera buffering of the capture engine, 'live' for the lowest latency, "
+                             "'lossless' to apply backpressure instead of dropping frames")
+    parser.add_argument('--format', default='png', choices=['png', 'raw'],
+                        help='raw appends the frames to a memory-mappable recording in <exp_name>/recording')
+    parser.add_argument('--chunk_frames', default=300, type=int, help='frames per file of a raw recording')
+    parser.add_argument('--segment_minutes', default=0, type=float,
+                        help='roll the recording over into a new segment directory after this long, 0 disables segments')
+    parser.add_argument('--segment_gb', default=0, type=float, help='roll over after this many GiB, 0 disables the limit')
+    parser.add_argument('--min_free_gb', default=2.0, type=float, help='segmented recordings stop saving below this free space')
+    parser.add_argument('--color_codec', default='png', help="png[:level], jpeg[:quality], raw, lz4 or zstd[:level]")
+    parser.add_argument('--depth_codec', default='png', help="png[:level], raw, lz4 or zstd[:level]")
+    parser.add_argument('--writer_workers', default=2, type=int, help='0 writes the images inline')
+    parser.add_argument('--writer_queue', default=64, type=int)
+    parser.add_argument('--drop_policy', default='block', choices=DROP_POLICIES)
+    parser.add_argument('--writer_processes', action='store_true', default=False)
+    parser.add_argument('--camera_workers', default=1, type=int,
+                        help='threads aligning and converting the cameras of a set concurrently, 0 for one per camera')
+    parser.add_argument('--warmup', default='exposure', choices=WARMUP_MODES,
+                        help='discard a fixed number of frames or wait for the auto exposure to settle before capturing')
+    parser.add_argument('--max_warmup_frames', default=300, type=int)
+    parser.add_argument('--no_preview', action='store_true', default=False, help='headless capture without a window')
+    parser.add_argument('--preview_fps', default=10.0, type=float)
+    parser.add_argument('--preview_scale', default=0.25, type=float)
+    parser.add_argument('--metrics_port', default=0, type=int,
+                        help='serve live capture metrics in Prometheus format on this port, 0 disables them')
     args = parser.parse_args()
     return args
 
@@ -23,6 +66,25 @@ def capture(root):
     rgb_width = 1920
     rgb_height = 1080
     dispose_frames_for_stablisation = 30  # frames
+    writer = None
+    recorder = None
+    if args.format == 'png' and args.writer_workers > 0:
+        writer = FrameWriter(args.writer_workers, args.writer_queue, args.drop_policy, args.writer_processes)
+    if args.segment_minutes > 0 or args.segment_gb > 0:
+        # Rolls over into segment_NNNNN directories and saves less when the disk falls behind
+        recorder = SegmentedRecorder(root, args.format, args.segment_minutes * 60 or None, int(args.segment_gb * 2**30) or None,
+                                     writer, get_codec(args.color_codec, 'color'), get_codec(args.depth_codec, 'depth'),
+                                     args.chunk_frames, min_free_bytes=int(args.min_free_gb * 2**30))
+    elif args.format == 'raw':
+        recorder = RecordingWriter(os.path.join(root, 'recording'), args.chunk_frames)
+    # frames.jsonl lists the sets whose views are all on disk
+    frame_index = FrameIndex(root) if recorder is None else None
+    preview = None if args.no_preview else LivePreview(args.preview_fps, args.preview_scale)
+    metrics = None
+    metrics_server = None
+    if args.metrics_port > 0:
+        metrics = CaptureMetrics()
+        metrics_server = start_metrics_server(metrics, args.metrics_port)
     try:
         # Enable the streams from all the intel realsense devices
         L515_rs_config = rs.config()
@@ -32,33 +94,57 @@ def capture(root):
 
 
         # Use the device manager class to enable the devices and get the frames
-        device_manager = View3Manager(rs.context(), L515_rs_config, L515_rs_config, L515_rs_config)
-        device_manager.enable_all_devices()
+        device_manager = View3Manager(rs.context(), L515_rs_config, L515_rs_config, L515_rs_config, writer=writer, backend=rs, frame_index=frame_index, preview=preview, recorder=recorder, metrics=metrics, num_workers=args.camera_workers, buffer_policies=BUFFER_PRESETS[args.buffering],
+                                      color_codec=get_codec(args.color_codec, 'color'), depth_codec=get_codec(args.depth_codec, 'depth'))
+        # Starts, configures and warms up all cameras at once and reports when each one is ready
+        RigStartup(device_manager, args.warmup, dispose_frames_for_stablisation, args.max_warmup_frames).run()
+        # Depth scale, intrinsics and extrinsics of every device, read once from the active stream profiles
+        device_manager.metadata.save(root)
+        if not args.poll:
+            device_manager.start_capture_engine(sync_tolerance_ms=args.sync_tolerance_ms or None)
 
-        print("Check the screen")
-
-        for _ in range(300):
-            frames = device_manager.get_frames(root, save=False, no_count=True)
+        # The first synchronized set, the cameras are already warmed up
+        start = time.time()
+        with device_manager.get_frames(root, save=False, no_count=True) as frames:
+            print(f"First set after {time.time() - start:.2f} s")
             if save_intrinsic:
                 intrinsic = device_manager.get_device_intrinsics(frames)
                 with open(os.path.join(root, 'intrinsic.json'), 'w') as json_file:
                     json.dump(intrinsic, json_file)
-                save_intrinsic = False
 
         while True:
-            frames = device_manager.get_frames(root, save=not args.no_save)
+            # Nothing to keep, the device buffers go straight back to the pool
+            device_manager.get_frames(root, save=not args.no_save).release()
 
 
     except KeyboardInterrupt:
         print("The program was interupted by the user. Closing the program...")
 
     finally:
+        engine = device_manager.capture_engine
+        if engine is not None and engine.synchronizer is not None:
+            print("Sync", engine.synchronizer.stats())
+        if engine is not None:
+            print("Buffers", engine.buffer_stats())
         device_manager.disable_streams()
-        cv2.destroyAllWindows()
+        if writer is not None:
+            writer.close()
+            print("Writer", writer.stats())
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.num_frames} frames")
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 
 if __name__ == "__main__":
     args = parse_config()
+    if args.simulate:
+        # The configs, the manager and the warm-up all take the simulated backend in place of pyrealsense2
+        rs = sim_realsense
+        sim_realsense.set_rig(sim_realsense.SimRig(num_devices=3))
+    elif rs is None:
+        raise SystemExit("pyrealsense2 is not installed, use --simulate to run without cameras")
     exp_name = args.exp_name
     root = f'./{exp_name}'
     if not os.path.exists(root):
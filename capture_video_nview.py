@@ -0,0 +1,205 @@
+try:
+    import pyrealsense2 as rs
+except ImportError:
+    rs = None  # --simulate and --replay still work without the SDK
+import os
+import json
+import time
+import argparse
+from functools import partial
+import sim_realsense
+from multi_device_manager import MultiDeviceManager
+from frame_buffer import BUFFER_PRESETS
+from frame_codecs import get_codec
+from frame_writer import FrameIndex, FrameWriter, DROP_POLICIES
+from preview import LivePreview
+from startup import WARMUP_MODES, RigStartup
+from recording import RecordingWriter
+from recording_session import SegmentedRecorder
+from replay import ReplayManager, open_session
+from capture_metrics import CaptureMetrics, start_metrics_server
+from shm_capture import ShmCaptureCoordinator
+from stream_plan import StreamPlan
+
+def parse_config():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exp_name', default='test')
+    parser.add_argument('--no_save', action='store_true', default=False)
+    parser.add_argument('--simulate', default=0, type=int, help='run against this many simulated cameras')
+    parser.add_argument('--replay', default=None,
+                        help='replay a session directory, raw recording or .bag file instead of capturing')
+    parser.add_argument('--replay_realtime', action='store_true', default=False,
+                        help='pace the replay like the original capture instead of running at full speed')
+    parser.add_argument('--poll', action='store_true', default=False,
+                        help='use the poll_for_frames busy-loop instead of one capture thread per camera')
+    parser.add_argument('--sync_tolerance_ms', default=16.0, type=float,
+                        help='largest timestamp difference within a multi-view set, 0 disables the matching')
+    parser.add_argument('--buffering', default='default', choices=list(BUFFER_PRESETS),
+                        help="per-camera buffering of the capture engine, 'live' for the lowest latency, "
+                             "'lossless' to apply backpressure instead of dropping frames")
+    parser.add_argument('--format', default='png', choices=['png', 'raw'],
+                        help='raw appends the frames to a memory-mappable recording in <exp_name>/recording')
+    parser.add_argument('--chunk_frames', default=300, type=int, help='frames per file of a raw recording')
+    parser.add_argument('--segment_minutes', default=0, type=float,
+                        help='roll the recording over into a new segment directory after this long, 0 disables segments')
+    parser.add_argument('--segment_gb', default=0, type=float, help='roll over after this many GiB, 0 disables the limit')
+    parser.add_argument('--min_free_gb', default=2.0, type=float, help='segmented recordings stop saving below this free space')
+    parser.add_argument('--color_codec', default='png', help="png[:level], jpeg[:quality], raw, lz4 or zstd[:level]")
+    parser.add_argument('--depth_codec', default='png', help="png[:level], raw, lz4 or zstd[:level]")
+    parser.add_argument('--writer_workers', default=4, type=int, help='0 writes the images inline')
+    parser.add_argument('--writer_queue', default=64, type=int)
+    parser.add_argument('--drop_policy', default='block', choices=DROP_POLICIES)
+    parser.add_argument('--writer_processes', action='store_true', default=False)
+    parser.add_argument('--camera_workers', default=1, type=int,
+                        help='threads aligning and converting the cameras of a set concurrently, 0 for one per camera')
+    parser.add_argument('--cameras_per_process', default=0, type=int,
+                        help='capture in processes of this many cameras each, handing the frames over in shared memory; 0 captures in this process')
+    parser.add_argument('--streams', default='depth,color',
+                        help="streams to enable with their save rates, e.g. 'depth:30,color:10,infrared:0'; "
+                             "a bare name saves every frame, :0 streams without saving, left out streams are off. "
+                             "Capture processes always stream depth, infrared and color")
+    parser.add_argument('--warmup', default='exposure', choices=WARMUP_MODES,
+                        help='discard a fixed number of frames or wait for the auto exposure to settle before capturing')
+    parser.add_argument('--max_warmup_frames', default=300, type=int)
+    parser.add_argument('--no_preview', action='store_true', default=False, help='headless capture without a window')
+    parser.add_argument('--preview_fps', default=10.0, type=float)
+    parser.add_argument('--preview_scale', default=0.25, type=float)
+    parser.add_argument('--metrics_port', default=0, type=int,
+                        help='serve live capture metrics in Prometheus format on this port, 0 disables them')
+    args = parser.parse_args()
+    return args
+
+# Define some constants
+L515_resolution_width = 1024  # pixels
+L515_resolution_height = 768  # pixels
+L515_frame_rate = 30
+
+rgb_width = 1920
+rgb_height = 1080
+
+dispose_frames_for_stablisation = 30  # frames
+
+
+def make_l515_config(device_serial, backend=rs):
+    # A config of its own for every device lets the manager start all pipelines in parallel
+    L515_rs_config = backend.config()
+    L515_rs_config.enable_stream(backend.stream.depth, L515_resolution_width, L515_resolution_height, backend.format.z16, L515_frame_rate)
+    L515_rs_config.enable_stream(backend.stream.infrared, L515_resolution_width, L515_resolution_height, backend.format.y8, L515_frame_rate)
+    L515_rs_config.enable_stream(backend.stream.color, rgb_width, rgb_height, backend.format.bgr8, L515_frame_rate)
+    return L515_rs_config
+
+
+def stream_profiles():
+    return {'depth': (L515_resolution_width, L515_resolution_height, 'z16', L515_frame_rate),
+            'infrared': (L515_resolution_width, L515_resolution_height, 'y8', L515_frame_rate),
+            'color': (rgb_width, rgb_height, 'bgr8', L515_frame_rate)}
+
+
+def make_view_dirs(root, num_views):
+    for i in range(num_views):
+        os.makedirs(os.path.join(root, 'images', f'view{i}'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'depths', f'view{i}'), exist_ok=True)
+
+
+def capture(root):
+    save_intrinsic = True
+    writer = None
+    recorder = None
+    stream_plan = StreamPlan.parse(args.streams, stream_profiles())
+    if args.format == 'png' and args.writer_workers > 0:
+        writer = FrameWriter(args.writer_workers, args.writer_queue, args.drop_policy, args.writer_processes)
+    if args.segment_minutes > 0 or args.segment_gb > 0:
+        # Rolls over into segment_NNNNN directories and saves less when the disk falls behind
+        recorder = SegmentedRecorder(root, args.format, args.segment_minutes * 60 or None, int(args.segment_gb * 2**30) or None,
+                                     writer, get_codec(args.color_codec, 'color'), get_codec(args.depth_codec, 'depth'),
+                                     args.chunk_frames, min_free_bytes=int(args.min_free_gb * 2**30),
+                                     streams=stream_plan.saved_streams())
+    elif args.format == 'raw':
+        recorder = RecordingWriter(os.path.join(root, 'recording'), args.chunk_frames)
+    # frames.jsonl lists the sets whose views are all on disk
+    frame_index = FrameIndex(root) if recorder is None else None
+    preview = None if args.no_preview else LivePreview(args.preview_fps, args.preview_scale)
+    metrics = None
+    metrics_server = None
+    if args.metrics_port > 0:
+        metrics = CaptureMetrics()
+        metrics_server = start_metrics_server(metrics, args.metrics_port)
+    # Use the device manager class to enable the devices and get the frames
+    backend = rs
+    backend_setup = None
+    if args.simulate > 0:
+        backend = sim_realsense
+        # The capture processes need the same rig, with the same epoch
+        backend_setup = partial(sim_realsense.set_rig, sim_realsense.SimRig(num_devices=args.simulate, fps=L515_frame_rate))
+        backend_setup()
+    if args.replay is not None:
+        device_manager = ReplayManager(open_session(args.replay), realtime=args.replay_realtime, fps=L515_frame_rate,
+                                       writer=writer, frame_index=frame_index, preview=preview, recorder=recorder,
+                                       color_codec=get_codec(args.color_codec, 'color'), depth_codec=get_codec(args.depth_codec, 'depth'))
+    elif args.cameras_per_process > 0:
+        device_manager = ShmCaptureCoordinator(make_l515_config, (rgb_width, rgb_height), args.cameras_per_process,
+                                               backend=backend, backend_setup=backend_setup, sync_tolerance_ms=args.sync_tolerance_ms or None,
+                                               writer=writer, frame_index=frame_index, recorder=recorder,
+                                               color_codec=get_codec(args.color_codec, 'color'), depth_codec=get_codec(args.depth_codec, 'depth'))
+    else:
+        device_manager = MultiDeviceManager(backend.context(), None, stream_plans=stream_plan,
+                                            writer=writer, frame_index=frame_index, preview=preview, recorder=recorder, metrics=metrics, num_workers=args.camera_workers, buffer_policies=BUFFER_PRESETS[args.buffering], backend=backend,
+                                            color_codec=get_codec(args.color_codec, 'color'), depth_codec=get_codec(args.depth_codec, 'depth'))
+    try:
+        if isinstance(device_manager, MultiDeviceManager):
+            # Starts, configures and warms up all cameras at once and reports when each one is ready
+            RigStartup(device_manager, args.warmup, dispose_frames_for_stablisation, args.max_warmup_frames).run()
+        else:
+            device_manager.enable_all_devices()
+        # Depth scale, intrinsics and extrinsics of every device, read once from the active stream profiles
+        device_manager.metadata.save(root)
+        if not isinstance(recorder, SegmentedRecorder):
+            make_view_dirs(root, len(device_manager.enabled_devices))
+        if not args.poll:
+            device_manager.start_capture_engine(sync_tolerance_ms=args.sync_tolerance_ms or None)
+
+        # The first synchronized set, the cameras are already warmed up and a replay needs no stabilisation
+        start = time.time()
+        with device_manager.get_frames(root, save=False, no_count=True) as frames:
+            print(f"First set after {time.time() - start:.2f} s")
+            if save_intrinsic:
+                intrinsic = device_manager.get_device_intrinsics(frames)
+                with open(os.path.join(root, 'intrinsic.json'), 'w') as json_file:
+                    json.dump(intrinsic, json_file)
+        if args.replay is not None:
+            device_manager.seek(0)
+
+        print("Recording start")
+        while True:
+            # Nothing to keep, the device buffers go straight back to the pool
+            device_manager.get_frames(root, save=not args.no_save).release()
+
+    except KeyboardInterrupt:
+        print("The program was interupted by the user. Closing the program...")
+
+    except EOFError:
+        print("The replay has ended")
+
+    finally:
+        engine = device_manager.capture_engine
+        if engine is not None and engine.synchronizer is not None:
+            print("Sync", engine.synchronizer.stats())
+        if engine is not None:
+            print("Buffers", engine.buffer_stats())
+        device_manager.disable_streams()
+        if writer is not None:
+            writer.close()
+            print("Writer", writer.stats())
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.num_frames} frames")
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+if __name__ == "__main__":
+    args = parse_config()
+    exp_name = args.exp_name
+    root = f'./{exp_name}'
+    os.makedirs(root, exist_ok=True)
+    capture(root)
@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+
+UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def legacy_convert(raw, depth_scale):
+    # The conversion get_frames used to do, kept as the reference for benchmarks and checks
+    depth = np.array(raw, dtype=np.float32)*depth_scale
+    return np.array(depth, np.uint16)
+
+
+class DepthConverter:
+    """
+    Scale raw z16 depth into uint16 millimeters without temporary arrays
+
+    An integer scale is applied with an integer multiply and a scale of 1/2^k with a right shift,
+    both of which give exactly the truncated float result. Any other scale goes through one
+    preallocated float32 scratch buffer.
+
+    Depths beyond the uint16 range saturate at 65535 mm. The float path clips before narrowing, and a frame
+    whose largest raw value would overflow the integer multiply is converted through the float path, so the
+    result never wraps around. legacy_convert leaves such values to the platform's float to int cast.
+
+    Parameters:
+    -----------
+    depth_scale : float
+                  Millimeters per depth unit
+    num_buffers : int
+                  Number of output buffers used in rotation when convert() is called without out
+    """
+    def __init__(self, depth_scale, num_buffers=2):
+        self.depth_scale = depth_scale
+        self.num_buffers = num_buffers
+        self._buffers = []
+        self._next_buffer = 0
+        self._scratch = None
+        self._multiplier = None
+        self._max_raw = None
+        self._shift = None
+        # The sensors report the scale as float32 (0.00025 m is not exact), the legacy path multiplies in float32 too
+        scale = float(np.float32(depth_scale))
+        if scale >= 1 and scale.is_integer():
+            self._multiplier = int(scale)
+            self._max_raw = UINT16_MAX // self._multiplier  # larger raw values overflow the multiply
+        else:
+            exponent = -math.log2(scale) if scale > 0 else 0
+            if exponent > 0 and float(exponent).is_integer():
+                self._shift = int(exponent)
+
+    @property
+    def mode(self):
+        if self._multiplier is not None:
+            return 'copy' if self._multiplier == 1 else 'multiply'
+        return 'shift' if self._shift is not None else 'float'
+
+    def _output_buffer(self, shape):
+        if not self._buffers or self._buffers[0].shape != shape:
+            self._buffers = [np.empty(shape, np.uint16) for _ in range(self.num_buffers)]
+            self._next_buffer = 0
+        out = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % self.num_buffers
+        return out
+
+    def convert(self, raw, out=None):
+        """
+        Parameters:
+        -----------
+        raw : np.ndarray of uint16
+              Depth in device units, e.g. np.asanyarray(depth_frame.get_data())
+        out : np.ndarray of uint16 or None
+              Destination, a rotating preallocated buffer is used when omitted. Those buffers are
+              overwritten num_buffers calls later, pass out when the result has to outlive that.
+
+        Return:
+        -----------
+        depth : np.ndarray of uint16
+        """
+        if out is None:
+            out = self._output_buffer(raw.shape)
+        if self._multiplier == 1:
+            np.copyto(out, raw)
+        elif self._multiplier is not None and raw.max(initial=0) <= self._max_raw:
+            np.multiply(raw, self._multiplier, out=out, casting='unsafe')
+        elif self._shift is not None:
+            np.right_shift(raw, self._shift, out=out)
+        else:
+            if self._scratch is None or self._scratch.shape != raw.shape:
+                self._scratch = np.empty(raw.shape, np.float32)
+            np.multiply(raw, np.float32(self.depth_scale), out=self._scratch)
+            np.minimum(self._scratch, UINT16_MAX, out=self._scratch)
+            np.copyto(out, self._scratch, casting='unsafe')
+        return out
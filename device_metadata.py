@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+
+METADATA_VERSION = 1
+METADATA_FILE = 'device_metadata.json'
+
+
+def profile_key(profile):
+    """
+    Name of a stream profile, e.g. 'stream.color_0_1920x1080_format.bgr8_30'
+    """
+    return (f'{profile.stream_type()}_{profile.stream_index()}_{profile.width()}x{profile.height()}_'
+            f'{profile.format()}_{profile.fps()}')
+
+
+def intrinsics_to_dict(intrinsics):
+    # Same fields as the intrinsic.json the capture scripts have always written
+    return {
+        'coeffs': list(intrinsics.coeffs),
+        'fx': intrinsics.fx,
+        'fy': intrinsics.fy,
+        'height': intrinsics.height,
+        'width': intrinsics.width,
+        'cx': intrinsics.ppx,
+        'cy': intrinsics.ppy,
+    }
+
+
+class DeviceMetadata:
+    """
+    Calibration data of one device, read once from its active stream profiles
+
+    Parameters:
+    -----------
+    serial : str
+    product_line : str
+    view : int
+           Position of the device in the enabled views
+    depth_scale : float
+                  Millimeters per depth unit
+    streams : dict
+              profile_key -> {'stream', 'index', 'width', 'height', 'format', 'fps', 'intrinsics'}
+    depth_to_color : dict or None
+                     {'rotation': 9 floats, 'translation': 3 floats} in meters
+    """
+    def __init__(self, serial, product_line, view, depth_scale, streams, depth_to_color=None):
+        self.serial = serial
+        self.product_line = product_line
+        self.view = view
+        self.depth_scale = depth_scale
+        self.streams = streams
+        self.depth_to_color = depth_to_color
+
+    @classmethod
+    def from_pipeline_profile(cls, serial, product_line, view, pipeline_profile, depth_scale):
+        streams = {}
+        depth_profile = color_profile = None
+        for stream_profile in pipeline_profile.get_streams():
+            profile = stream_profile.as_video_stream_profile()
+            streams[profile_key(profile)] = {
+                'stream': str(profile.stream_type()),
+                'index': profile.stream_index(),
+                'width': profile.width(),
+                'height': profile.height(),
+                'format': str(profile.format()),
+                'fps': profile.fps(),
+                'intrinsics': intrinsics_to_dict(profile.get_intrinsics()),
+            }
+            if str(profile.stream_type()) == 'stream.depth':
+                depth_profile = profile
+            elif str(profile.stream_type()) == 'stream.color':
+                color_profile = profile
+        depth_to_color = None
+        if depth_profile is not None and color_profile is not None:
+            extrinsics = depth_profile.get_extrinsics_to(color_profile)
+            depth_to_color = {'rotation': list(extrinsics.rotation), 'translation': list(extrinsics.translation)}
+        return cls(serial, product_line, view, depth_scale, streams, depth_to_color)
+
+    def intrinsics(self, stream):
+        """
+        Intrinsics dict of the first profile of a stream, e.g. 'stream.color'
+        """
+        for info in self.streams.values():
+            if info['stream'] == stream:
+                return info['intrinsics']
+        raise KeyError(f"Device {self.serial} has no {stream} profile")
+
+    def to_dict(self):
+        return {'serial': self.serial, 'product_line': self.product_line, 'view': self.view,
+                'depth_scale': self.depth_scale, 'streams': self.streams, 'depth_to_color': self.depth_to_color}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['serial'], data['product_line'], data['view'], data['depth_scale'], data['streams'],
+                   data.get('depth_to_color'))
+
+
+class MetadataCache:
+    """
+    DeviceMetadata of every enabled device keyed by serial number
+
+    Filled by MultiDeviceManager.enable_device, saved once per recording and loadable without hardware.
+    """
+    def __init__(self, devices=None):
+        self._devices = dict(devices or {})
+        self._lock = threading.Lock()
+
+    def add(self, metadata):
+        with self._lock:
+            self._devices[metadata.serial] = metadata
+
+    def clear(self):
+        with self._lock:
+            self._devices = {}
+
+    def __getitem__(self, serial):
+        return self._devices[serial]
+
+    def __contains__(self, serial):
+        return serial in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    def views(self):
+        """
+        DeviceMetadata in view order
+        """
+        return sorted(self._devices.values(), key=lambda metadata: metadata.view)
+
+    def view_intrinsics(self, stream):
+        return [metadata.intrinsics(stream) for metadata in self.views()]
+
+    def to_dict(self):
+        return {'version': METADATA_VERSION,
+                'devices': {metadata.serial: metadata.to_dict() for metadata in self.views()}}
+
+    def save(self, root):
+        path = os.path.join(root, METADATA_FILE)
+        with open(path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+        return path
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != METADATA_VERSION:
+            raise ValueError(f"Unsupported device metadata version {data.get('version')}")
+        return cls({serial: DeviceMetadata.from_dict(device) for serial, device in data['devices'].items()})
+
+    @classmethod
+    def load(cls, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, METADATA_FILE)
+        with open(path) as json_file:
+            return cls.from_dict(json.load(json_file))
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+
+from frame_writer import DROP_POLICIES
+
+BUFFER_MODES = ('keep_all', 'keep_latest')
+
+
+class BufferPolicy:
+    """
+    How the frames of one device are buffered between its capture thread and the consumer
+
+    Parameters:
+    -----------
+    capacity : int
+               Framesets held per device
+    mode : str
+           'keep_all' hands out every buffered frameset in order, 'keep_latest' hands out the newest one and
+           skips the older ones
+    drop_policy : str
+                  What happens to a frameset arriving at a full buffer, see frame_writer.DROP_POLICIES: 'block'
+                  holds the capture thread until there is room (the frames then queue up in librealsense),
+                  'drop_newest' discards the arriving frameset and 'drop_oldest' the oldest buffered one
+    frames_queue_size : int or None
+                        Size of the internal librealsense frame queue of every sensor, left at its default when None
+    """
+    def __init__(self, capacity=2, mode='keep_all', drop_policy='drop_oldest', frames_queue_size=None):
+        if mode not in BUFFER_MODES:
+            raise ValueError(f"mode must be one of {BUFFER_MODES}, got {mode}")
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy}")
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.mode = mode
+        self.drop_policy = drop_policy
+        self.frames_queue_size = frames_queue_size
+
+    def describe(self):
+        return {'capacity': self.capacity, 'mode': self.mode, 'drop_policy': self.drop_policy,
+                'frames_queue_size': self.frames_queue_size}
+
+
+# Live tracking wants the newest set with the least delay, a dataset wants every frame
+BUFFER_PRESETS = {
+    'default': BufferPolicy(),
+    'live': BufferPolicy(1, 'keep_latest', 'drop_oldest', frames_queue_size=1),
+    'lossless': BufferPolicy(30, 'keep_all', 'block', frames_queue_size=32),
+}
+
+
+class FrameBuffer:
+    """
+    Bounded buffer of one device's framesets with a BufferPolicy and drop counters
+
+    Safe to use from the capture thread and the consumer. The engine passes its own condition so that
+    its consumer wakes up on every push; pass None for a buffer used on its own.
+
+    Parameters:
+    -----------
+    policy : BufferPolicy
+    condition : threading.Condition or None
+    """
+    def __init__(self, policy=None, condition=None):
+        self.policy = policy if policy is not None else BufferPolicy()
+        self._condition = condition if condition is not None else threading.Condition()
+        self._items = deque()
+        self._closed = False
+        self.pushed = 0
+        self.delivered = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.superseded = 0
+        self.blocked_s = 0.0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    def push(self, item, timeout=None):
+        """
+        Add a frameset as the policy demands
+
+        Return:
+        -----------
+        accepted : bool
+                   False if the frameset was dropped, or the buffer was closed while blocking
+        """
+        policy = self.policy
+        with self._condition:
+            self.pushed += 1
+            if len(self._items) >= policy.capacity:
+                if policy.drop_policy == 'drop_newest':
+                    self.dropped_newest += 1
+                    return False
+                if policy.drop_policy == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped_oldest += 1
+                else:
+                    start = time.perf_counter()
+                    room = self._condition.wait_for(
+                        lambda: self._closed or len(self._items) < policy.capacity, timeout)
+                    self.blocked_s += time.perf_counter() - start
+                    if not room or self._closed:
+                        self.dropped_newest += 1
+                        return False
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._condition.notify_all()
+            return True
+
+    def pop(self):
+        """
+        Oldest frameset, or the newest one in keep_latest mode, None when the buffer is empty
+        """
+        with self._condition:
+            if not self._items:
+                return None
+            if self.policy.mode == 'keep_latest':
+                self.superseded += len(self._items) - 1
+                item = self._items.pop()
+                self._items.clear()
+            else:
+                item = self._items.popleft()
+            self.delivered += 1
+            self._condition.notify_all()
+            return item
+
+    def drain(self, limit=None):
+        """
+        The buffered framesets in arrival order, at most limit of them, e.g. to feed them into a synchronizer
+        """
+        with self._condition:
+            count = len(self._items) if limit is None else min(limit, len(self._items))
+            items = [self._items.popleft() for _ in range(count)]
+            self.delivered += len(items)
+            self._condition.notify_all()
+            return items
+
+    def close(self):
+        # Releases a capture thread blocked in push
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        return {'depth': len(self._items), 'max_depth': self.max_depth, 'pushed': self.pushed,
+                'delivered': self.delivered, 'dropped_oldest': self.dropped_oldest,
+                'dropped_newest': self.dropped_newest, 'superseded': self.superseded, 'blocked_s': self.blocked_s}
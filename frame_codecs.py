@@ -0,0 +1,179 @@
+import io
+
+import cv2
+import numpy as np
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _npy_bytes(image):
+    buffer = io.BytesIO()
+    np.save(buffer, image, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _from_npy_bytes(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class PngCodec:
+    """
+    Lossless PNG for color and z16 depth, level 0 (fastest) to 9 (smallest)
+    """
+    name = 'png'
+    extension = '.png'
+    streams = ('color', 'depth')
+    parameter = 'level'
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def encode(self, image):
+        params = [] if self.level is None else [cv2.IMWRITE_PNG_COMPRESSION, int(self.level)]
+        ok, data = cv2.imencode(self.extension, image, params)
+        if not ok:
+            raise IOError("PNG encoding failed")
+        return data
+
+    def decode(self, data):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class JpegCodec:
+    """
+    Lossy JPEG for 8 bit color, quality 0 to 100
+    """
+    name = 'jpeg'
+    extension = '.jpg'
+    streams = ('color',)
+    parameter = 'quality'
+
+    def __init__(self, quality=95):
+        self.quality = quality
+
+    def encode(self, image):
+        ok, data = cv2.imencode(self.extension, image, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        if not ok:
+            raise IOError("JPEG encoding failed")
+        return data
+
+    def decode(self, data):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class RawCodec:
+    """
+    Uncompressed .npy, the fastest option when the disk keeps up
+    """
+    name = 'raw'
+    extension = '.npy'
+    streams = ('color', 'depth')
+    parameter = None
+
+    def encode(self, image):
+        return _npy_bytes(image)
+
+    def decode(self, data):
+        return _from_npy_bytes(data)
+
+
+class Lz4Codec:
+    """
+    .npy compressed with LZ4 frames, needs the lz4 package
+    """
+    name = 'lz4'
+    extension = '.npy.lz4'
+    streams = ('color', 'depth')
+    parameter = 'level'
+
+    def __init__(self, level=0):
+        if lz4 is None:
+            raise ImportError("The lz4 codec needs the lz4 package: pip install lz4")
+        self.level = level
+
+    def encode(self, image):
+        return lz4.frame.compress(_npy_bytes(image), compression_level=int(self.level))
+
+    def decode(self, data):
+        return _from_npy_bytes(lz4.frame.decompress(data))
+
+
+class ZstdCodec:
+    """
+    .npy compressed with Zstandard, needs the zstandard package
+    """
+    name = 'zstd'
+    extension = '.npy.zst'
+    streams = ('color', 'depth')
+    parameter = 'level'
+
+    def __init__(self, level=1):
+        if zstandard is None:
+            raise ImportError("The zstd codec needs the zstandard package: pip install zstandard")
+        self.level = level
+
+    def encode(self, image):
+        return zstandard.ZstdCompressor(level=int(self.level)).compress(_npy_bytes(image))
+
+    def decode(self, data):
+        return _from_npy_bytes(zstandard.ZstdDecompressor().decompress(data))
+
+
+CODECS = {codec.name: codec for codec in (PngCodec, JpegCodec, RawCodec, Lz4Codec, ZstdCodec)}
+
+
+def get_codec(spec, stream=None):
+    """
+    Build a codec from a 'name' or 'name:parameter' string, e.g. 'png:1', 'jpeg:90', 'zstd:3', 'raw'
+
+    Parameters:
+    -----------
+    spec : str
+    stream : str or None
+             'color' or 'depth', raises ValueError if the codec cannot store that stream
+
+    The parameter is the codec's parameter attribute, e.g. the PNG level or the JPEG quality; a parameter for a
+    codec without one, such as 'raw:1', raises ValueError.
+    """
+    name, _, parameter = spec.partition(':')
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name}, choose one of {list(CODECS)}")
+    codec_class = CODECS[name]
+    if stream is not None and stream not in codec_class.streams:
+        raise ValueError(f"The {name} codec cannot store {stream} frames")
+    if not parameter:
+        return codec_class()
+    if codec_class.parameter is None:
+        raise ValueError(f"The {name} codec takes no parameter, got {spec}")
+    try:
+        value = int(parameter)
+    except ValueError:
+        raise ValueError(f"The {codec_class.parameter} of the {name} codec must be an integer, "
+                         f"got {parameter}") from None
+    return codec_class(value)
+
+
+def codec_for_path(path):
+    """
+    Codec of a saved frame, picked by the longest matching file extension
+    """
+    matches = [codec_class for codec_class in CODECS.values() if path.endswith(codec_class.extension)]
+    if not matches:
+        raise ValueError(f"No codec writes files like {path}")
+    return max(matches, key=lambda codec_class: len(codec_class.extension))()
+
+
+def read_image(path):
+    """
+    Read a frame written with any of the codecs
+    """
+    with open(path, 'rb') as image_file:
+        return codec_for_path(path).decode(image_file.read())
@@ -0,0 +1,166 @@
+import random
+import sys
+from collections import deque
+
+
+def frameset_timestamp(frameset):
+    """
+    Timestamp of a frameset in milliseconds together with its time domain.
+    Only timestamps in the global (host correlated) time domain are comparable across devices.
+    """
+    return frameset.get_timestamp(), str(frameset.get_frame_timestamp_domain())
+
+
+class FrameSynchronizer:
+    """
+    Match framesets of several cameras by timestamp
+
+    Each view keeps a short history ordered by arrival. A tuple is emitted only when the oldest
+    entries of all views lie within tolerance_ms of each other; an entry that is too old to be
+    matched with any later entry of the other views is dropped.
+
+    Parameters:
+    -----------
+    views : list
+            Keys of the views, e.g. serial numbers
+    tolerance_ms : float
+                   Largest allowed difference between the earliest and latest timestamp of a tuple
+    history : int
+              Number of entries kept per view, the oldest one is dropped when the history is full
+    """
+    def __init__(self, views, tolerance_ms=16.0, history=8):
+        self.views = list(views)
+        self.tolerance_ms = tolerance_ms
+        self._history = {view: deque(maxlen=history) for view in self.views}
+        self.domains = {}
+        self.dropped = {view: 0 for view in self.views}
+        self.matched = 0
+        self.max_skew_ms = 0.0
+        self.last_skew_ms = None
+
+    def push(self, view, timestamp, item=None, domain=None):
+        history = self._history[view]
+        if history and timestamp <= history[-1][0]:
+            # Out of order or repeated frame, it can never be matched reliably
+            self.dropped[view] += 1
+            return
+        if domain is not None:
+            if self.domains.get(view, domain) != domain:
+                print(f"View {view} changed its timestamp domain from {self.domains[view]} to {domain}")
+            self.domains[view] = domain
+        if len(history) == history.maxlen:
+            self.dropped[view] += 1
+        history.append((timestamp, item))
+
+    def room(self, view):
+        """
+        Entries the view can take before its oldest one is dropped
+        """
+        history = self._history[view]
+        return history.maxlen - len(history)
+
+    def pop(self):
+        """
+        Return the oldest matched tuple or None
+
+        Return:
+        -----------
+        matched : dict or None
+        keys  : view
+        values: (timestamp, item)
+        skew_ms : float
+                  Difference between the latest and earliest timestamp of the tuple
+        """
+        while all(self._history[view] for view in self.views):
+            heads = {view: self._history[view][0][0] for view in self.views}
+            oldest = min(heads, key=heads.get)
+            skew = max(heads.values()) - heads[oldest]
+            if skew <= self.tolerance_ms:
+                matched = {view: self._history[view].popleft() for view in self.views}
+                self.matched += 1
+                self.last_skew_ms = skew
+                self.max_skew_ms = max(self.max_skew_ms, skew)
+                return matched, skew
+            # Every other view only gets later from here on, the oldest head has no partner anymore
+            self._history[oldest].popleft()
+            self.dropped[oldest] += 1
+        return None
+
+    def stats(self):
+        return {
+            'matched': self.matched,
+            'dropped': dict(self.dropped),
+            'last_skew_ms': self.last_skew_ms,
+            'max_skew_ms': self.max_skew_ms,
+            'domains': dict(self.domains),
+        }
+
+
+def simulate_streams(num_views, num_frames, fps=30.0, jitter_ms=2.0, drop_rate=0.05, max_offset_ms=4.0, seed=0):
+    """
+    Synthetic timestamp streams of free running cameras for exercising FrameSynchronizer
+
+    Every view has a constant phase offset, per-frame gaussian jitter and randomly dropped frames.
+    Return the (view, timestamp, frame_number) events sorted by timestamp, i.e. in arrival order.
+    """
+    rng = random.Random(seed)
+    period = 1000.0 / fps
+    events = []
+    for view in range(num_views):
+        offset = rng.uniform(0, max_offset_ms)
+        for n in range(num_frames):
+            if rng.random() < drop_rate:
+                continue
+            events.append((view, n * period + offset + rng.gauss(0, jitter_ms), n))
+    events.sort(key=lambda event: event[1])
+    return events
+
+
+def run_harness(num_views=3, num_frames=3000, tolerance_ms=8.0, seed=0, max_mismatched=0, **stream_kwargs):
+    """
+    Feed simulated streams through a FrameSynchronizer and check every emitted tuple
+
+    Raises AssertionError, also under python -O, when a tuple exceeds the tolerance, a view goes backwards or
+    repeats a frame, or more than max_mismatched tuples pair different frame numbers.
+    """
+    synchronizer = FrameSynchronizer(range(num_views), tolerance_ms)
+    emitted = []
+    for view, timestamp, n in simulate_streams(num_views, num_frames, seed=seed, **stream_kwargs):
+        synchronizer.push(view, timestamp, n)
+        result = synchronizer.pop()
+        while result is not None:
+            emitted.append(result)
+            result = synchronizer.pop()
+
+    for matched, skew in emitted:
+        timestamps = [timestamp for timestamp, _ in matched.values()]
+        if skew > tolerance_ms:
+            raise AssertionError(f"Skew {skew} ms exceeds the tolerance of {tolerance_ms} ms")
+        if abs(max(timestamps) - min(timestamps) - skew) >= 1e-9:
+            raise AssertionError(f"Reported skew {skew} ms does not match the timestamps {timestamps}")
+    frame_numbers = [[n for _, n in matched.values()] for matched, _ in emitted]
+    mismatched = sum(len(set(numbers)) > 1 for numbers in frame_numbers)
+    if mismatched > max_mismatched:
+        raise AssertionError(f"{mismatched} tuples pair different frame numbers, at most {max_mismatched} allowed")
+    for view in range(num_views):
+        sequence = [matched[view][1] for matched, _ in emitted]
+        if sequence != sorted(sequence) or len(set(sequence)) != len(sequence):
+            raise AssertionError(f"The frames of view {view} were emitted out of order or twice")
+    return {
+        'emitted': len(emitted),
+        'mismatched_frame_numbers': mismatched,
+        'stats': synchronizer.stats(),
+    }
+
+
+if __name__ == "__main__":
+    failed = False
+    for jitter_ms, drop_rate in [(0.0, 0.0), (1.0, 0.02), (3.0, 0.1)]:
+        try:
+            result = run_harness(jitter_ms=jitter_ms, drop_rate=drop_rate)
+        except AssertionError as e:
+            print(f"jitter {jitter_ms} ms, drop rate {drop_rate}: FAILED, {e}")
+            failed = True
+            continue
+        print(f"jitter {jitter_ms} ms, drop rate {drop_rate}: {result}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,409 @@
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import cv2
+
+from profiling import null_measure
+
+DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+FRAME_INDEX_FILE = 'frames.jsonl'
+
+
+def write_atomic(path, data):
+    """
+    Write data next to path under a hidden temporary name and rename it into place
+
+    A reader, or a crash, never sees a partly written file under the final name. The data is synced to disk
+    before the rename; the rename itself survives a power loss once the directory is synced, see fsync_directory.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f'.{name}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def fsync_directory(directory):
+    # Makes the renames and new files in the directory durable; directories cannot be opened on Windows
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_images(items, profiler=None):
+    # Top-level function so that it can be pickled into a process pool
+    measure = profiler.measure if profiler is not None else null_measure
+    nbytes = 0
+    for item in items:
+        # (path, image) is encoded by cv2 for the path's extension, (path, image, codec) with the codec's encoder
+        path, image = item[0], item[1]
+        codec = item[2] if len(item) > 2 else None
+        with measure('encode'):
+            if codec is None:
+                ok, data = cv2.imencode(os.path.splitext(path)[1], image)
+                if not ok:
+                    raise IOError(f"cv2.imencode failed for {path}")
+            else:
+                data = codec.encode(image)
+        with measure('write'):
+            write_atomic(path, data)
+        nbytes += len(data)
+    return nbytes
+
+
+class FrameIndex:
+    """
+    Append-only index of the saved sets, root/frames.jsonl
+
+    A set is committed, as one JSON line with its frame number, timestamps and files, only once every view of
+    it is on disk, and the sets are committed in the order they were saved. A set with a failed or dropped
+    view is left out, so every listed file exists and is complete. The files are synced by write_atomic, their
+    directories and the index before a line is counted as committed, so this also holds after a power loss.
+    """
+    def __init__(self, root, name=FRAME_INDEX_FILE):
+        self.path = os.path.join(root, name)
+        self.root = root
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # set id -> [views left, failed, entry, directories]
+        self._next_id = 0
+        self.committed = 0
+        self.failed = 0
+
+    def open_set(self, frame_number, timestamps, paths, num_parts):
+        """
+        Register a set whose num_parts jobs report to part_done with the returned set id
+
+        The id tells the sets apart, frame numbers may repeat, e.g. for no_count sets or after a counter reset.
+        """
+        entry = {'frame': frame_number, 'timestamps': list(timestamps) if timestamps is not None else None,
+                 'files': [os.path.relpath(path, self.root) for path in paths]}
+        directories = {os.path.dirname(os.path.abspath(path)) for path in paths}
+        with self._lock:
+            set_id = self._next_id
+            self._next_id += 1
+            self._pending[set_id] = [num_parts, False, entry, directories]
+        if num_parts == 0:
+            self._commit_ready()
+        return set_id
+
+    def part_done(self, set_id, ok=True):
+        with self._lock:
+            pending = self._pending[set_id]
+            pending[0] -= 1
+            pending[1] |= not ok
+        self._commit_ready()
+
+    def add(self, frame_number, timestamps, paths):
+        """
+        Commit a set whose views were all written already
+        """
+        self.open_set(frame_number, timestamps, paths, 0)
+
+    def _commit_ready(self):
+        with self._lock:
+            lines = []
+            directories = set()
+            while self._pending:
+                set_id, (parts, failed, entry, set_directories) = next(iter(self._pending.items()))
+                if parts > 0:
+                    break
+                del self._pending[set_id]
+                if failed:
+                    self.failed += 1
+                else:
+                    lines.append(json.dumps(entry) + '\n')
+                    directories |= set_directories
+                    self.committed += 1
+            if lines:
+                # The renames of the listed files must be on disk before the lines that list them
+                for directory in sorted(directories):
+                    fsync_directory(directory)
+                created = not os.path.exists(self.path)
+                with open(self.path, 'a') as index_file:
+                    index_file.writelines(lines)
+                    index_file.flush()
+                    os.fsync(index_file.fileno())
+                if created:
+                    fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+
+def read_frame_index(root, name=FRAME_INDEX_FILE):
+    """
+    Entries of a FrameIndex, [] when the session has none
+    """
+    path = os.path.join(root, name)
+    if not os.path.exists(path):
+        return []
+    with open(path) as index_file:
+        return [json.loads(line) for line in index_file if line.endswith('\n')]
+
+
+def view_items(root, frame_number, view, color, depth, color_codec, depth_codec, copy_color=False):
+    """
+    (path, image, codec) items of one view in the images/viewN, depths/viewN layout, None images are skipped
+    """
+    items = []
+    if color is not None:
+        items.append((os.path.join(root, f'images/view{view}/{frame_number}_img{color_codec.extension}'),
+                      color.copy() if copy_color else color, color_codec))
+    if depth is not None:
+        items.append((os.path.join(root, f'depths/view{view}/{frame_number}_depth{depth_codec.extension}'),
+                      depth, depth_codec))
+    return items
+
+
+def save_views(root, frame_number, colors, depths, timestamps, writer=None, recorder=None, color_codec=None,
+               depth_codec=None, profiler=None, index=None, executor=None, cameras=None, on_written=None):
+    """
+    Save one multi-view set to a recording or in the images/viewN, depths/viewN layout
+
+    Parameters:
+    -----------
+    colors, depths : list of np.ndarray
+                     Color and depth image of every view, None for a stream not saved with this set
+    writer : FrameWriter or None
+             Queue the images instead of writing them inline
+    recorder : RecordingWriter or None
+               Append the set to a raw recording instead of writing images
+    color_codec, depth_codec : codec
+                               frame_codecs codecs of the images
+    index : FrameIndex or None
+            Commit the set to the frame index once all its views are on disk
+    executor : concurrent.futures.Executor or None
+               Encode and write the views concurrently when writing inline; a writer gets one job per view
+    cameras : list of str or None
+              Camera label of every view, the writer counts its jobs per camera
+    on_written : callable or None
+                 Called with (view, nbytes) for every view written inline
+
+    Return:
+    -----------
+    nbytes : int
+             Bytes written inline, 0 when the set was queued or recorded
+    """
+    measure = profiler.measure if profiler is not None else null_measure
+    if recorder is not None:
+        with measure('write'):
+            recorder.write(frame_number, [{'color': rgb, 'depth': depth} for rgb, depth in zip(colors, depths)],
+                           timestamps)
+        return 0
+    views = []
+    view_numbers = []
+    for i in range(len(colors)):
+        # The color array is a view on the librealsense frame; copy it so a deep writer queue
+        # does not hold frames back from the device's frame pool
+        items = view_items(root, frame_number, i, colors[i], depths[i], color_codec, depth_codec, writer is not None)
+        if items:
+            views.append(items)
+            view_numbers.append(i)
+    paths = [item[0] for items in views for item in items]
+    if writer is not None:
+        on_done = None
+        if index is not None:
+            set_id = index.open_set(frame_number, timestamps, paths, len(views))
+            on_done = partial(index.part_done, set_id)
+        with measure('queue'):
+            for view, items in zip(view_numbers, views):
+                writer.submit(items, on_done, cameras[view] if cameras is not None else None)
+        return 0
+    if executor is not None and len(views) > 1:
+        view_bytes = list(executor.map(lambda items: write_images(items, profiler), views))
+    else:
+        view_bytes = [write_images(items, profiler) for items in views]
+    if on_written is not None:
+        for view, nbytes in zip(view_numbers, view_bytes):
+            on_written(view, nbytes)
+    if index is not None:
+        index.add(frame_number, timestamps, paths)
+    return sum(view_bytes)
+
+
+class FrameWriter:
+    """
+    Background stage that encodes and writes frames off the capture thread.
+
+    A bounded queue feeds a pool of worker threads. With use_processes=True each worker hands its
+    job to a process pool, so the PNG compression runs outside the capturing interpreter.
+
+    Parameters:
+    -----------
+    num_workers : int
+                  Number of jobs that are encoded concurrently
+    max_queue_size : int
+                     Number of jobs that may wait in the queue; save_views queues one job per view
+    drop_policy : str
+                  'block' applies backpressure to the caller when the queue is full,
+                  'drop_newest' discards the incoming frame and 'drop_oldest' discards the oldest queued frame
+    use_processes : bool
+                    Encode in a process pool instead of the worker threads
+    profiler : StageProfiler or None
+               Records the encode and write time of every image, not available with use_processes
+    """
+    def __init__(self, num_workers=2, max_queue_size=64, drop_policy='block', use_processes=False, profiler=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy}")
+        self.drop_policy = drop_policy
+        self.max_queue_size = max_queue_size
+        self.profiler = profiler
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=num_workers) if use_processes else None
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self._cameras = defaultdict(lambda: {'queue_depth': 0, 'bytes_written': 0, 'dropped': 0})
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run, name=f"frame-writer-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, items, on_done=None, camera=None):
+        """
+        Queue one job, the images of a frame or of one view of it, for writing
+
+        Parameters:
+        -----------
+        items : list of (str, np.ndarray) or (str, np.ndarray, codec)
+                Output path, image and optionally the frame_codecs codec of every view/stream belonging to the job
+        on_done : callable or None
+                  Called with True once the job is on disk, or with False when it failed or was dropped
+        camera : str or None
+                 Label of the camera the job belongs to, its queue depth, bytes and drops are counted per camera
+
+        Return:
+        -----------
+        accepted : bool
+                   False if the frame was dropped
+        """
+        if self._closed:
+            raise RuntimeError("FrameWriter is closed")
+        job = (list(items), on_done, camera)
+        # Counted as queued up front, so that a worker finishing the job right away never counts below zero
+        self._count_queued(camera, 1)
+        if self.drop_policy == 'block':
+            self._queue.put(job)
+            return True
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            pass
+        if self.drop_policy == 'drop_newest':
+            self._count_drop(job)
+            return False
+        # drop_oldest: make room by discarding the job that has waited the longest
+        try:
+            oldest = self._queue.get_nowait()
+            self._queue.task_done()
+            self._count_drop(oldest)
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            self._count_drop(job)
+            return False
+
+    def _count_queued(self, camera, n):
+        if camera is not None:
+            with self._lock:
+                self._cameras[camera]['queue_depth'] += n
+
+    def _count_drop(self, job):
+        camera = job[2]
+        with self._lock:
+            self.dropped += 1
+            if camera is not None:
+                self._cameras[camera]['queue_depth'] -= 1
+                self._cameras[camera]['dropped'] += 1
+        if job[1] is not None:
+            job[1](False)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            items, on_done, camera = job
+            ok = False
+            try:
+                if self._executor is not None:
+                    nbytes = self._executor.submit(write_images, items).result()
+                else:
+                    nbytes = write_images(items, self.profiler)
+                with self._lock:
+                    self.written += 1
+                    self.bytes_written += nbytes
+                    if camera is not None:
+                        self._cameras[camera]['bytes_written'] += nbytes
+                ok = True
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"FrameWriter failed to write {[item[0] for item in items]}: {e}")
+            finally:
+                self._count_queued(camera, -1)
+                if on_done is not None:
+                    on_done(ok)
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        Block until every queued frame is on disk
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Flush the queue and stop the workers
+        """
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'written': self.written,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'bytes_written': self.bytes_written,
+                'cameras': {camera: dict(counts) for camera, counts in self._cameras.items()},
+            }
@@ -0,0 +1,625 @@
+import numpy as np
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from capture_engine import CaptureEngine
+from depth_convert import DepthConverter
+from device_metadata import DeviceMetadata, MetadataCache
+from frame_codecs import PngCodec
+from frame_writer import save_views, view_items, write_images
+from multiview_frameset import MultiViewFrameset, ViewFrames
+from pointcloud import LiveFusion
+from preview import LivePreview
+from processing import ProcessingChain, realsense_backend
+from profiling import null_measure
+from stream_plan import SAVED_STREAMS
+
+class Device:
+    def __init__(self, pipeline, pipeline_profile, product_line, processing=None, depth_converter=None,
+                 metadata=None, stream_plan=None):
+        self.pipeline = pipeline
+        self.pipeline_profile = pipeline_profile
+        self.product_line = product_line
+        self.processing = processing if processing is not None else ProcessingChain()
+        self.depth_converter = depth_converter
+        self.metadata = metadata
+        self.stream_plan = stream_plan
+
+
+def enumerate_connected_devices(context, backend=None):
+    backend = realsense_backend(backend)
+    connect_device = []
+
+    for d in context.devices:
+        if d.get_info(backend.camera_info.name).lower() != 'platform camera':
+            serial = d.get_info(backend.camera_info.serial_number)
+            product_line = d.get_info(backend.camera_info.product_line)
+            device_info = (serial, product_line)  # (serial_number, product_line)
+            connect_device.append(device_info)
+    return connect_device
+
+
+def post_process_depth_frame(depth_frame, decimation_magnitude=1.0, spatial_magnitude=2.0, spatial_smooth_alpha=0.5,
+                             spatial_smooth_delta=20, temporal_smooth_alpha=0.4, temporal_smooth_delta=20,
+                             backend=None):
+    # Post processing possible only on the depth_frame
+    assert (depth_frame.is_depth_frame())
+    rs = realsense_backend(backend)
+
+    # Available filters and control options for the filters
+    decimation_filter = rs.decimation_filter()
+    spatial_filter = rs.spatial_filter()
+    temporal_filter = rs.temporal_filter()
+
+    filter_magnitude = rs.option.filter_magnitude
+    filter_smooth_alpha = rs.option.filter_smooth_alpha
+    filter_smooth_delta = rs.option.filter_smooth_delta
+
+    # Apply the control parameters for the filter
+    decimation_filter.set_option(filter_magnitude, decimation_magnitude)
+    spatial_filter.set_option(filter_magnitude, spatial_magnitude)
+    spatial_filter.set_option(filter_smooth_alpha, spatial_smooth_alpha)
+    spatial_filter.set_option(filter_smooth_delta, spatial_smooth_delta)
+    temporal_filter.set_option(filter_smooth_alpha, temporal_smooth_alpha)
+    temporal_filter.set_option(filter_smooth_delta, temporal_smooth_delta)
+
+    # Apply the filters
+    filtered_frame = decimation_filter.process(depth_frame)
+    filtered_frame = spatial_filter.process(filtered_frame)
+    filtered_frame = temporal_filter.process(filtered_frame)
+
+    return filtered_frame
+
+class MultiDeviceManager:
+    """
+    Manage any number of RealSense devices
+
+    Parameters:
+    -----------
+    context : rs::context
+    configs : list, dict, callable or None
+              Pipeline configuration per device: a list in enumeration order, a dict keyed by serial number,
+              or a callable returning a fresh rs::config for a serial number. Devices that share one rs::config
+              object are started one after the other, every other device is started in parallel.
+              None builds the configurations from the stream plans.
+    writer : FrameWriter or None
+             Writes the saved frames in the background, they are written inline without it
+    processing_options : dict or None
+                         Keyword arguments of the ProcessingChain built for every device
+    recorder : RecordingWriter or None
+               Append the saved frames to a raw recording instead of writing PNGs
+    color_codec, depth_codec : codec or None
+                               frame_codecs codec of the saved color and depth images, PNG by default
+    backend : module or None
+              pyrealsense2 by default, sim_realsense runs the manager without cameras
+    profiler : StageProfiler or None
+               Records the time spent in the poll, align, convert, queue, encode and write stages
+    preview : LivePreview, bool or None
+              Shows the latest views from a thread of its own, True uses a LivePreview with default settings
+              and False or None disables the preview for headless capture
+    metrics : CaptureMetrics or None
+              Live per-camera counters and timings, see capture_metrics
+    point_clouds : PointCloudBuilder, LiveFusion or None
+                   Deproject the aligned depth of the latest set on a LiveFusion thread, off the capture path; the
+                   newest clouds are in last_point_clouds. See PointCloudBuilder.live for settings that keep up
+    num_workers : int
+                  Threads that align, convert and, without a writer, encode the cameras of a set concurrently.
+                  1, the default, handles the cameras one after the other, 0 uses one thread per camera. Keep 1
+                  unless benchmark_capture.py --camera_workers 1,0 shows a speedup on the capture host
+    serials : list of str or None
+              Manage only these devices, in this order, instead of every connected one
+    frame_index : FrameIndex or None
+                  Commits every saved set to root/frames.jsonl once all its views are on disk
+    stream_plans : StreamPlan, dict or None
+                   Streams to enable and save, for every device or keyed by serial number; see stream_plan.
+                   Streams are only aligned and converted in the sets they are saved with, or for the point clouds
+    buffer_policies : BufferPolicy, dict or None
+                      Buffering of the capture engine and size of the librealsense frame queues, for every device
+                      or keyed by serial number; see frame_buffer
+    """
+    def __init__(self, context, configs, writer=None, processing_options=None, recorder=None, color_codec=None,
+                 depth_codec=None, backend=None, profiler=None, preview=True, metrics=None,
+                 point_clouds=None, num_workers=1, serials=None, stream_plans=None, frame_index=None,
+                 buffer_policies=None):
+        self._rs = realsense_backend(backend)
+        assert isinstance(context, type(self._rs.context()))
+        if configs is None:
+            assert stream_plans is not None, "Either configs or stream_plans is needed"
+        elif isinstance(configs, dict):
+            assert all(isinstance(config, type(self._rs.config())) for config in configs.values())
+        elif not callable(configs):
+            configs = list(configs)
+            assert all(isinstance(config, type(self._rs.config())) for config in configs)
+        self._context = context
+        self._available_devices = enumerate_connected_devices(context, self._rs)
+        if serials is not None:
+            connected = dict(self._available_devices)
+            missing = [serial for serial in serials if serial not in connected]
+            if missing:
+                raise RuntimeError(f"No device connected with serial number {', '.join(missing)}")
+            self._available_devices = [(serial, connected[serial]) for serial in serials]
+        self._enabled_devices = {}  # serial numbers of te enabled devices
+        self.configs = configs
+        self.stream_plans = stream_plans
+        self.buffer_policies = buffer_policies
+        self.frame_index = frame_index
+        self._started_configs = []
+        self._config_locks = {}
+        self._lock = threading.Lock()
+        self._frame_counter = 0
+        self.writer = writer  # optional FrameWriter, images are written inline without it
+        self.processing_options = processing_options or {}  # keyword arguments of ProcessingChain
+        self.recorder = recorder
+        self.inline_bytes = 0  # bytes of the images written without a writer or recorder
+        self.camera_inline_bytes = {}  # the same per serial number
+        self.color_codec = color_codec if color_codec is not None else PngCodec()
+        self.depth_codec = depth_codec if depth_codec is not None else PngCodec()
+        self.profiler = profiler
+        self._measure = profiler.measure if profiler is not None else null_measure
+        self.preview = LivePreview() if preview is True else (preview or None)
+        self.metrics = metrics
+        self.point_clouds = point_clouds
+        self.metadata = MetadataCache()  # filled by enable_device
+        self.fusion = None
+        if point_clouds is not None:
+            self.fusion = point_clouds if isinstance(point_clouds, LiveFusion) else LiveFusion(point_clouds, profiler)
+            self.point_clouds = self.fusion.builder
+        if metrics is not None:
+            metrics.attach(writer, recorder, self)
+        self.last_timestamps = []
+        self.last_frame_numbers = []
+        self.last_colors = []
+        self.last_depths = []
+        self._last_set = None  # the set last_colors and last_depths belong to
+        self._last_saved = {}  # (serial, stream) -> scheduled timestamp of the last save, see StreamPlan.due
+        self._due = {}  # (serial, stream) -> whether the stream is saved with the current set
+        self._engine = None
+        self.num_workers = num_workers
+        self._workers = None
+
+    @property
+    def available_devices(self):
+        # (serial, product_line) of every connected device, or of the requested serials, in view order
+        return list(self._available_devices)
+
+    @property
+    def enabled_devices(self):
+        return self._enabled_devices
+
+    @property
+    def last_point_clouds(self):
+        # Clouds of the newest set the fusion thread finished, None before the first one
+        if self.fusion is None or self.fusion.latest is None:
+            return None
+        return self.fusion.latest[1]
+
+    @property
+    def backend(self):
+        # pyrealsense2, or the module standing in for it such as sim_realsense
+        return self._rs
+
+    def plan_for(self, device_serial):
+        if isinstance(self.stream_plans, dict):
+            return self.stream_plans.get(device_serial)
+        return self.stream_plans
+
+    def buffer_policy_for(self, device_serial):
+        if isinstance(self.buffer_policies, dict):
+            return self.buffer_policies.get(device_serial)
+        return self.buffer_policies
+
+    def _set_frames_queue_size(self, device_serial, frames_queue_size):
+        # Read when the sensors open their streams, so it is set before the pipeline starts
+        for device in self._context.devices:
+            if device.get_info(self._rs.camera_info.serial_number) != device_serial:
+                continue
+            for sensor in device.query_sensors():
+                if sensor.supports(self._rs.option.frames_queue_size):
+                    sensor.set_option(self._rs.option.frames_queue_size, frames_queue_size)
+
+    def config_for(self, idx, device_serial):
+        if self.configs is None:
+            plan = self.plan_for(device_serial)
+            if plan is None:
+                raise KeyError(f"No stream plan for device {device_serial}")
+            return plan.config(self._rs)
+        if callable(self.configs):
+            return self.configs(device_serial)
+        if isinstance(self.configs, dict):
+            if device_serial not in self.configs:
+                raise KeyError(f"No pipeline configuration for device {device_serial}")
+            return self.configs[device_serial]
+        if idx >= len(self.configs):
+            raise IndexError(f"No pipeline configuration for device {idx} ({device_serial}), "
+                             f"only {len(self.configs)} were given")
+        return self.configs[idx]
+
+    def _start_pipeline(self, config, device_serial):
+        pipeline = self._rs.pipeline()
+        # enable_device modifies the config, so a config shared by several devices is started by one thread at a time
+        with self._lock:
+            config_lock = self._config_locks.setdefault(id(config), threading.Lock())
+        with config_lock:
+            config.enable_device(device_serial)
+            pipeline_profile = pipeline.start(config)
+        with self._lock:
+            if not any(config is started for started in self._started_configs):
+                self._started_configs.append(config)
+        return pipeline, pipeline_profile
+
+    def enable_device(self, idx, device_info, enable_ir_emitter, visual_preset='max_range'):
+        device_serial = device_info[0]
+        product_line = device_info[1]
+
+        if product_line == "L500":
+            config = self.config_for(idx, device_serial)
+            policy = self.buffer_policy_for(device_serial)
+            if policy is not None and policy.frames_queue_size is not None:
+                self._set_frames_queue_size(device_serial, policy.frames_queue_size)
+            pipeline, pipeline_profile = self._start_pipeline(config, device_serial)
+            print(f"Enable L515 device {idx} ({device_serial})")
+        else:
+            raise Exception("Please use RealSense L500 series")
+
+        # Set the acquisition parameters
+        sensor = pipeline_profile.get_device().first_depth_sensor()
+        # Every device keeps its own scale, mixed rigs do not share one
+        depth_scale = sensor.get_depth_scale()*1000
+        print(depth_scale)
+        # Timestamps in the global time domain are comparable across devices
+        if sensor.supports(self._rs.option.global_time_enabled):
+            sensor.set_option(self._rs.option.global_time_enabled, 1)
+        self.configure_sensors(pipeline_profile, enable_ir_emitter, visual_preset)
+        plan = self.plan_for(device_serial)
+        processing_options = dict(self.processing_options)
+        if plan is not None and not plan.enabled('color'):
+            # Nothing to align the depth to
+            processing_options['align'] = False
+        processing = ProcessingChain(backend=self._rs, **processing_options)
+        depth_converter = DepthConverter(depth_scale)
+        metadata = DeviceMetadata.from_pipeline_profile(device_serial, product_line, idx, pipeline_profile, depth_scale)
+        self.metadata.add(metadata)
+        device = Device(pipeline, pipeline_profile, product_line, processing, depth_converter, metadata, plan)
+        with self._lock:
+            self._enabled_devices[device_serial] = device
+        return device
+
+    def configure_sensors(self, pipeline_profile, enable_ir_emitter=None, visual_preset=None, laser_power=None):
+        """
+        Set the visual preset and emitter options on every sensor of a started device that supports them
+
+        Options left at None are not touched. visual_preset is the name of an l500_visual_preset.
+        """
+        options = []
+        if visual_preset is not None:
+            options.append((self._rs.option.visual_preset, int(getattr(self._rs.l500_visual_preset, visual_preset))))
+        if enable_ir_emitter is not None:
+            options.append((self._rs.option.emitter_enabled, 1 if enable_ir_emitter else 0))
+        if laser_power is not None:
+            options.append((self._rs.option.laser_power, laser_power))
+        for sensor in pipeline_profile.get_device().query_sensors():
+            for option, value in options:
+                if sensor.supports(option):
+                    sensor.set_option(option, value)
+
+    def enable_all_devices(self, enable_ir_emitter=False, parallel=True, visual_preset='max_range', on_enabled=None):
+        """
+        Start every device, all at once unless parallel is False
+
+        on_enabled(idx, serial, device) is called from the thread that started the device as soon as it is up,
+        so the devices that came up first can be warmed up while the others are still starting, see startup.
+        """
+        print(str(len(self._available_devices)) + " devices have been found")
+
+        def enable(idx, device_info):
+            device = self.enable_device(idx, device_info, enable_ir_emitter, visual_preset)
+            if on_enabled is not None:
+                on_enabled(idx, device_info[0], device)
+
+        if not parallel or len(self._available_devices) < 2:
+            for idx, device_info in enumerate(self._available_devices):
+                enable(idx, device_info)
+            return
+        with ThreadPoolExecutor(max_workers=len(self._available_devices)) as executor:
+            futures = [executor.submit(enable, idx, device_info)
+                       for idx, device_info in enumerate(self._available_devices)]
+            for future in futures:
+                future.result()
+        # Keep the views in enumeration order no matter which device came up first
+        self._enabled_devices = {serial: self._enabled_devices[serial] for serial, _ in self._available_devices}
+
+    def enable_emitter(self, enable_ir_emitter=True):
+        for (device_serial, device) in self._enabled_devices.items():
+            # Get the active profile and enable the emitter for all the connected devices
+            sensor = device.pipeline_profile.get_device().first_depth_sensor()
+            if not sensor.supports(self._rs.option.emitter_enabled):
+                continue
+            sensor.set_option(self._rs.option.emitter_enabled, 1 if enable_ir_emitter else 0)
+            if enable_ir_emitter:
+                sensor.set_option(self._rs.option.laser_power, 330)
+
+    def start_capture_engine(self, buffer_size=2, timeout_ms=1000, sync_tolerance_ms=None):
+        """
+        Capture with one blocking thread per device instead of the poll_for_frames busy-loop.
+        get_frames keeps its signature and takes its framesets from the engine until stop_capture_engine.
+        With sync_tolerance_ms the views of every set are matched by timestamp. The buffer policies of the
+        manager, if any, take the place of buffer_size.
+        """
+        self._engine = CaptureEngine(self._enabled_devices, buffer_size, timeout_ms, sync_tolerance_ms, self.metrics,
+                                     self.buffer_policies)
+        self._engine.start()
+        return self._engine
+
+    @property
+    def capture_engine(self):
+        return self._engine
+
+    def stop_capture_engine(self):
+        if self._engine is not None:
+            self._engine.stop()
+            self._engine = None
+
+    def _poll_framesets(self):
+        framesets = {}
+        metrics = self.metrics
+        retries = dict.fromkeys(self._enabled_devices, 0)
+        polled = dict.fromkeys(self._enabled_devices, 0)
+        while len(framesets) < len(self._enabled_devices):
+            for serial, device in self._enabled_devices.items():
+                streams = device.pipeline_profile.get_streams()
+                frameset = device.pipeline.poll_for_frames()
+                if frameset.size() == len(streams):
+                    # A camera polled again while waiting for the others replaces its frameset, the older one is lost
+                    framesets[serial] = frameset
+                    polled[serial] += 1
+                elif metrics is not None:
+                    if frameset.size() > 0:
+                        metrics.inc(serial, 'incomplete_framesets')
+                    if serial not in framesets:
+                        retries[serial] += 1
+        if metrics is not None:
+            for serial in framesets:
+                metrics.inc(serial, 'frames_polled', polled[serial])
+                if polled[serial] > 1:
+                    metrics.inc(serial, 'poll_overwritten', polled[serial] - 1)
+                metrics.inc(serial, 'loop_retries', retries[serial])
+        return framesets
+
+    def _camera_workers(self):
+        if self._workers is None and self.num_workers != 1 and len(self._enabled_devices) > 1:
+            num_workers = self.num_workers or len(self._enabled_devices)
+            self._workers = ThreadPoolExecutor(num_workers, thread_name_prefix='camera')
+        return self._workers
+
+    def _process_device(self, cam_idx, serial, device, frameset, save, write_root=None):
+        """
+        ViewFrames of one device's frameset, with the aligned color and converted depth, and the written paths
+
+        With write_root the view's images are also written, from the worker that processed them.
+        """
+        measure = self._measure
+        metrics = self.metrics
+        device_frames = {}
+        for stream in device.pipeline_profile.get_streams():
+            if (self._rs.stream.infrared == stream.stream_type()):
+                frame = frameset.get_infrared_frame(stream.stream_index())
+                key_ = str(stream.stream_type())
+            else:
+                frame = frameset.first_or_default(stream.stream_type())
+                key_ = str(stream.stream_type())
+
+            device_frames[key_] = frame
+
+        plan = device.stream_plan
+        has_color = plan is None or plan.enabled('color')
+        save_depth = self._saves(serial, 'depth', save)
+        rgb = depth = None
+        if plan is None or (plan.enabled('depth') and (save_depth or self.point_clouds is not None)):
+            start = time.perf_counter()
+            with measure('align'):
+                aligned_frames = device.processing.process(frameset)
+            aligned = time.perf_counter()
+            with measure('convert'):
+                aligned_depth = aligned_frames.get_depth_frame()
+                if has_color:
+                    rgb = np.asarray(aligned_frames.get_color_frame().get_data())
+                raw_depth = np.asanyarray(aligned_depth.get_data())
+                # The converter's own buffers are reused on later calls, a queued or recorded write needs a buffer
+                # of its own
+                owned = self.writer is not None or self.recorder is not None
+                out = np.empty(raw_depth.shape, np.uint16) if save_depth and owned else None
+                depth = device.depth_converter.convert(raw_depth, out)
+            if metrics is not None:
+                metrics.observe(serial, 'align', aligned - start)
+                metrics.observe(serial, 'convert', time.perf_counter() - aligned)
+        elif has_color:
+            # Aligning only moves the depth, the color frame is the same without it
+            rgb = np.asarray(frameset.get_color_frame().get_data())
+        paths = []
+        if write_root is not None:
+            color = rgb if self._saves(serial, 'color', save) else None
+            items = view_items(write_root, self._frame_counter, cam_idx, color, depth if save_depth else None,
+                               self.color_codec, self.depth_codec)
+            self.add_inline_bytes(write_images(items, self.profiler), serial)
+            paths = [item[0] for item in items]
+        view = ViewFrames(cam_idx, serial, device.product_line, device_frames, rgb, depth, frameset.get_timestamp(),
+                          frameset.get_frame_number())
+        return view, paths
+
+    def _release_set(self, frames):
+        # last_colors, last_depths and the published preview images are views on the buffers of the latest set
+        if self._last_set is not frames:
+            return
+        if self.preview is not None:
+            self.preview.withdraw(self.last_colors)
+        self.last_colors = []
+        self.last_depths = []
+        self._last_set = None
+
+    def add_inline_bytes(self, nbytes, serial=None):
+        # Called from the camera workers, save_views and write_images return 0 for queued or recorded sets
+        with self._lock:
+            self.inline_bytes += nbytes
+            if serial is not None:
+                self.camera_inline_bytes[serial] = self.camera_inline_bytes.get(serial, 0) + nbytes
+
+    def count_view_bytes(self, view, nbytes):
+        # on_written callback of save_views, views are numbered like the enabled devices
+        self.add_inline_bytes(nbytes, list(self._enabled_devices)[view])
+
+    def _saves(self, serial, stream, save):
+        # Whether the stream of the device is saved with the current set, decided by _schedule_saves
+        return save and self._due.get((serial, stream), True)
+
+    def _schedule_saves(self, framesets):
+        # Decided once per set from the earliest frame timestamp, so devices with the same plan save the same sets
+        timestamp = min(frameset.get_timestamp() for frameset in framesets.values())
+        due = {}
+        for serial, device in self._enabled_devices.items():
+            plan = device.stream_plan
+            if plan is None:
+                continue
+            for stream in SAVED_STREAMS:
+                key = (serial, stream)
+                due[key], self._last_saved[key] = plan.due(stream, timestamp, self._last_saved.get(key))
+        self._due = due
+
+    def get_frames(self, root, save=False, no_count=False):
+        """
+        Next set of all devices as a MultiViewFrameset, keyed by (view, product_line)
+
+        The set holds the device buffers, zero-copy; release it (or use it in a with block) once done with it
+        and copy() what has to be kept.
+        """
+        measure = self._measure
+        metrics = self.metrics
+        with measure('poll'):
+            if self._engine is not None:
+                framesets = self._engine.get_framesets()
+            else:
+                framesets = self._poll_framesets()
+
+        if save:
+            self._schedule_saves(framesets)
+        workers = self._camera_workers()
+        # Images of a single view may be written right in its worker; a writer or recorder needs the whole set
+        write_views = save and self.writer is None and self.recorder is None and workers is not None
+        jobs = [(cam_idx, serial, device, framesets[serial], save, root if write_views else None)
+                for cam_idx, (serial, device) in enumerate(self._enabled_devices.items())]
+        if workers is not None:
+            results = list(workers.map(lambda job: self._process_device(*job), jobs))
+        else:
+            results = [self._process_device(*job) for job in jobs]
+
+        frames = MultiViewFrameset([view for view, _ in results], self._frame_counter, self._release_set)
+        img_repos = frames.colors
+        depth_repos = frames.depths
+        timestamps = frames.timestamps
+        written = [path for _, paths in results for path in paths]
+        self.last_timestamps = timestamps
+        self.last_frame_numbers = frames.frame_numbers
+        self.last_colors = img_repos
+        self.last_depths = depth_repos
+        self._last_set = frames
+        if self.fusion is not None:
+            # Only copies the decimated images, the fusion thread builds the clouds of the newest set
+            with measure('pointcloud_publish'):
+                self.fusion.publish(self._frame_counter, depth_repos, img_repos)
+
+        if save and not write_views:
+            serials = list(self._enabled_devices)
+            colors = [rgb if self._saves(serial, 'color', save) else None for rgb, serial in zip(img_repos, serials)]
+            depths = [depth if self._saves(serial, 'depth', save) else None
+                      for depth, serial in zip(depth_repos, serials)]
+            if any(image is not None for image in colors + depths):
+                save_views(root, self._frame_counter, colors, depths, timestamps, self.writer, self.recorder,
+                           self.color_codec, self.depth_codec, self.profiler, self.frame_index, workers,
+                           list(self._enabled_devices), self.count_view_bytes)
+        elif write_views and self.frame_index is not None and written:
+            # Every view was written by its worker before the results came back
+            self.frame_index.add(self._frame_counter, timestamps, written)
+        if self.preview is not None and all(rgb is not None for rgb in img_repos):
+            # Only hands the arrays over, the preview thread downsamples and shows them at its own rate
+            self.preview.publish(img_repos)
+        if not no_count:
+            self._frame_counter += 1
+        if metrics is not None:
+            metrics.count_set()
+
+        return frames
+
+
+    def get_device_intrinsics(self, frames):
+        """
+        Get the intrinsics of the imager using its frame delivered by the realsense device
+
+        Parameters:
+        -----------
+        frames : MultiViewFrameset
+                 A set returned by get_frames, also after it was released
+
+        Return:
+        -----------
+        device_intrinsics : dict
+        keys  : serial
+                View index of the device
+        values: [key]
+                Intrinsics of the corresponding device
+        """
+        device_intrinsics = {}
+        views = self.metadata.views()
+        for (dev_info, frameset) in frames.items():
+            serial = dev_info[0]
+            device_intrinsics[serial] = {}
+            # Read once from the stream profiles at enable_device
+            metadata = views[dev_info[0]]
+            for key in frameset:
+                device_intrinsics[serial][key] = dict(metadata.intrinsics(key))
+        print(device_intrinsics)
+        return device_intrinsics
+
+    def get_depth_to_color_extrinsics(self, frames):
+        """
+        Get the extrinsics between the depth imager 1 and the color imager using its frame delivered by the realsense device
+
+        Parameters:
+        -----------
+        frames : MultiViewFrameset
+                 A set returned by get_frames
+
+        Return:
+        -----------
+        device_intrinsics : dict
+        keys  : serial
+                Serial number of the device
+        values: [key]
+                Extrinsics of the corresponding device
+        """
+        device_extrinsics = {}
+        for (dev_info, frameset) in frames.items():
+            serial = dev_info[0]
+            # get_frames keys the frames by the stream name
+            device_extrinsics[serial] = frameset[
+                str(self._rs.stream.depth)].get_profile().as_video_stream_profile().get_extrinsics_to(
+                frameset[str(self._rs.stream.color)].get_profile())
+        return device_extrinsics
+
+    def disable_streams(self):
+        self.stop_capture_engine()
+        if self._workers is not None:
+            self._workers.shutdown()
+            self._workers = None
+        if self.preview is not None:
+            self.preview.stop()
+        if self.fusion is not None:
+            self.fusion.stop()
+        for device in self._enabled_devices.values():
+            try:
+                device.pipeline.stop()
+            except RuntimeError as e:
+                print(f"Failed to stop a pipeline: {e}")
+        self._enabled_devices = {}
+        for config in self._started_configs:
+            config.disable_all_streams()
+        self._started_configs = []
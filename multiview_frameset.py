@@ -0,0 +1,182 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def frame_array(frame):
+    """
+    NumPy view over the buffer of an rs::frame, without copying; arrays are passed through
+    """
+    if frame is None or isinstance(frame, np.ndarray):
+        return frame
+    return np.asanyarray(frame.get_data())
+
+
+class ViewFrames(Mapping):
+    """
+    Frames of one camera in a set, a mapping stream name ('stream.depth', ...) -> rs::frame
+
+    color and depth are what get_frames computed for the view: the color aligned with the depth, a view over
+    the librealsense buffer, and the depth converted to millimeters, a view over the converter's buffer that
+    is reused for the next set. array() gives any stream as a zero-copy view. All of them stay valid until
+    release(); copy() detaches the view from the device buffers.
+
+    release() drops the references this object holds, so the frames go back to librealsense once no array
+    taken from color, depth or array() is left alive; releasing the whole MultiViewFrameset also makes the
+    manager drop its last_colors and last_depths and withdraw the set from a preview that did not show it
+    yet. The depth buffer belongs to the converter and is overwritten by a later set whether released or not.
+
+    Parameters:
+    -----------
+    view : int
+    serial : str or None
+    product_line : str
+    frames : dict
+             Stream name -> rs::frame, or np.ndarray for replayed and shared-memory sets
+    color, depth : np.ndarray or None
+                   None when the stream is not enabled or was not converted for this set
+    timestamp : float
+                Milliseconds, in the domain of the device
+    frame_number : int
+    """
+    def __init__(self, view, serial, product_line, frames, color=None, depth=None, timestamp=None,
+                 frame_number=None):
+        self.view = view
+        self.serial = serial
+        self.product_line = product_line
+        self.timestamp = timestamp
+        self.frame_number = frame_number
+        self.streams = tuple(frames)  # kept after release, e.g. for the intrinsics
+        self._frames = dict(frames)
+        self._arrays = {}
+        self._color = color
+        self._depth = depth
+        self.released = False
+
+    def _check(self):
+        if self.released:
+            raise RuntimeError(f"The frames of view {self.view} were released")
+
+    def __getitem__(self, stream):
+        self._check()
+        return self._frames[stream]
+
+    def __iter__(self):
+        return iter(self.streams)
+
+    def __len__(self):
+        return len(self.streams)
+
+    @property
+    def color(self):
+        self._check()
+        return self._color
+
+    @property
+    def depth(self):
+        self._check()
+        return self._depth
+
+    def array(self, stream):
+        """
+        Zero-copy view over the buffer of a stream, e.g. array('stream.infrared') or the unaligned 'stream.depth'
+        """
+        self._check()
+        if stream not in self._arrays:
+            self._arrays[stream] = frame_array(self._frames[stream])
+        return self._arrays[stream]
+
+    def copy(self):
+        """
+        ViewFrames holding copies of every stream, valid after this one is released
+        """
+        self._check()
+        frames = {stream: np.array(self.array(stream)) for stream in self.streams}
+        return ViewFrames(self.view, self.serial, self.product_line, frames,
+                          None if self._color is None else self._color.copy(),
+                          None if self._depth is None else self._depth.copy(), self.timestamp, self.frame_number)
+
+    def release(self):
+        """
+        Drop the references to the device buffers, so librealsense can hand them out again
+        """
+        self._frames = {}
+        self._arrays = {}
+        self._color = None
+        self._depth = None
+        self.released = True
+
+
+class MultiViewFrameset(Mapping):
+    """
+    One synchronized set of all views, as returned by get_frames
+
+    A mapping (view, product_line) -> ViewFrames, so it reads like the dict of frame dicts the managers
+    returned before. The rs::frame objects of a set come from a small pool per stream; release the set, or use
+    it as a context manager, when done with it instead of keeping it around, and copy() what has to outlive it.
+
+    Parameters:
+    -----------
+    views : list of ViewFrames
+            In view order
+    set_number : int
+                 Frame counter of the manager when the set was taken, the frame number of its saved files
+    on_release : callable or None
+                 Called with the set when it is released the first time, e.g. for the manager to drop its own
+                 references to the set's buffers
+    """
+    def __init__(self, views, set_number=None, on_release=None):
+        self.views = list(views)
+        self.set_number = set_number
+        self._on_release = on_release
+        self._keys = {(view.view, view.product_line): view for view in self.views}
+
+    def __getitem__(self, key):
+        return self._keys[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def colors(self):
+        return [view.color for view in self.views]
+
+    @property
+    def depths(self):
+        return [view.depth for view in self.views]
+
+    @property
+    def timestamps(self):
+        return [view.timestamp for view in self.views]
+
+    @property
+    def frame_numbers(self):
+        return [view.frame_number for view in self.views]
+
+    @property
+    def serials(self):
+        return [view.serial for view in self.views]
+
+    @property
+    def released(self):
+        return all(view.released for view in self.views)
+
+    def copy(self):
+        return MultiViewFrameset([view.copy() for view in self.views], self.set_number)
+
+    def release(self):
+        for view in self.views:
+            view.release()
+        on_release, self._on_release = self._on_release, None
+        if on_release is not None:
+            on_release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,418 @@
+import argparse
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from device_metadata import MetadataCache
+from recording import RecordingReader
+
+ALIGNED_STREAM = 'stream.color'  # get_frames aligns depth to color, so the color intrinsics apply
+MAX_DENSE_VOXELS = 1 << 23  # grids up to this many cells are voxelized in linear time, larger ones by sorting
+# Live fusion of 3 views of 1920x1080 aligned depth takes 19-21 ms with these, within a 30 fps frame period;
+# stride 4 takes 50-70 ms
+LIVE_STRIDE = 8
+LIVE_VOXEL_SIZE = 0.01
+
+
+@lru_cache(maxsize=32)
+def ray_grid(fx, fy, cx, cy, width, height, stride=1):
+    """
+    Normalized image-plane coordinates (x/z, y/z) of every stride-th pixel, computed once per intrinsics
+
+    Distortion is ignored, as in rs2_deproject_pixel_to_point for the models the L515 reports on aligned depth.
+
+    Return:
+    -----------
+    rays : tuple of np.ndarray
+           Two float32 arrays of shape (ceil(height/stride), ceil(width/stride)), read-only
+    """
+    u = (np.arange(0, width, stride, dtype=np.float32) - cx) / fx
+    v = (np.arange(0, height, stride, dtype=np.float32) - cy) / fy
+    x_rays, y_rays = np.meshgrid(u, v)
+    x_rays.setflags(write=False)
+    y_rays.setflags(write=False)
+    return x_rays, y_rays
+
+
+def intrinsics_key(intrinsics):
+    """
+    (fx, fy, cx, cy, width, height) of an intrinsics dict as written by get_device_intrinsics
+    """
+    return (float(intrinsics['fx']), float(intrinsics['fy']), float(intrinsics['cx']), float(intrinsics['cy']),
+            int(intrinsics['width']), int(intrinsics['height']))
+
+
+def load_intrinsics(path, stream=ALIGNED_STREAM):
+    """
+    Intrinsics of one stream for every view of an intrinsic.json or device_metadata.json, in view order
+    """
+    with open(path) as json_file:
+        device_intrinsics = json.load(json_file)
+    if 'devices' in device_intrinsics:
+        return MetadataCache.from_dict(device_intrinsics).view_intrinsics(stream)
+    return [device_intrinsics[view][stream] for view in sorted(device_intrinsics, key=int)]
+
+
+def deproject(depth, intrinsics, stride=1, depth_scale=0.001, max_depth=None, color=None):
+    """
+    Back-project a depth image into camera-frame points
+
+    Parameters:
+    -----------
+    depth : np.ndarray
+            HxW depth, uint16 millimeters as written by the capture scripts
+    intrinsics : dict
+                 Intrinsics of the stream the depth is aligned to
+    stride : int
+             Keep every stride-th pixel in both directions
+    depth_scale : float
+                  Meters per depth unit
+    max_depth : float or None
+                Drop points farther than this, in meters
+    color : np.ndarray or None
+            HxWx3 BGR image aligned with depth
+
+    Return:
+    -----------
+    points : np.ndarray
+             Nx3 float32 points in meters, pixels without depth are dropped
+    colors : np.ndarray or None
+             Nx3 uint8 RGB color of every point
+    """
+    x_rays, y_rays = ray_grid(*intrinsics_key(intrinsics), stride)
+    z = depth[::stride, ::stride]
+    valid = z > 0
+    if max_depth is not None:
+        valid &= z <= max_depth / depth_scale
+    z = z[valid].astype(np.float32) * np.float32(depth_scale)
+    points = np.empty((len(z), 3), np.float32)
+    np.multiply(x_rays[valid], z, out=points[:, 0])
+    np.multiply(y_rays[valid], z, out=points[:, 1])
+    points[:, 2] = z
+    colors = None
+    if color is not None:
+        colors = color[::stride, ::stride][valid][:, ::-1]
+    return points, colors
+
+
+def transform_points(points, transform):
+    """
+    Apply a 4x4 rigid transform to Nx3 points
+    """
+    transform = np.asarray(transform, np.float32)
+    return points @ transform[:3, :3].T + transform[:3, 3]
+
+
+def voxel_downsample(points, voxel_size, colors=None):
+    """
+    Replace the points of every occupied voxel by their centroid
+
+    Linear in the number of points while the bounding box spans at most MAX_DENSE_VOXELS voxels, e.g. a
+    3.3 x 1.7 x 1.1 m scene at 1 cm; larger grids fall back to sorting the voxel keys.
+
+    Return:
+    -----------
+    points : np.ndarray
+             Mx3 float32 centroids
+    colors : np.ndarray or None
+             Mx3 uint8 mean color of every voxel
+    """
+    if len(points) == 0:
+        return points, colors
+    # One axis at a time, reductions over the columns of an Nx3 array are slow strided loops
+    scale = np.float32(1 / voxel_size)
+    flat = None
+    cells = 1
+    for k in range(3):
+        key = np.floor(points[:, k] * scale).astype(np.int64)
+        low = int(key.min())
+        extent = int(key.max()) - low + 1
+        key -= low
+        flat = key if flat is None else flat * extent + key
+        cells *= extent
+    if cells <= MAX_DENSE_VOXELS:
+        # Marking the occupied cells of the bounding grid numbers the voxels without sorting the points
+        occupied = np.zeros(cells, bool)
+        occupied[flat] = True
+        cell_ids = np.flatnonzero(occupied)
+        lookup = np.empty(cells, np.int32)
+        lookup[cell_ids] = np.arange(len(cell_ids), dtype=np.int32)
+        inverse = lookup[flat]
+        counts = np.bincount(inverse, minlength=len(cell_ids))
+    else:
+        _, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+    def mean(values):
+        return np.stack([np.bincount(inverse, values[:, k], len(counts)) for k in range(3)], axis=1) / counts[:, None]
+
+    centroids = mean(points).astype(np.float32)
+    if colors is not None:
+        colors = np.rint(mean(colors)).astype(np.uint8)
+    return centroids, colors
+
+
+class PointCloudBuilder:
+    """
+    Per-view or merged point clouds from the aligned depth of every view
+
+    Used online through LiveFusion, see live(), or offline over a recording.
+
+    Parameters:
+    -----------
+    intrinsics : list of dict
+                 Intrinsics of the aligned stream per view, see load_intrinsics
+    stride : int
+             Decimation of the depth images
+    depth_scale : float
+                  Meters per unit of the converted depth, 0.001 for the millimeter images of the capture scripts
+    max_depth : float or None
+                Farthest point kept, in meters
+    transforms : list of np.ndarray or None
+                 4x4 camera-to-world transform per view; without them every cloud stays in its camera frame
+    merge : bool
+            Return one cloud of all views instead of one per view
+    voxel_size : float or None
+                 Voxel-grid downsampling of the merged cloud, in meters
+    """
+    def __init__(self, intrinsics, stride=1, depth_scale=0.001, max_depth=None, transforms=None, merge=False,
+                 voxel_size=None):
+        self.intrinsics = list(intrinsics)
+        self.stride = stride
+        self.depth_scale = depth_scale
+        self.max_depth = max_depth
+        self.transforms = transforms
+        self.merge = merge
+        self.voxel_size = voxel_size
+        self._directions = {}
+
+    def _view_directions(self, view):
+        # Rays of the strided pixels already rotated into the world frame, so a point is z * direction + t
+        if view not in self._directions:
+            x_rays, y_rays = ray_grid(*intrinsics_key(self.intrinsics[view]), self.stride)
+            rays = np.stack([x_rays, y_rays, np.ones_like(x_rays)], axis=-1)
+            translation = np.zeros(3, np.float32)
+            if self.transforms is not None:
+                transform = np.asarray(self.transforms[view], np.float32)
+                rays = rays @ transform[:3, :3].T
+                translation = transform[:3, 3].copy()
+            self._directions[view] = (np.ascontiguousarray(rays, np.float32), translation)
+        return self._directions[view]
+
+    def _view_cloud(self, view, depth, color, decimated=False):
+        directions, translation = self._view_directions(view)
+        stride = 1 if decimated else self.stride
+        z = depth[::stride, ::stride]
+        valid = z > 0
+        if self.max_depth is not None:
+            valid &= z <= self.max_depth / self.depth_scale
+        z = z[valid].astype(np.float32)
+        z *= np.float32(self.depth_scale)
+        points = directions[valid]
+        points *= z[:, None]
+        if self.transforms is not None:
+            points += translation
+        colors = color[::stride, ::stride][valid][:, ::-1] if color is not None else None
+        return points, colors
+
+    @classmethod
+    def from_device_intrinsics(cls, device_intrinsics, stream=ALIGNED_STREAM, **kwargs):
+        """
+        Build from the dict returned by get_device_intrinsics
+        """
+        views = sorted(device_intrinsics, key=int)
+        return cls([device_intrinsics[view][stream] for view in views], **kwargs)
+
+    @classmethod
+    def live(cls, intrinsics, transforms=None, **kwargs):
+        """
+        Merged, voxel-downsampled clouds at LIVE_STRIDE and LIVE_VOXEL_SIZE, fast enough to fuse every set of
+        3 views at 30 fps
+        """
+        kwargs = {'stride': LIVE_STRIDE, 'voxel_size': LIVE_VOXEL_SIZE, 'merge': True, **kwargs}
+        return cls(intrinsics, transforms=transforms, **kwargs)
+
+    def decimate(self, images):
+        """
+        Copies of the pixels process uses, every stride-th one, None entries are kept
+        """
+        stride = self.stride
+        return [image[::stride, ::stride].copy() if image is not None else None for image in images]
+
+    def process(self, depths, colors=None, decimated=False):
+        """
+        Parameters:
+        -----------
+        decimated : bool
+                    The images were already reduced by decimate()
+
+        Return:
+        -----------
+        clouds : list of (points, colors), or a single (points, colors) when merging; the colors of a view
+                 without a color image are None, as are the merged colors unless every view has one
+        """
+        clouds = [self._view_cloud(view, depth, colors[view] if colors is not None else None, decimated)
+                  for view, depth in enumerate(depths)]
+        if not self.merge:
+            return clouds
+        points = np.concatenate([points for points, _ in clouds])
+        # A stream plan may disable the color of some cameras, a merged cloud is colored only if every view is
+        merged_colors = None
+        if clouds and all(point_colors is not None for _, point_colors in clouds):
+            merged_colors = np.concatenate([point_colors for _, point_colors in clouds])
+        if self.voxel_size is not None:
+            return voxel_downsample(points, self.voxel_size, merged_colors)
+        return points, merged_colors
+
+
+class LiveFusion:
+    """
+    Build the point clouds of the latest set on a thread of its own, off the capture path
+
+    Like LivePreview, publish only hands the set over: it keeps copies of the decimated depth and color, since
+    the full-resolution buffers go back to the device and the converter, and replaces a set that was not fused
+    yet. The thread always fuses the newest set and counts the ones it skipped, so a builder slower than the
+    cameras delays the clouds instead of every set. Use PointCloudBuilder.live() for settings that keep up
+    with 30 fps.
+
+    Parameters:
+    -----------
+    builder : PointCloudBuilder
+    profiler : StageProfiler or None
+               Times the 'pointcloud' stage on the fusion thread
+    """
+    def __init__(self, builder, profiler=None):
+        self.builder = builder
+        self.profiler = profiler
+        self.fused = 0
+        self.skipped = 0
+        self.latest = None  # (set number, clouds) of the newest fused set
+        self._pending = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._running = False
+        self.error = None
+
+    def publish(self, set_number, depths, colors=None):
+        """
+        Hand over a set, a set that was not fused yet is replaced
+        """
+        if self.error is not None:
+            raise RuntimeError("The point cloud fusion thread failed") from self.error
+        pending = (set_number, self.builder.decimate(depths),
+                   self.builder.decimate(colors) if colors is not None else None)
+        with self._lock:
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = pending
+        if self._thread is None:
+            self.start()
+        self._event.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='fusion', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            self._event.wait()
+            self._event.clear()
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is None:
+                continue
+            set_number, depths, colors = pending
+            start = time.perf_counter()
+            try:
+                clouds = self.builder.process(depths, colors, decimated=True)
+            except Exception as e:
+                self.error = e
+                self._running = False
+                return
+            if self.profiler is not None:
+                self.profiler.add('pointcloud', time.perf_counter() - start)
+            self.latest = (set_number, clouds)
+            self.fused += 1
+
+
+def recording_point_clouds(recording_root, builder):
+    """
+    Yield (frame number, clouds) for every frame of a raw recording
+    """
+    reader = RecordingReader(recording_root)
+    has_color = 'color' in reader.streams
+    for idx in range(len(reader)):
+        depths = [reader.get(idx, view, 'depth') for view in range(reader.num_views)]
+        if any(depth is None for depth in depths):
+            # Depth saved at a lower rate than color
+            continue
+        colors = [reader.get(idx, view, 'color') for view in range(reader.num_views)] if has_color else None
+        if colors is not None and any(color is None for color in colors):
+            colors = None
+        yield reader.frame_number(idx), builder.process(depths, colors)
+
+
+def write_ply(path, points, colors=None):
+    """
+    Write a binary little-endian PLY file
+    """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), fields)
+    vertices['x'], vertices['y'], vertices['z'] = points[:, 0], points[:, 1], points[:, 2]
+    if colors is not None:
+        vertices['red'], vertices['green'], vertices['blue'] = colors[:, 0], colors[:, 1], colors[:, 2]
+    types = {'<f4': 'float', 'u1': 'uchar'}
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(points)}']
+    header += [f'property {types[dtype]} {name}' for name, dtype in fields]
+    header.append('end_header')
+    with open(path, 'wb') as ply_file:
+        ply_file.write(('\n'.join(header) + '\n').encode())
+        ply_file.write(vertices.tobytes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Point clouds of every frame of a raw recording as PLY files')
+    parser.add_argument('recording')
+    parser.add_argument('intrinsics', help='intrinsic.json or device_metadata.json written by the capture scripts')
+    parser.add_argument('output')
+    parser.add_argument('--stride', default=1, type=int)
+    parser.add_argument('--max_depth', default=None, type=float, help='meters')
+    parser.add_argument('--merge', action='store_true', default=False, help='one cloud of all views per frame')
+    parser.add_argument('--extrinsics', default=None,
+                        help='extrinsic.json of calibration.py, expresses the clouds in the common world frame')
+    parser.add_argument('--voxel_size', default=None, type=float, help='downsample the merged cloud, meters')
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    transforms = None
+    if args.extrinsics is not None:
+        from calibration import load_extrinsics
+        transforms = load_extrinsics(args.extrinsics)
+    builder = PointCloudBuilder(load_intrinsics(args.intrinsics), args.stride, max_depth=args.max_depth,
+                                transforms=transforms, merge=args.merge or args.voxel_size is not None,
+                                voxel_size=args.voxel_size)
+    count = 0
+    for frame_number, clouds in recording_point_clouds(args.recording, builder):
+        if builder.merge:
+            write_ply(os.path.join(args.output, f'{frame_number}.ply'), *clouds)
+        else:
+            for view, cloud in enumerate(clouds):
+                write_ply(os.path.join(args.output, f'{frame_number}_view{view}.ply'), *cloud)
+        count += 1
+    print(f"Wrote the point clouds of {count} frames")
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def tile_views(images, columns=None):
+    """
+    Arrange the views in a grid, smaller views are padded with black
+
+    Parameters:
+    -----------
+    images : list of np.ndarray
+             HxWx3 uint8 color views
+    columns : int or None
+              Views per row, about the square root of the number of views by default
+    """
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(len(images))))
+    rows = int(np.ceil(len(images) / columns))
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    canvas = np.zeros((rows * height, columns * width, 3), np.uint8)
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        canvas[row * height:row * height + image.shape[0], column * width:column * width + image.shape[1]] = image
+    return canvas
+
+
+class LivePreview:
+    """
+    Show the latest multi-view set in one window from a thread of its own
+
+    publish only swaps a reference under a lock, so the capture path never waits for the GUI. The display
+    thread picks up the newest set at most max_fps times a second, downsamples and tiles the views and
+    skips every set published in between. When no display is available the preview turns itself off.
+
+    Parameters:
+    -----------
+    max_fps : float
+              Upper bound of the window refresh rate
+    scale : float
+            Downsampling factor applied to every view
+    columns : int or None
+              Views per row of the tiled window
+    window_name : str
+    """
+    def __init__(self, max_fps=10.0, scale=0.25, columns=None, window_name='preview'):
+        self.max_fps = max_fps
+        self.scale = scale
+        self.columns = columns
+        self.window_name = window_name
+        self.shown = 0
+        self.skipped = 0
+        self._latest = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._running = False
+        self.enabled = True
+
+    def publish(self, images):
+        """
+        Hand over the latest views, a set that was not shown yet is replaced
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._latest is not None:
+                self.skipped += 1
+            self._latest = images
+        if self._thread is None:
+            self.start()
+        self._event.set()
+
+    def withdraw(self, images):
+        """
+        Drop the views of a published set that was not shown yet, e.g. because their buffers were released
+        """
+        with self._lock:
+            if self._latest is images:
+                self._latest = None
+                self.skipped += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='preview', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        interval = 1.0 / self.max_fps if self.max_fps else 0.0
+        try:
+            while self._running:
+                self._event.wait()
+                self._event.clear()
+                with self._lock:
+                    images, self._latest = self._latest, None
+                if images is None:
+                    continue
+                start = time.perf_counter()
+                views = [cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+                         for image in images]
+                cv2.imshow(self.window_name, tile_views(views, self.columns))
+                cv2.waitKey(1)
+                self.shown += 1
+                remaining = interval - (time.perf_counter() - start)
+                if remaining > 0:
+                    time.sleep(remaining)
+        except cv2.error as e:
+            # Typically a headless machine, keep capturing without preview
+            print(f"Preview disabled: {e}")
+            self.enabled = False
+        finally:
+            try:
+                cv2.destroyWindow(self.window_name)
+            except cv2.error:
+                pass
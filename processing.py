@@ -0,0 +1,71 @@
+try:
+    import pyrealsense2 as rs
+except ImportError:
+    # Simulated and replayed capture still work, see realsense_backend
+    rs = None
+
+
+def realsense_backend(backend=None):
+    """
+    The given backend module, pyrealsense2 by default; raises ImportError when it is not installed
+    """
+    if backend is not None:
+        return backend
+    if rs is None:
+        raise ImportError("pyrealsense2 is not installed, pass backend=sim_realsense to run against simulated cameras")
+    return rs
+
+
+class ProcessingChain:
+    """
+    Per-device depth post-processing and alignment, built once and reused for every frameset
+
+    The filters keep their state between frames, which the temporal filter relies on.
+
+    Parameters:
+    -----------
+    align : bool
+            Align the depth frame to the color stream
+    decimation_magnitude : float or None
+                           Enable the decimation filter with this magnitude
+    spatial_magnitude, spatial_smooth_alpha, spatial_smooth_delta : float or None
+                           Enable the spatial filter when spatial_magnitude is given
+    temporal_smooth_alpha, temporal_smooth_delta : float or None
+                           Enable the temporal filter when temporal_smooth_alpha is given
+    backend : module or None
+              pyrealsense2 or a stand-in such as sim_realsense, pyrealsense2 when None
+    """
+    def __init__(self, align=True, decimation_magnitude=None, spatial_magnitude=None, spatial_smooth_alpha=0.5,
+                 spatial_smooth_delta=20, temporal_smooth_alpha=None, temporal_smooth_delta=20, backend=None):
+        backend = realsense_backend(backend)
+        self.filters = []
+        if decimation_magnitude is not None:
+            decimation_filter = backend.decimation_filter()
+            decimation_filter.set_option(backend.option.filter_magnitude, decimation_magnitude)
+            self.filters.append(decimation_filter)
+        if spatial_magnitude is not None:
+            spatial_filter = backend.spatial_filter()
+            spatial_filter.set_option(backend.option.filter_magnitude, spatial_magnitude)
+            spatial_filter.set_option(backend.option.filter_smooth_alpha, spatial_smooth_alpha)
+            spatial_filter.set_option(backend.option.filter_smooth_delta, spatial_smooth_delta)
+            self.filters.append(spatial_filter)
+        if temporal_smooth_alpha is not None:
+            temporal_filter = backend.temporal_filter()
+            temporal_filter.set_option(backend.option.filter_smooth_alpha, temporal_smooth_alpha)
+            temporal_filter.set_option(backend.option.filter_smooth_delta, temporal_smooth_delta)
+            self.filters.append(temporal_filter)
+        self.align = backend.align(backend.stream.color) if align else None
+
+    def process(self, frameset):
+        """
+        Run the filters on the depth frame of the frameset and align it to color
+
+        Return:
+        -----------
+        frameset : rs::composite_frame
+        """
+        for processing_block in self.filters:
+            frameset = processing_block.process(frameset).as_frameset()
+        if self.align is not None:
+            frameset = self.align.process(frameset)
+        return frameset
@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+_NULL_CONTEXT = nullcontext()
+
+
+def null_measure(stage):
+    # Stand-in for StageProfiler.measure when profiling is off
+    return _NULL_CONTEXT
+
+
+def percentiles_ms(seconds):
+    """
+    count, mean, p50, p95, p99 and max of a list of durations in seconds, reported in milliseconds
+    """
+    if not seconds:
+        return {'count': 0}
+    values = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(values.max()),
+        'total_s': float(values.sum() / 1000),
+    }
+
+
+class StageProfiler:
+    """
+    Collect the duration of every pass through the named stages of the capture path
+    """
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+
+    def summary(self):
+        with self._lock:
+            return {stage: percentiles_ms(seconds) for stage, seconds in self.samples.items()}
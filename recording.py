@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+RECORDING_VERSION = 1
+STREAM_FILE = 'view{view}_{stream}_{chunk:05d}.bin'
+
+
+def index_dtype(num_views, num_streams):
+    return np.dtype([
+        ('frame', '<i8'),
+        ('timestamp', '<f8', (num_views,)),
+        ('chunk', '<i4'),
+        ('offset', '<i8', (num_views, num_streams)),
+    ])
+
+
+class RecordingWriter:
+    """
+    Append raw frames of every view into chunked binary files
+
+    Each (view, stream) pair gets its own files of chunk_frames frames that are preallocated when
+    the chunk is opened. index.bin holds one record per set with the frame number, the timestamp of
+    every view, the chunk and the byte offset of every frame, meta.json describes the layout.
+
+    Parameters:
+    -----------
+    root : str
+           Directory of the recording, created if needed
+    chunk_frames : int
+                   Number of frames per chunk file
+    """
+    def __init__(self, root, chunk_frames=300):
+        self.root = root
+        self.chunk_frames = chunk_frames
+        os.makedirs(root, exist_ok=True)
+        self.meta = None
+        self.num_frames = 0
+        self.bytes_written = 0
+        self._files = {}
+        self._chunk = -1
+        self._index = open(os.path.join(root, 'index.bin'), 'wb')
+        self._dtype = None
+
+    def _init_layout(self, views):
+        streams = sorted(views[0])
+        if any(frames[stream] is None for frames in views for stream in streams):
+            raise ValueError("The first set of a recording must hold every stream")
+        self.meta = {
+            'version': RECORDING_VERSION,
+            'chunk_frames': self.chunk_frames,
+            'num_views': len(views),
+            'streams': {stream: {'shape': list(views[0][stream].shape), 'dtype': views[0][stream].dtype.str}
+                        for stream in streams},
+            'num_frames': 0,
+        }
+        self._dtype = index_dtype(len(views), len(streams))
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.root, 'meta.json'), 'w') as json_file:
+            json.dump(self.meta, json_file, indent=2)
+
+    def _frame_nbytes(self, stream):
+        info = self.meta['streams'][stream]
+        return int(np.prod(info['shape'])) * np.dtype(info['dtype']).itemsize
+
+    def _open_chunk(self, chunk):
+        self._close_files()
+        for view in range(self.meta['num_views']):
+            for stream in self.meta['streams']:
+                path = os.path.join(self.root, STREAM_FILE.format(view=view, stream=stream, chunk=chunk))
+                f = open(path, 'wb')
+                # Reserve the whole chunk up front so appending does not keep growing the file
+                f.truncate(self.chunk_frames * self._frame_nbytes(stream))
+                self._files[(view, stream)] = f
+        self._chunk = chunk
+
+    def _close_files(self, trim_to=None):
+        for (_, stream), f in self._files.items():
+            if trim_to is not None:
+                f.truncate(trim_to * self._frame_nbytes(stream))
+            f.close()
+        self._files = {}
+
+    def write(self, frame_number, views, timestamps=None):
+        """
+        Parameters:
+        -----------
+        frame_number : int
+        views : list of dict
+                Per view a dict stream name -> np.ndarray, the same streams and shapes for every call. A None
+                frame is not stored, e.g. a stream saved at a lower rate
+        timestamps : list of float or None
+                     Timestamp of every view in milliseconds
+        """
+        if self.meta is None:
+            self._init_layout(views)
+        chunk, slot = divmod(self.num_frames, self.chunk_frames)
+        if chunk != self._chunk:
+            self._open_chunk(chunk)
+
+        streams = list(self.meta['streams'])
+        record = np.zeros((), self._dtype)
+        record['frame'] = frame_number
+        record['chunk'] = chunk
+        if timestamps is not None:
+            record['timestamp'] = timestamps
+        for view, frames in enumerate(views):
+            for s, stream in enumerate(streams):
+                if frames[stream] is None:
+                    record['offset'][view, s] = -1
+                    continue
+                array = np.ascontiguousarray(frames[stream])
+                info = self.meta['streams'][stream]
+                if list(array.shape) != info['shape'] or array.dtype.str != info['dtype']:
+                    raise ValueError(f"View {view} {stream} is {array.shape} {array.dtype}, "
+                                     f"the recording holds {info['shape']} {info['dtype']}")
+                offset = slot * array.nbytes
+                f = self._files[(view, stream)]
+                f.seek(offset)
+                f.write(memoryview(array).cast('B'))
+                record['offset'][view, s] = offset
+                self.bytes_written += array.nbytes
+        self._index.write(record.tobytes())
+        self.num_frames += 1
+
+    def close(self):
+        if self._index.closed:
+            return
+        used = self.num_frames - self._chunk * self.chunk_frames if self._chunk >= 0 else None
+        self._close_files(trim_to=used)
+        self._index.close()
+        if self.meta is not None:
+            self.meta['num_frames'] = self.num_frames
+            self._write_meta()
+
+
+class RecordingReader:
+    """
+    Zero-copy access to a recording written by RecordingWriter
+
+    Every chunk file is memory mapped once, frames are returned as views into the mapping.
+    """
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'meta.json')) as json_file:
+            self.meta = json.load(json_file)
+        if self.meta['version'] > RECORDING_VERSION:
+            raise ValueError(f"Recording version {self.meta['version']} is newer than {RECORDING_VERSION}")
+        self.streams = list(self.meta['streams'])
+        self.num_views = self.meta['num_views']
+        dtype = index_dtype(self.num_views, len(self.streams))
+        # Also readable while the recording is still open, only complete records are used
+        self.index = np.fromfile(os.path.join(root, 'index.bin'), dtype=dtype)
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _map(self, view, stream, chunk):
+        key = (view, stream, chunk)
+        if key not in self._maps:
+            info = self.meta['streams'][stream]
+            path = os.path.join(self.root, STREAM_FILE.format(view=view, stream=stream, chunk=chunk))
+            frames = os.path.getsize(path) // (int(np.prod(info['shape'])) * np.dtype(info['dtype']).itemsize)
+            self._maps[key] = np.memmap(path, dtype=info['dtype'], mode='r', shape=(frames, *info['shape']))
+        return self._maps[key]
+
+    def get(self, idx, view, stream):
+        """
+        Frame idx (position in the recording, not the frame number) of one view and stream, None if not stored
+        """
+        record = self.index[idx]
+        offset = int(record['offset'][view, self.streams.index(stream)])
+        if offset < 0:
+            return None
+        frames = self._map(view, stream, int(record['chunk']))
+        return frames[offset // frames[0].nbytes]
+
+    def __getitem__(self, idx):
+        return [{stream: self.get(idx, view, stream) for stream in self.streams} for view in range(self.num_views)]
+
+    def frame_number(self, idx):
+        return int(self.index[idx]['frame'])
+
+    def timestamps(self, idx):
+        return self.index[idx]['timestamp'].tolist()
+
+
+def export_png(recording_root, root):
+    """
+    Write a recording out in the images/viewN, depths/viewN PNG layout of the capture scripts
+    """
+    reader = RecordingReader(recording_root)
+    for view in range(reader.num_views):
+        os.makedirs(os.path.join(root, 'images', f'view{view}'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'depths', f'view{view}'), exist_ok=True)
+    for idx in range(len(reader)):
+        frame_number = reader.frame_number(idx)
+        for view in range(reader.num_views):
+            for stream, path in (('color', f'images/view{view}/{frame_number}_img.png'),
+                                 ('depth', f'depths/view{view}/{frame_number}_depth.png')):
+                image = reader.get(idx, view, stream) if stream in reader.streams else None
+                if image is not None:
+                    cv2.imwrite(os.path.join(root, path), image)
+    return len(reader)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a raw recording to the PNG layout')
+    parser.add_argument('recording')
+    parser.add_argument('output')
+    args = parser.parse_args()
+    print(f"Exported {export_png(args.recording, args.output)} frames")
@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import time
+
+from frame_codecs import PngCodec
+from frame_writer import FrameIndex, save_views
+from recording import RecordingWriter
+
+SEGMENT_DIR = 'segment_{segment:05d}'
+MANIFEST_FILE = 'manifest.json'
+SESSION_FILE = 'session.json'
+SHARED_FILES = ('device_metadata.json', 'intrinsic.json')  # copied into every segment so each one replays alone
+
+# Steps taken one at a time while the disk cannot keep up: save every interval-th set, with or without color
+DEGRADATION_LEVELS = (
+    {'name': 'full', 'interval': 1, 'color': True},
+    {'name': 'half_rate', 'interval': 2, 'color': True},
+    {'name': 'depth_only', 'interval': 2, 'color': False},
+    {'name': 'depth_quarter_rate', 'interval': 4, 'color': False},
+)
+
+
+class SegmentedRecorder:
+    """
+    Split a long capture into time- or size-bounded segments and degrade the saving when the disk falls behind
+
+    Every segment is a directory of its own, root/segment_00000, ..., in the images/viewN, depths/viewN layout
+    or holding a raw recording, and gets a manifest.json when it is closed; root/session.json lists the
+    segments. A png segment keeps its own frames.jsonl index of the complete sets, see FrameIndex. The device
+    metadata and intrinsics found in root are copied into every segment. Passed to the device managers as
+    their recorder, so save_views hands it every saved set.
+
+    Every check_interval_s the free space and the write load are checked. The load is the writer's queue
+    fill, or without a writer the fraction of the time spent writing inline. The recorder steps down one
+    of the levels (lower save rate, then no color) when the load exceeds high_load or the free space lasts
+    less than min_remaining_s at the current write rate, and steps back up after the load stayed below
+    low_load for recover_s. Below min_free_bytes nothing is saved until space is freed.
+
+    Parameters:
+    -----------
+    root : str
+    format : str
+             'png' for the images/viewN layout with the given codecs, 'raw' for a RecordingWriter per segment
+    max_segment_s : float or None
+    max_segment_bytes : int or None
+    writer : FrameWriter or None
+             Queue the images of the png format instead of writing them inline
+    chunk_frames : int
+                   Frames per chunk file of the raw format
+    min_free_bytes, min_remaining_s : float
+    high_load, low_load, recover_s, check_interval_s : float
+    levels : tuple of dict
+             See DEGRADATION_LEVELS
+    streams : tuple of str
+              Streams the manager saves, e.g. only depth when the stream plan saves no color
+    """
+    def __init__(self, root, format='png', max_segment_s=600.0, max_segment_bytes=None, writer=None,
+                 color_codec=None, depth_codec=None, chunk_frames=300, profiler=None, min_free_bytes=2 << 30,
+                 min_remaining_s=600.0, high_load=0.8, low_load=0.4, recover_s=10.0, check_interval_s=1.0,
+                 levels=DEGRADATION_LEVELS, streams=('color', 'depth')):
+        if format not in ('png', 'raw'):
+            raise ValueError(f"format must be 'png' or 'raw', got {format}")
+        self.root = root
+        self.format = format
+        self.max_segment_s = max_segment_s
+        self.max_segment_bytes = max_segment_bytes
+        self.writer = writer
+        self.color_codec = color_codec if color_codec is not None else PngCodec()
+        self.depth_codec = depth_codec if depth_codec is not None else PngCodec()
+        self.chunk_frames = chunk_frames
+        self.profiler = profiler
+        self.min_free_bytes = min_free_bytes
+        self.min_remaining_s = min_remaining_s
+        self.high_load = high_load
+        self.low_load = low_load
+        self.recover_s = recover_s
+        self.check_interval_s = check_interval_s
+        self.levels = levels
+        self.streams = list(streams)
+        os.makedirs(root, exist_ok=True)
+        self.level = 0
+        self.stopped = False
+        self.num_frames = 0
+        self.skipped = 0
+        self.segments = []
+        self._segment = None
+        self._recording = None
+        self._index = None
+        self._offered = 0
+        self._inline_bytes = 0
+        self._write_seconds = 0.0
+        self._last_check = None
+        self._last_bytes = 0
+        self._last_write_seconds = 0.0
+        self._write_rate = 0.0
+        self._calm_since = None
+
+    @property
+    def bytes_written(self):
+        # The writer's counter also holds what it wrote before this recorder; only differences are used
+        if self._recording is not None:
+            return self._inline_bytes + self._recording.bytes_written
+        return self._inline_bytes + (self.writer.bytes_written if self.writer is not None else 0)
+
+    def _open_segment(self, frame_number, streams):
+        index = len(self.segments)
+        path = os.path.join(self.root, SEGMENT_DIR.format(segment=index))
+        os.makedirs(path, exist_ok=True)
+        for name in SHARED_FILES:
+            source = os.path.join(self.root, name)
+            if os.path.exists(source):
+                shutil.copy(source, path)
+        self._segment = {
+            'segment': index,
+            'path': os.path.basename(path),
+            'format': self.format,
+            'streams': streams,
+            'first_frame': frame_number,
+            'last_frame': None,
+            'num_frames': 0,
+            'skipped': 0,
+            'start_time': time.time(),
+            'end_time': None,
+            'first_timestamps': None,
+            'last_timestamps': None,
+            'bytes': 0,
+            'levels': [{'frame': frame_number, 'level': self.levels[self.level]['name']}],
+        }
+        self._made_dirs = set()
+        if self.format == 'raw':
+            if self._recording is not None:
+                self._inline_bytes += self._recording.bytes_written
+            self._recording = RecordingWriter(path, self.chunk_frames)
+        else:
+            self._index = FrameIndex(path)
+            self._segment['color_codec'] = self.color_codec.name
+            self._segment['depth_codec'] = self.depth_codec.name
+        self._segment_start_bytes = self.bytes_written
+        self.segments.append(self._segment)
+        print(f"Recording segment {index} into {path}")
+
+    def _close_segment(self):
+        segment = self._segment
+        if segment is None:
+            return
+        if self._recording is not None:
+            self._recording.close()
+        # Queued images are not waited for, that would stall the capture; their bytes count to the next segment
+        segment['end_time'] = time.time()
+        segment['bytes'] = self.bytes_written - self._segment_start_bytes
+        with open(os.path.join(self.root, segment['path'], MANIFEST_FILE), 'w') as json_file:
+            json.dump(segment, json_file, indent=2)
+        self._segment = None
+        self._write_session()
+
+    def _write_session(self):
+        session = {'format': self.format, 'max_segment_s': self.max_segment_s,
+                   'max_segment_bytes': self.max_segment_bytes, 'num_frames': self.num_frames, 'skipped': self.skipped,
+                   'segments': [{key: segment[key] for key in ('segment', 'path', 'first_frame', 'last_frame',
+                                                                'num_frames', 'bytes')} for segment in self.segments]}
+        with open(os.path.join(self.root, SESSION_FILE), 'w') as json_file:
+            json.dump(session, json_file, indent=2)
+
+    def _needs_rollover(self, streams):
+        segment = self._segment
+        if segment is None:
+            return True
+        if self.format == 'raw' and streams != segment['streams']:
+            # A raw recording keeps one layout, dropping color starts a new segment
+            return True
+        if self.max_segment_s is not None and time.time() - segment['start_time'] >= self.max_segment_s:
+            return True
+        return (self.max_segment_bytes is not None
+                and self.bytes_written - self._segment_start_bytes >= self.max_segment_bytes)
+
+    def _load(self, elapsed):
+        if self.writer is not None and self.format == 'png':
+            return self.writer.queue_depth / max(1, self.writer.max_queue_size)
+        return (self._write_seconds - self._last_write_seconds) / elapsed
+
+    def _set_level(self, level, reason):
+        level = min(max(level, 0), len(self.levels) - 1)
+        if level == self.level:
+            return
+        self.level = level
+        name = self.levels[level]['name']
+        print(f"Recording level {name}: {reason}")
+        if self._segment is not None:
+            self._segment['levels'].append({'frame': self._segment['last_frame'], 'level': name, 'reason': reason})
+
+    def _check(self):
+        now = time.perf_counter()
+        if self._last_check is None:
+            self._last_check = now
+            return
+        elapsed = now - self._last_check
+        if elapsed < self.check_interval_s:
+            return
+        bytes_written = self.bytes_written
+        rate = (bytes_written - self._last_bytes) / elapsed
+        self._write_rate = rate if self._write_rate == 0 else 0.7 * self._write_rate + 0.3 * rate
+        load = self._load(elapsed)
+        self._last_check = now
+        self._last_bytes = bytes_written
+        self._last_write_seconds = self._write_seconds
+
+        free = shutil.disk_usage(self.root).free
+        if free < self.min_free_bytes:
+            if not self.stopped:
+                print(f"Only {free / 2**30:.1f} GiB left on {self.root}, saving stopped")
+                self.stopped = True
+            return
+        if self.stopped:
+            print(f"{free / 2**30:.1f} GiB free on {self.root} again, saving resumed")
+            self.stopped = False
+        remaining_s = free / self._write_rate if self._write_rate > 0 else float('inf')
+        if load > self.high_load:
+            self._calm_since = None
+            self._set_level(self.level + 1, f'write load {load:.2f}')
+        elif remaining_s < self.min_remaining_s:
+            self._calm_since = None
+            self._set_level(self.level + 1, f'disk full in {remaining_s:.0f} s')
+        elif load < self.low_load and self.level > 0:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recover_s:
+                self._calm_since = now
+                self._set_level(self.level - 1, f'write load {load:.2f}')
+        else:
+            self._calm_since = None
+
+    def write(self, frame_number, views, timestamps=None):
+        """
+        Save one set, or skip it as the current level demands
+
+        Parameters:
+        -----------
+        views : list of dict
+                Per view a dict stream name -> np.ndarray with 'color' and 'depth', None when not saved with this set
+        """
+        self._check()
+        level = self.levels[self.level]
+        offered = self._offered
+        self._offered += 1
+        if self.stopped or offered % level['interval'] != 0:
+            self.skipped += 1
+            if self._segment is not None:
+                self._segment['skipped'] += 1
+            return
+        streams = [stream for stream in self.streams if level['color'] or stream != 'color']
+        if self._needs_rollover(streams):
+            if self.format == 'raw' and any(frames[stream] is None for frames in views for stream in streams):
+                # A raw segment takes its layout from its first set, wait for one that holds every stream
+                if self._segment is None or streams != self._segment['streams']:
+                    self.skipped += 1
+                    return
+            else:
+                self._close_segment()
+                self._open_segment(frame_number, streams)
+        segment = self._segment
+        path = os.path.join(self.root, segment['path'])
+
+        start = time.perf_counter()
+        if self._recording is not None:
+            self._recording.write(frame_number, [{stream: frames[stream] for stream in streams} for frames in views],
+                                  timestamps)
+        else:
+            for view in range(len(views)):
+                if view not in self._made_dirs:
+                    os.makedirs(os.path.join(path, 'images', f'view{view}'), exist_ok=True)
+                    os.makedirs(os.path.join(path, 'depths', f'view{view}'), exist_ok=True)
+                    self._made_dirs.add(view)
+            colors = [frames['color'] if 'color' in streams else None for frames in views]
+            # The managers hand a recorder depth images of their own, a queued write can keep them as they are
+            depths = [frames['depth'] for frames in views]
+            self._inline_bytes += save_views(path, frame_number, colors, depths, timestamps, self.writer, None,
+                                             self.color_codec, self.depth_codec, self.profiler, self._index)
+        self._write_seconds += time.perf_counter() - start
+
+        segment['last_frame'] = frame_number
+        segment['num_frames'] += 1
+        if timestamps is not None:
+            if segment['first_timestamps'] is None:
+                segment['first_timestamps'] = list(timestamps)
+            segment['last_timestamps'] = list(timestamps)
+        self.num_frames += 1
+
+    def stats(self):
+        return {
+            'level': self.levels[self.level]['name'],
+            'stopped': self.stopped,
+            'segments': len(self.segments),
+            'num_frames': self.num_frames,
+            'skipped': self.skipped,
+            'write_rate_mb_s': self._write_rate / 1e6,
+        }
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.flush()
+        self._close_segment()
+        self._write_session()
@@ -0,0 +1,437 @@
+import bisect
+import datetime
+import glob
+import itertools
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from depth_convert import DepthConverter
+from device_metadata import METADATA_FILE, MetadataCache
+from frame_codecs import PngCodec, read_image
+from frame_writer import read_frame_index, save_views
+from multiview_frameset import MultiViewFrameset, ViewFrames
+from processing import ProcessingChain, realsense_backend
+from profiling import null_measure
+from recording import RecordingReader
+from recording_session import SESSION_FILE
+
+REPLAY_PRODUCT_LINE = 'replay'
+SEGMENT_GLOB = 'segment_[0-9]*'  # directories of recording_session.SEGMENT_DIR
+
+
+class PngSession:
+    """
+    Session saved by the capture scripts in the images/viewN, depths/viewN layout, with any frame codec
+
+    The sets of the session's frames.jsonl are replayed when it has one, with the streams saved with each set;
+    otherwise the frame numbers present in every view of the streams the session holds, so a depth-only
+    session replays its depth.
+    """
+    sequential = False
+
+    def __init__(self, root):
+        self.root = root
+        self.num_views = max(len(glob.glob(os.path.join(root, directory, 'view*')))
+                             for directory in ('images', 'depths'))
+        paths = []
+        for view in range(self.num_views):
+            paths.append({'color': self._index(os.path.join(root, 'images', f'view{view}'), 'img'),
+                          'depth': self._index(os.path.join(root, 'depths', f'view{view}'), 'depth')})
+        streams = [stream for stream in ('color', 'depth') if any(views[stream] for views in paths)]
+        indexed = read_frame_index(root)
+        if indexed:
+            # The index only lists complete sets; a degraded recording saves some of them without color
+            self.frame_numbers = [entry['frame'] for entry in indexed
+                                  if all(any(entry['frame'] in views[stream] for stream in streams) for views in paths)]
+            self._timestamps = {entry['frame']: entry.get('timestamps') for entry in indexed}
+        else:
+            numbers = [set(views[stream]) for views in paths for stream in streams]
+            self.frame_numbers = sorted(set.intersection(*numbers)) if numbers else []
+            self._timestamps = {}
+        self._paths = paths
+
+    @staticmethod
+    def _index(directory, suffix):
+        pattern = re.compile(rf'(\d+)_{suffix}\.')
+        index = {}
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            match = pattern.match(name)
+            if match is not None:
+                index[int(match.group(1))] = os.path.join(directory, name)
+        return index
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def read(self, idx):
+        frame_number = self.frame_numbers[idx]
+        return [{stream: read_image(paths[frame_number]) for stream, paths in views.items() if frame_number in paths}
+                for views in self._paths]
+
+    def frame_number(self, idx):
+        return self.frame_numbers[idx]
+
+    def timestamps(self, idx):
+        return self._timestamps.get(self.frame_numbers[idx])
+
+    def close(self):
+        pass
+
+
+class RecordingSession:
+    """
+    Raw recording of recording.RecordingWriter, frames are memory-mapped and carry their timestamps
+
+    root is the experiment directory holding the intrinsics, the recording directory by default.
+    """
+    sequential = False
+
+    def __init__(self, recording_root, root=None):
+        self.root = root if root is not None else recording_root
+        self.reader = RecordingReader(recording_root)
+        self.num_views = self.reader.num_views
+
+    def __len__(self):
+        return len(self.reader)
+
+    def read(self, idx):
+        return self.reader[idx]
+
+    def frame_number(self, idx):
+        return self.reader.frame_number(idx)
+
+    def timestamps(self, idx):
+        return self.reader.timestamps(idx)
+
+    def close(self):
+        pass
+
+
+class BagSession:
+    """
+    One .bag file per view, played back through librealsense with depth aligned to color
+
+    The files are read in order; reading out of order seeks every playback device.
+
+    Parameters:
+    -----------
+    paths : list of str
+    processing_options : dict or None
+                         Keyword arguments of the ProcessingChain, the filters being tuned
+    """
+    sequential = True
+
+    def __init__(self, paths, processing_options=None, backend=None):
+        backend = realsense_backend(backend)
+        self._rs = backend
+        self.root = os.path.dirname(os.path.abspath(paths[0]))
+        self.num_views = len(paths)
+        self._pipelines = []
+        self._playbacks = []
+        self._processing = []
+        self._converters = []
+        for path in paths:
+            config = backend.config()
+            config.enable_device_from_file(path, repeat_playback=False)
+            pipeline = backend.pipeline()
+            profile = pipeline.start(config)
+            playback = profile.get_device().as_playback()
+            playback.set_real_time(False)
+            depth_scale = profile.get_device().first_depth_sensor().get_depth_scale() * 1000
+            self._pipelines.append(pipeline)
+            self._playbacks.append(playback)
+            self._processing.append(ProcessingChain(backend=backend, **(processing_options or {})))
+            self._converters.append(DepthConverter(depth_scale))
+            self.fps = profile.get_stream(backend.stream.depth).fps()
+        duration = min(playback.get_duration() for playback in self._playbacks)
+        self._length = int(duration.total_seconds() * self.fps)
+        self._next = 0
+        self._last_timestamps = (None, None)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, idx):
+        if idx != self._next:
+            for playback in self._playbacks:
+                playback.seek(datetime.timedelta(seconds=idx / self.fps))
+        views = []
+        timestamps = []
+        for pipeline, processing, converter in zip(self._pipelines, self._processing, self._converters):
+            frameset = pipeline.wait_for_frames()
+            aligned = processing.process(frameset)
+            raw_depth = np.asanyarray(aligned.get_depth_frame().get_data())
+            views.append({'color': np.asanyarray(aligned.get_color_frame().get_data()).copy(),
+                          'depth': converter.convert(raw_depth, np.empty(raw_depth.shape, np.uint16))})
+            timestamps.append(frameset.get_timestamp())
+        self._last_timestamps = (idx, timestamps)
+        self._next = idx + 1
+        return views
+
+    def frame_number(self, idx):
+        return idx
+
+    def timestamps(self, idx):
+        # Known for the frame read last only
+        last_idx, timestamps = self._last_timestamps
+        return timestamps if last_idx == idx else None
+
+    def close(self):
+        for pipeline in self._pipelines:
+            try:
+                pipeline.stop()
+            except RuntimeError as e:
+                print(f"Failed to stop a playback pipeline: {e}")
+
+
+class SegmentedSession:
+    """
+    Session of a recording_session.SegmentedRecorder, its segments replayed one after the other
+
+    The segments are taken in the order of session.json, followed by those it does not list yet (the one open
+    when the capture stopped). Every segment is a PngSession or a RecordingSession of its own; segments without
+    any saved set are skipped.
+    """
+    sequential = False
+
+    def __init__(self, root):
+        self.root = root
+        names = []
+        if os.path.exists(os.path.join(root, SESSION_FILE)):
+            with open(os.path.join(root, SESSION_FILE)) as json_file:
+                names = [segment['path'] for segment in json.load(json_file)['segments']]
+        names += sorted(os.path.basename(path) for path in glob.glob(os.path.join(root, SEGMENT_GLOB))
+                        if os.path.basename(path) not in names)
+        self.segments = []
+        for name in names:
+            path = os.path.join(root, name)
+            if not os.path.isdir(path):
+                continue
+            if os.path.exists(os.path.join(path, 'index.bin')) and not os.path.exists(os.path.join(path, 'meta.json')):
+                continue  # raw segment closed before its first set
+            segment = open_session(path)
+            if len(segment) > 0:
+                self.segments.append(segment)
+        self.num_views = max((segment.num_views for segment in self.segments), default=0)
+        self._starts = list(itertools.accumulate((len(segment) for segment in self.segments), initial=0))
+
+    def _locate(self, idx):
+        segment = bisect.bisect_right(self._starts, idx) - 1
+        return self.segments[segment], idx - self._starts[segment]
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def read(self, idx):
+        segment, idx = self._locate(idx)
+        return segment.read(idx)
+
+    def frame_number(self, idx):
+        segment, idx = self._locate(idx)
+        return segment.frame_number(idx)
+
+    def timestamps(self, idx):
+        segment, idx = self._locate(idx)
+        return segment.timestamps(idx)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+def open_session(path, processing_options=None, backend=None):
+    """
+    PngSession, RecordingSession, SegmentedSession or BagSession for a session directory, a raw recording,
+    a segmented recording or .bag files
+
+    Parameters:
+    -----------
+    path : str or list of str
+           Experiment directory, raw recording directory, a .bag file or a list of .bag files (one per view)
+    """
+    if isinstance(path, (list, tuple)) or str(path).endswith('.bag'):
+        return BagSession([path] if isinstance(path, str) else list(path), processing_options, backend)
+    if os.path.exists(os.path.join(path, SESSION_FILE)) or glob.glob(os.path.join(path, SEGMENT_GLOB)):
+        return SegmentedSession(path)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return RecordingSession(path)
+    if os.path.exists(os.path.join(path, 'recording', 'meta.json')):
+        return RecordingSession(os.path.join(path, 'recording'), path)
+    return PngSession(path)
+
+
+class ReplayManager:
+    """
+    Feed a recorded session back through the interface of the live device managers
+
+    get_frames returns a MultiViewFrameset like MultiDeviceManager, with numpy arrays in place of rs::frame,
+    and can save, preview and deproject the replayed sets in
+    the same way. A thread pool decodes the next frames ahead of the consumer.
+
+    Parameters:
+    -----------
+    session : PngSession, RecordingSession, SegmentedSession or BagSession
+              See open_session
+    prefetch : int
+               Number of sets decoded ahead
+    num_workers : int
+                  Decoding threads, sequential sessions always use one
+    realtime : bool
+               Pace the sets by their timestamps, or by fps when the session has none; otherwise replay at full speed
+    fps : float
+          Rate of sessions without timestamps in realtime mode
+    writer, recorder, color_codec, depth_codec, profiler, preview, point_clouds, frame_index :
+               As for MultiDeviceManager
+    """
+    def __init__(self, session, prefetch=8, num_workers=4, realtime=False, fps=30.0, writer=None, recorder=None,
+                 color_codec=None, depth_codec=None, profiler=None, preview=None, point_clouds=None, frame_index=None):
+        self.session = session
+        self.prefetch = max(1, prefetch)
+        self.realtime = realtime
+        self.fps = fps
+        self.writer = writer
+        self.recorder = recorder
+        self.color_codec = color_codec if color_codec is not None else PngCodec()
+        self.depth_codec = depth_codec if depth_codec is not None else PngCodec()
+        self.profiler = profiler
+        self._measure = profiler.measure if profiler is not None else null_measure
+        self.preview = preview
+        self.point_clouds = point_clouds
+        self.frame_index = frame_index
+        self.last_point_clouds = None
+        self.last_timestamps = []
+        self.last_frame_numbers = []
+        self.position = 0
+        self._frame_counter = 0
+        self._executor = ThreadPoolExecutor(1 if session.sequential else num_workers,
+                                            thread_name_prefix='replay')
+        self._pending = deque()
+        self._next_read = 0
+        self._pace_origin = None
+        self.metadata = MetadataCache()
+        root = getattr(session, 'root', None)
+        if root is not None and os.path.exists(os.path.join(root, METADATA_FILE)):
+            self.metadata = MetadataCache.load(root)
+        self._intrinsics = None
+        if root is not None and os.path.exists(os.path.join(root, 'intrinsic.json')):
+            with open(os.path.join(root, 'intrinsic.json')) as json_file:
+                self._intrinsics = {int(view): value for view, value in json.load(json_file).items()}
+
+    @property
+    def enabled_devices(self):
+        return {f'{REPLAY_PRODUCT_LINE}{view}': view for view in range(self.session.num_views)}
+
+    @property
+    def capture_engine(self):
+        return None
+
+    def __len__(self):
+        return len(self.session)
+
+    def enable_all_devices(self, *args, **kwargs):
+        print(f"Replaying {len(self.session)} sets of {self.session.num_views} views")
+        self.seek(0)
+
+    def start_capture_engine(self, *args, **kwargs):
+        # The prefetching pool already decouples reading from the consumer
+        return None
+
+    def stop_capture_engine(self):
+        pass
+
+    def _read(self, idx):
+        views = self.session.read(idx)
+        return views, self.session.timestamps(idx), self.session.frame_number(idx)
+
+    def _schedule(self):
+        while len(self._pending) < self.prefetch and self._next_read < len(self.session):
+            self._pending.append(self._executor.submit(self._read, self._next_read))
+            self._next_read += 1
+
+    def seek(self, idx):
+        """
+        Continue the replay at set idx (position in the session, not the frame number)
+        """
+        if not 0 <= idx <= len(self.session):
+            raise IndexError(f"Cannot seek to {idx} in a session of {len(self.session)} sets")
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self.position = self._next_read = idx
+        self._pace_origin = None
+        self._schedule()
+
+    def _pace(self, timestamps):
+        if timestamps is not None:
+            reference = min(timestamps) / 1000
+        else:
+            reference = self.position / self.fps
+        now = time.perf_counter()
+        if self._pace_origin is None:
+            self._pace_origin = now - reference
+        delay = self._pace_origin + reference - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_frames(self, root, save=False, no_count=False):
+        """
+        Next replayed set, raises EOFError after the last one
+        """
+        if not self._pending:
+            raise EOFError("End of the replayed session")
+        measure = self._measure
+        with measure('poll'):
+            views, timestamps, frame_number = self._pending.popleft().result()
+        self._schedule()
+        if self.realtime:
+            self._pace(timestamps)
+        self.position += 1
+
+        self.last_timestamps = timestamps if timestamps is not None else [frame_number * 1000 / self.fps] * len(views)
+        self.last_frame_numbers = [frame_number] * len(views)
+        frames = MultiViewFrameset([ViewFrames(view, None, REPLAY_PRODUCT_LINE,
+                                               {f'stream.{stream}': image for stream, image in streams.items()},
+                                               streams.get('color'), streams.get('depth'), timestamp, frame_number)
+                                    for view, (streams, timestamp) in enumerate(zip(views, self.last_timestamps))],
+                                   self._frame_counter)
+        colors = frames.colors
+        depths = frames.depths
+        if self.point_clouds is not None:
+            with measure('pointcloud'):
+                self.last_point_clouds = self.point_clouds.process(depths, colors)
+        if save:
+            save_views(root, self._frame_counter, colors, depths, self.last_timestamps, self.writer, self.recorder,
+                       self.color_codec, self.depth_codec, self.profiler, self.frame_index)
+        if self.preview is not None and all(color is not None for color in colors):
+            self.preview.publish(colors)
+        if not no_count:
+            self._frame_counter += 1
+        return frames
+
+    def get_device_intrinsics(self, frames):
+        """
+        Intrinsics saved with the session, from device_metadata.json or intrinsic.json
+        """
+        device_intrinsics = {}
+        views = self.metadata.views()
+        for (view, _), streams in frames.items():
+            if views:
+                device_intrinsics[view] = {key: dict(views[view].intrinsics(key)) for key in streams}
+            elif self._intrinsics is not None:
+                device_intrinsics[view] = self._intrinsics[view]
+        return device_intrinsics
+
+    def disable_streams(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        if self.preview is not None:
+            self.preview.stop()
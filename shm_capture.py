@@ -0,0 +1,363 @@
+import importlib
+import multiprocessing
+import queue
+import time
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from device_metadata import DeviceMetadata, MetadataCache
+from frame_codecs import PngCodec
+from frame_sync import FrameSynchronizer
+from frame_writer import save_views
+from multi_device_manager import MultiDeviceManager, enumerate_connected_devices
+from multiview_frameset import MultiViewFrameset, ViewFrames
+from processing import realsense_backend
+from profiling import null_measure
+
+
+class ShmRing:
+    """
+    Ring of multi-view sets in one shared memory block, written by a single producer
+
+    Every slot holds the aligned color and converted depth of each camera of a group, their timestamps and
+    frame numbers, and the sequence number of the set. The producer writes the pixels first and the slot's
+    sequence number last, so a reader that sees the same sequence number before and after reading a slot
+    got an intact set (a seqlock). Readers get views on the block, the pixels are never pickled.
+
+    Parameters:
+    -----------
+    num_cameras : int
+    color_resolution : (int, int)
+                       (width, height) of the aligned color and depth images
+    slots : int
+    name : str or None
+           Attach to an existing ring instead of creating one
+    """
+    def __init__(self, num_cameras, color_resolution, slots=8, name=None):
+        width, height = color_resolution
+        self.num_cameras = num_cameras
+        self.slots = slots
+        self._color_shape = (height, width, 3)
+        self._depth_shape = (height, width)
+        color_bytes = height * width * 3
+        depth_bytes = height * width * 2
+        self._view_bytes = color_bytes + depth_bytes
+        # Published count, then per slot: sequence number, frame numbers, timestamps
+        header_bytes = 8 + slots * 8 * (1 + 2 * num_cameras)
+        self._header_bytes = -(-header_bytes // 64) * 64
+        size = self._header_bytes + slots * num_cameras * self._view_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self._published = np.ndarray((1,), np.int64, self.shm.buf, 0)
+        self._sequence = np.ndarray((slots,), np.int64, self.shm.buf, 8)
+        self._frame_numbers = np.ndarray((slots, num_cameras), np.int64, self.shm.buf, 8 + slots * 8)
+        self._timestamps = np.ndarray((slots, num_cameras), np.float64, self.shm.buf,
+                                      8 + slots * 8 * (1 + num_cameras))
+        self._colors = []
+        self._depths = []
+        for slot in range(slots):
+            colors = []
+            depths = []
+            for camera in range(num_cameras):
+                offset = self._header_bytes + (slot * num_cameras + camera) * self._view_bytes
+                colors.append(np.ndarray(self._color_shape, np.uint8, self.shm.buf, offset))
+                depths.append(np.ndarray(self._depth_shape, np.uint16, self.shm.buf, offset + color_bytes))
+            self._colors.append(colors)
+            self._depths.append(depths)
+        if name is None:
+            self._published[0] = 0
+            self._sequence[:] = -1
+
+    @property
+    def published(self):
+        return int(self._published[0])
+
+    def publish(self, colors, depths, timestamps, frame_numbers):
+        sequence = int(self._published[0])
+        slot = sequence % self.slots
+        self._sequence[slot] = -1
+        for camera in range(self.num_cameras):
+            np.copyto(self._colors[slot][camera], colors[camera])
+            np.copyto(self._depths[slot][camera], depths[camera])
+        self._timestamps[slot] = timestamps
+        self._frame_numbers[slot] = frame_numbers
+        self._sequence[slot] = sequence
+        self._published[0] = sequence + 1
+
+    def read(self, sequence):
+        """
+        Views on the set with this sequence number, None when it was overwritten already
+
+        Return:
+        -----------
+        set : tuple or None
+              colors, depths, timestamps, frame numbers
+        """
+        slot = sequence % self.slots
+        if self._sequence[slot] != sequence:
+            return None
+        return (self._colors[slot], self._depths[slot], self._timestamps[slot].tolist(),
+                self._frame_numbers[slot].tolist())
+
+    def valid(self, sequence):
+        # Still the set with this sequence number; checked after reading a slot to detect a torn read
+        return self._sequence[sequence % self.slots] == sequence
+
+    def close(self, unlink=False):
+        # Drop the views before closing the mapping
+        self._published = self._sequence = self._frame_numbers = self._timestamps = None
+        self._colors = self._depths = []
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _produce(group, serials, ring_name, slots, color_resolution, make_config, backend_name, backend_setup,
+             processing_options, sync_tolerance_ms, stop, status):
+    # Entry point of a producer process: capture a group of cameras and publish every set into its ring
+    backend = importlib.import_module(backend_name)
+    if backend_setup is not None:
+        backend_setup()
+    ring = ShmRing(len(serials), color_resolution, slots, ring_name)
+    manager = MultiDeviceManager(backend.context(), partial(make_config, backend=backend), backend=backend,
+                                 preview=False, processing_options=processing_options, serials=serials)
+    try:
+        manager.enable_all_devices()
+        manager.start_capture_engine(sync_tolerance_ms=sync_tolerance_ms)
+        status.put((group, 'ready', [metadata.to_dict() for metadata in manager.metadata.views()]))
+        while not stop.is_set():
+            with manager.get_frames(None, save=False, no_count=True) as frames:
+                ring.publish(frames.colors, frames.depths, frames.timestamps, frames.frame_numbers)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group, the coordinator shuts the producers down
+        pass
+    except Exception as e:
+        status.put((group, 'error', repr(e)))
+        raise
+    finally:
+        manager.disable_streams()
+        ring.close()
+
+
+class ShmCaptureCoordinator:
+    """
+    Capture with one process per camera group and synchronize and save the sets in this process
+
+    Every producer process runs a MultiDeviceManager for its cameras and publishes the aligned color and
+    converted depth into a ShmRing. The coordinator matches the sets of the groups by timestamp, always taking
+    the newest matched set so that the producers have the most slots to go before they overwrite it. A saved
+    set is copied out of shared memory first and only saved when no producer overwrote it meanwhile; torn sets
+    are counted in torn and skipped. get_frames mirrors the device managers, with numpy arrays in place of
+    rs::frame.
+
+    Parameters:
+    -----------
+    make_config : callable
+                  Module-level make_config(serial, backend) returning the rs::config of a device; it is
+                  pickled to the producers together with the name of the backend
+    color_resolution : (int, int)
+                       (width, height) of the color stream, the depth is aligned to it
+    cameras_per_process : int
+    slots : int
+            Sets buffered per group
+    backend : module
+              pyrealsense2 or sim_realsense, imported by name in the producers
+    backend_setup : callable or None
+                    Picklable call run before the backend is used in every process, e.g. to set a simulated rig
+    sync_tolerance_ms : float or None
+                        Largest timestamp difference between the groups of a set, and between the cameras of a
+                        group. None matches the sets in arrival order
+    writer, recorder, color_codec, depth_codec, profiler, processing_options, frame_index :
+                        As for MultiDeviceManager
+    """
+    def __init__(self, make_config, color_resolution, cameras_per_process=1, slots=8, backend=None,
+                 backend_setup=None, sync_tolerance_ms=16.0, writer=None, recorder=None, color_codec=None,
+                 depth_codec=None, profiler=None, processing_options=None, frame_index=None):
+        backend = realsense_backend(backend)
+        if backend_setup is not None:
+            backend_setup()
+        self._rs = backend
+        self.make_config = make_config
+        self.color_resolution = color_resolution
+        self.cameras_per_process = cameras_per_process
+        self.slots = slots
+        self.backend_setup = backend_setup
+        self.sync_tolerance_ms = sync_tolerance_ms
+        self.writer = writer
+        self.recorder = recorder
+        self.color_codec = color_codec if color_codec is not None else PngCodec()
+        self.depth_codec = depth_codec if depth_codec is not None else PngCodec()
+        self.profiler = profiler
+        self._measure = profiler.measure if profiler is not None else null_measure
+        self.processing_options = processing_options
+        self.frame_index = frame_index
+        self._available_devices = enumerate_connected_devices(backend.context(), backend)
+        serials = [serial for serial, _ in self._available_devices]
+        self.groups = [serials[i:i + cameras_per_process] for i in range(0, len(serials), cameras_per_process)]
+        self.metadata = MetadataCache()
+        self.dropped = [0] * len(self.groups)
+        self.superseded = 0  # matched sets skipped for a newer one
+        self.torn = 0
+        self._last_sequences = []
+        self.last_timestamps = []
+        self.last_frame_numbers = []
+        self._rings = []
+        self._processes = []
+        self._next = []
+        self._frame_counter = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = self._context.Event()
+        self._status = self._context.Queue()
+        self.synchronizer = None
+
+    @property
+    def enabled_devices(self):
+        return {serial: product_line for serial, product_line in self._available_devices}
+
+    @property
+    def capture_engine(self):
+        return None
+
+    def enable_all_devices(self, timeout=30.0):
+        """
+        Start one producer process per group and wait until all of them stream
+        """
+        print(f"{len(self._available_devices)} devices in {len(self.groups)} capture processes")
+        for group, serials in enumerate(self.groups):
+            ring = ShmRing(len(serials), self.color_resolution, self.slots)
+            process = self._context.Process(
+                target=_produce, name=f'capture-{group}', daemon=True,
+                args=(group, serials, ring.name, self.slots, self.color_resolution, self.make_config,
+                      self._rs.__name__, self.backend_setup, self.processing_options, self.sync_tolerance_ms,
+                      self._stop, self._status))
+            process.start()
+            self._rings.append(ring)
+            self._processes.append(process)
+        self._next = [0] * len(self.groups)
+        tolerance_ms = self.sync_tolerance_ms if self.sync_tolerance_ms else float('inf')
+        # A history shorter than the ring keeps the matched sets away from the slots written next
+        self.synchronizer = FrameSynchronizer(range(len(self.groups)), tolerance_ms, max(1, self.slots // 2))
+        ready = 0
+        deadline = time.time() + timeout
+        while ready < len(self.groups):
+            try:
+                group, state, payload = self._status.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                raise TimeoutError("Not every capture process started in time")
+            if state == 'error':
+                raise RuntimeError(f"Capture process {group} failed: {payload}")
+            for metadata in payload:
+                # View indices of the producers count within their group
+                metadata['view'] += sum(len(serials) for serials in self.groups[:group])
+                self.metadata.add(DeviceMetadata.from_dict(metadata))
+            ready += 1
+
+    def start_capture_engine(self, *args, **kwargs):
+        # The producer processes run their own capture engines
+        return None
+
+    def stop_capture_engine(self):
+        pass
+
+    def _collect(self):
+        for group, ring in enumerate(self._rings):
+            published = ring.published
+            if published - self._next[group] > self.slots:
+                # The producer lapped us, skip to the oldest set still in the ring
+                skipped = published - self.slots - self._next[group]
+                self.dropped[group] += skipped
+                self._next[group] += skipped
+            while self._next[group] < published:
+                sequence = self._next[group]
+                self._next[group] += 1
+                views = ring.read(sequence)
+                if views is None:
+                    self.dropped[group] += 1
+                    continue
+                self.synchronizer.push(group, min(views[2]), sequence)
+
+    def get_views(self, timeout=5.0):
+        """
+        Wait for the newest timestamp-matched set of every group
+
+        Return:
+        -----------
+        views : tuple
+                colors, depths, timestamps and frame numbers of every camera in device order. The images are
+                views on shared memory, valid until the producers wrap around the ring, see intact
+        """
+        deadline = time.time() + timeout
+        while True:
+            for process in self._processes:
+                if not process.is_alive():
+                    raise RuntimeError(f"Capture process {process.name} exited with code {process.exitcode}")
+            self._collect()
+            matched = self.synchronizer.pop()
+            newer = self.synchronizer.pop() if matched is not None else None
+            while newer is not None:
+                # The older sets are the next ones the producers overwrite
+                self.superseded += 1
+                matched, newer = newer, self.synchronizer.pop()
+            if matched is not None:
+                sequences = [sequence for _, (_, sequence) in sorted(matched[0].items())]
+                sets = [ring.read(sequence) for ring, sequence in zip(self._rings, sequences)]
+                if all(views is not None for views in sets):
+                    self._last_sequences = sequences
+                    return tuple([item for views in sets for item in views[field]] for field in range(4))
+                self.torn += 1
+            if time.time() > deadline:
+                raise TimeoutError("No synchronized set arrived in time")
+            time.sleep(0.0005)
+
+    def get_frames(self, root, save=False, no_count=False):
+        measure = self._measure
+        while True:
+            with measure('poll'):
+                colors, depths, timestamps, frame_numbers = self.get_views()
+            if not save:
+                break
+            # Copied out of the slots before anything is saved, a producer may overwrite them any time
+            colors = [color.copy() for color in colors]
+            depths = [depth.copy() for depth in depths]
+            if self.intact():
+                break
+            self.torn += 1
+            print(f"A set was overwritten while it was copied, skipped ({self.torn} so far), raise slots")
+        self.last_timestamps = timestamps
+        self.last_frame_numbers = frame_numbers
+        if save:
+            save_views(root, self._frame_counter, colors, depths, timestamps, self.writer, self.recorder,
+                       self.color_codec, self.depth_codec, self.profiler, self.frame_index)
+        frames = MultiViewFrameset([ViewFrames(cam_idx, serial, product_line,
+                                               {'stream.color': colors[cam_idx], 'stream.depth': depths[cam_idx]},
+                                               colors[cam_idx], depths[cam_idx], timestamps[cam_idx],
+                                               frame_numbers[cam_idx])
+                                    for cam_idx, (serial, product_line) in enumerate(self._available_devices)],
+                                   self._frame_counter)
+        if not no_count:
+            self._frame_counter += 1
+        return frames
+
+    def intact(self):
+        """
+        Whether the set returned last is still in the rings, i.e. no producer overwrote it since
+        """
+        return all(ring.valid(sequence) for ring, sequence in zip(self._rings, self._last_sequences))
+
+    def get_device_intrinsics(self, frames):
+        views = self.metadata.views()
+        return {cam_idx: {key: dict(views[cam_idx].intrinsics(key)) for key in streams}
+                for (cam_idx, _), streams in frames.items()}
+
+    def disable_streams(self):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        for ring in self._rings:
+            ring.close(unlink=True)
+        self._processes = []
+        self._rings = []
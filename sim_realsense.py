@@ -0,0 +1,634 @@
+"""
+Simulated stand-in for the parts of pyrealsense2 the capture code uses
+
+Pass the module as backend to MultiDeviceManager (and use its config/context in place of the rs ones)
+to run the whole capture pipeline without cameras:
+
+    import sim_realsense
+    sim_realsense.set_rig(sim_realsense.SimRig(num_devices=4, fps=30, drop_rate=0.01))
+    manager = MultiDeviceManager(sim_realsense.context(), lambda serial: sim_config(), backend=sim_realsense)
+
+A SimRig generates synthetic frames or replays a recording written by recording.RecordingWriter.
+"""
+import enum
+import random
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class stream(enum.IntEnum):
+    any = 0
+    depth = 1
+    color = 2
+    infrared = 3
+
+    def __str__(self):
+        return f'stream.{self.name}'
+
+
+class format(enum.IntEnum):
+    any = 0
+    z16 = 1
+    y8 = 2
+    bgr8 = 3
+    rgb8 = 4
+
+    def __str__(self):
+        return f'format.{self.name}'
+
+
+class option(enum.IntEnum):
+    visual_preset = 0
+    emitter_enabled = 1
+    laser_power = 2
+    global_time_enabled = 3
+    filter_magnitude = 4
+    filter_smooth_alpha = 5
+    filter_smooth_delta = 6
+    enable_auto_exposure = 7
+    exposure = 8
+    frames_queue_size = 9
+
+    def __str__(self):
+        return f'option.{self.name}'
+
+
+class camera_info(enum.IntEnum):
+    name = 0
+    serial_number = 1
+    product_line = 2
+    firmware_version = 3
+
+
+class timestamp_domain(enum.IntEnum):
+    hardware_clock = 0
+    system_time = 1
+    global_time = 2
+
+    def __str__(self):
+        return f'timestamp_domain.{self.name}'
+
+
+class frame_metadata_value(enum.IntEnum):
+    frame_counter = 0
+    actual_exposure = 1
+
+    def __str__(self):
+        return f'frame_metadata_value.{self.name}'
+
+
+class l500_visual_preset(enum.IntEnum):
+    custom = 0
+    default = 1
+    no_ambient_light = 3
+    low_ambient_light = 4
+    max_range = 5
+    short_range = 6
+
+
+STREAM_FORMATS = {stream.depth: format.z16, stream.color: format.bgr8, stream.infrared: format.y8}
+
+
+class SimRig:
+    """
+    Description of a simulated camera rig
+
+    Parameters:
+    -----------
+    num_devices : int
+    fps : float
+    depth_resolution, color_resolution : (int, int)
+                                         Default (width, height) when a config does not request one
+    jitter_ms : float
+                Standard deviation of the timestamp jitter of every frame
+    phase_spread_ms : float
+                      The cameras share one clock, each one is offset from it by up to this much
+    drop_rate : float
+                Probability that a frame never arrives
+    depth_scale : float
+                  Meters per depth unit
+    start_delay_s : float
+                    Time pipeline.start takes, like the firmware handshake of a real device
+    exposure_settle_frames : float
+                             Frames the auto exposure of a started color sensor needs to get within 1/e of its
+                             target, the actual_exposure metadata of the frames converges accordingly
+    recording : str or None
+                Replay the views of this RecordingWriter directory instead of generating frames. The recorded depth
+                is already in millimeters and aligned to color, so the depth scale becomes 0.001
+    seed : int
+    """
+    def __init__(self, num_devices=4, fps=30, depth_resolution=(1024, 768), color_resolution=(1920, 1080),
+                 jitter_ms=0.5, phase_spread_ms=2.0, drop_rate=0.0, depth_scale=0.00025, recording=None, seed=0,
+                 start_delay_s=0.0, exposure_settle_frames=8.0):
+        self.num_devices = num_devices
+        self.fps = fps
+        self.depth_resolution = depth_resolution
+        self.color_resolution = color_resolution
+        self.jitter_ms = jitter_ms
+        self.phase_spread_ms = phase_spread_ms
+        self.epoch = time.time()
+        self.drop_rate = drop_rate
+        self.depth_scale = depth_scale
+        self.seed = seed
+        self.start_delay_s = start_delay_s
+        self.exposure_settle_frames = exposure_settle_frames
+        self.reader = None
+        if recording is not None:
+            from recording import RecordingReader
+            self.reader = RecordingReader(recording)
+            height, width = self.reader.meta['streams']['depth']['shape']
+            self.depth_resolution = (width, height)
+            height, width = self.reader.meta['streams']['color']['shape'][:2]
+            self.color_resolution = (width, height)
+            self.depth_scale = 0.001
+        self.devices = [SimDevice(self, idx) for idx in range(num_devices)]
+
+    def find(self, serial):
+        for device in self.devices:
+            if device.serial == serial:
+                return device
+        raise RuntimeError(f"No device connected with serial number {serial}")
+
+
+_rig = None
+
+
+def set_rig(rig):
+    global _rig
+    _rig = rig
+    return rig
+
+
+def get_rig():
+    global _rig
+    if _rig is None:
+        _rig = SimRig()
+    return _rig
+
+
+class intrinsics:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.fx = self.fy = 0.9 * width
+        self.ppx = width / 2
+        self.ppy = height / 2
+        self.coeffs = [0.0] * 5
+        self.model = 'none'
+
+
+class extrinsics:
+    def __init__(self, rotation=None, translation=None):
+        self.rotation = rotation if rotation is not None else [1.0, 0, 0, 0, 1.0, 0, 0, 0, 1.0]
+        self.translation = translation if translation is not None else [0.0, 0.0, 0.0]
+
+
+class video_stream_profile:
+    def __init__(self, stream_type, index, width, height, fmt, fps):
+        self._stream_type = stream_type
+        self._index = index
+        self._width = width
+        self._height = height
+        self._format = fmt
+        self._fps = fps
+        self._intrinsics = intrinsics(width, height)
+
+    def stream_type(self):
+        return self._stream_type
+
+    def stream_index(self):
+        return self._index
+
+    def format(self):
+        return self._format
+
+    def fps(self):
+        return self._fps
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def as_video_stream_profile(self):
+        return self
+
+    def get_intrinsics(self):
+        return self._intrinsics
+
+    def get_extrinsics_to(self, other):
+        if other.stream_type() == self._stream_type:
+            return extrinsics()
+        # The L515 color imager sits about 15 mm next to the depth imager
+        return extrinsics(translation=[0.015, 0.0, 0.0])
+
+    def resized(self, width, height):
+        return video_stream_profile(self._stream_type, self._index, width, height, self._format, self._fps)
+
+
+class frame:
+    def __init__(self, data, profile, frame_number, timestamp, metadata=None):
+        self._data = data
+        self._profile = profile
+        self._frame_number = frame_number
+        self._timestamp = timestamp
+        self._metadata = metadata or {}
+
+    def get_data(self):
+        return self._data
+
+    def get_profile(self):
+        return self._profile
+
+    def get_frame_number(self):
+        return self._frame_number
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_frame_timestamp_domain(self):
+        return timestamp_domain.global_time
+
+    def supports_frame_metadata(self, value):
+        return value.name in self._metadata
+
+    def get_frame_metadata(self, value):
+        if value.name not in self._metadata:
+            raise RuntimeError(f"Metadata {value} is not supported")
+        return self._metadata[value.name]
+
+    def is_depth_frame(self):
+        return self._profile.stream_type() == stream.depth
+
+    def get_width(self):
+        return self._profile.width()
+
+    def get_height(self):
+        return self._profile.height()
+
+    def keep(self):
+        pass
+
+    def __bool__(self):
+        return self._data is not None
+
+
+class composite_frame(frame):
+    def __init__(self, frames, frame_number=0, timestamp=0.0):
+        super().__init__(None, None, frame_number, timestamp)
+        self._frames = list(frames)
+
+    def size(self):
+        return len(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __bool__(self):
+        return bool(self._frames)
+
+    def first_or_default(self, stream_type):
+        for f in self._frames:
+            if f.get_profile().stream_type() == stream_type:
+                return f
+        return None
+
+    def first(self, stream_type):
+        f = self.first_or_default(stream_type)
+        if f is None:
+            raise RuntimeError(f"Frameset has no {stream_type} frame")
+        return f
+
+    def get_depth_frame(self):
+        return self.first_or_default(stream.depth)
+
+    def get_color_frame(self):
+        return self.first_or_default(stream.color)
+
+    def get_infrared_frame(self, index=0):
+        for f in self._frames:
+            profile = f.get_profile()
+            if profile.stream_type() == stream.infrared and (index == 0 or profile.stream_index() == index):
+                return f
+        return None
+
+    def as_frameset(self):
+        return self
+
+
+class config:
+    def __init__(self):
+        self._streams = []
+        self._serial = None
+        self._file = None
+
+    def enable_stream(self, stream_type, *args):
+        # Mirrors the overloads (stream), (stream, w, h, fmt, fps) and (stream, index, w, h, fmt, fps)
+        index, width, height, fmt, fps = 0, None, None, STREAM_FORMATS.get(stream_type), None
+        if len(args) == 5:
+            index, width, height, fmt, fps = args
+        elif len(args) == 4:
+            width, height, fmt, fps = args
+        elif len(args) == 1:
+            index = args[0]
+        elif args:
+            raise TypeError(f"Unsupported enable_stream arguments {args}")
+        self._streams = [s for s in self._streams if s[0] != stream_type]
+        self._streams.append((stream_type, index, width, height, fmt, fps))
+
+    def enable_device(self, serial):
+        self._serial = serial
+
+    def enable_device_from_file(self, path, repeat_playback=True):
+        self._file = path
+
+    def disable_all_streams(self):
+        self._streams = []
+
+
+class sensor:
+    def __init__(self, device, depth_scale=None):
+        self._device = device
+        self._depth_scale = depth_scale
+        self._options = {option.visual_preset: float(l500_visual_preset.default), option.emitter_enabled: 1.0,
+                         option.laser_power: 100.0, option.global_time_enabled: 0.0,
+                         option.enable_auto_exposure: 1.0, option.exposure: 8000.0,
+                         option.frames_queue_size: 16.0}
+
+    def get_depth_scale(self):
+        if self._depth_scale is None:
+            raise RuntimeError("Not a depth sensor")
+        return self._depth_scale
+
+    def supports(self, opt):
+        return opt in self._options
+
+    def set_option(self, opt, value):
+        if opt not in self._options:
+            raise RuntimeError(f"Option {opt} is not supported")
+        self._options[opt] = float(value)
+
+    def get_option(self, opt):
+        return self._options[opt]
+
+    def is_depth_sensor(self):
+        return self._depth_scale is not None
+
+
+class SimDevice:
+    def __init__(self, rig, idx):
+        self.rig = rig
+        self.idx = idx
+        self.serial = f'SIM{idx:05d}'
+        # Stored as float32 like the value librealsense reports
+        self._depth_sensor = sensor(self, float(np.float32(rig.depth_scale)))
+        self._color_sensor = sensor(self)
+
+    def get_info(self, info):
+        return {camera_info.name: 'Intel RealSense L515 (simulated)', camera_info.serial_number: self.serial,
+                camera_info.product_line: 'L500', camera_info.firmware_version: '0.0.0'}[info]
+
+    def supports(self, info):
+        return True
+
+    def first_depth_sensor(self):
+        return self._depth_sensor
+
+    def query_sensors(self):
+        return [self._depth_sensor, self._color_sensor]
+
+    @property
+    def sensors(self):
+        return self.query_sensors()
+
+
+class context:
+    def __init__(self):
+        self.rig = get_rig()
+
+    @property
+    def devices(self):
+        return list(self.rig.devices)
+
+    def query_devices(self):
+        return self.devices
+
+
+class pipeline_profile:
+    def __init__(self, device, profiles):
+        self._device = device
+        self._profiles = profiles
+
+    def get_device(self):
+        return self._device
+
+    def get_streams(self):
+        return list(self._profiles)
+
+    def get_stream(self, stream_type, index=-1):
+        for profile in self._profiles:
+            if profile.stream_type() == stream_type and (index < 0 or profile.stream_index() == index):
+                return profile
+        raise RuntimeError(f"Profile has no {stream_type} stream")
+
+
+class _FrameSource:
+    """
+    Produces the frames of one started pipeline on the rig's clock
+    """
+    def __init__(self, device, profiles):
+        self.device = device
+        self.rig = device.rig
+        self.profiles = profiles
+        self.period = 1.0 / self.rig.fps
+        phase = random.Random(self._seed(0, 2)).uniform(0, self.rig.phase_spread_ms) / 1000
+        self.start = self.rig.epoch + phase
+        # Frame numbers count from the rig's epoch, the first frame delivered is the one due now
+        self.last = self.due() - 1
+        self.first = self.last + 1
+        self.patterns = {}
+        for profile in profiles:
+            self.patterns[profile.stream_type()] = self._pattern(profile)
+
+    def _pattern(self, profile):
+        height, width = profile.height(), profile.width()
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        phase = self.device.idx * 0.7
+        if profile.stream_type() == stream.depth:
+            # A tilted plane around 2 m with a bump, in device units
+            meters = 2.0 + 0.5 * x / width + 0.3 * np.sin(x / 90 + phase) * np.cos(y / 70)
+            return np.clip(meters / self.device.first_depth_sensor().get_depth_scale(), 0, 65535).astype(np.uint16)
+        if profile.stream_type() == stream.color:
+            channels = [128 + 100 * np.sin(x / (60 + 20 * c) + y / 90 + phase) for c in range(3)]
+            return np.stack(channels, axis=-1).astype(np.uint8)
+        return (128 + 100 * np.sin(x / 50 + phase)).astype(np.uint8)
+
+    def _seed(self, n, purpose):
+        # Deterministic per frame, so a dropped frame stays dropped however often it is looked at
+        return ((self.rig.seed * 1000003 + self.device.idx) * 1000003 + n) * 2 + purpose
+
+    def _dropped(self, n):
+        if self.rig.drop_rate <= 0:
+            return False
+        return random.Random(self._seed(n, 0)).random() < self.rig.drop_rate
+
+    def _data(self, profile, n):
+        reader = self.rig.reader
+        if reader is not None:
+            view = self.device.idx % reader.num_views
+            name = {stream.depth: 'depth', stream.color: 'color'}.get(profile.stream_type())
+            if name in reader.streams:
+                return np.array(reader.get(n % len(reader), view, name))
+            return np.zeros((profile.height(), profile.width()), np.uint8)
+        # Moving pattern so consecutive frames differ, a fresh buffer per frame like the device delivers
+        return np.roll(self.patterns[profile.stream_type()], 4 * n, axis=1)
+
+    def frameset(self, n):
+        jitter = random.Random(self._seed(n, 1)).gauss(0, self.rig.jitter_ms)
+        timestamp = (self.start + n * self.period) * 1000 + jitter
+        color_sensor = self.device.query_sensors()[1]
+        exposure = color_sensor.get_option(option.exposure)
+        if color_sensor.get_option(option.enable_auto_exposure) and self.rig.exposure_settle_frames > 0:
+            # Starts far too long and decays to the target
+            exposure *= 1 + 3 * np.exp(-max(0, n - self.first) / self.rig.exposure_settle_frames)
+        frames = []
+        for profile in self.profiles:
+            metadata = {'frame_counter': n}
+            if profile.stream_type() == stream.color:
+                metadata['actual_exposure'] = float(exposure)
+            frames.append(frame(self._data(profile, n), profile, n, timestamp, metadata))
+        return composite_frame(frames, n, timestamp)
+
+    def due(self, now=None):
+        # Number of the newest frame whose time has come
+        now = time.time() if now is None else now
+        return int((now - self.start) / self.period)
+
+
+class pipeline:
+    def __init__(self, ctx=None):
+        self._context = ctx
+        self._source = None
+        self._profile = None
+        self._lock = threading.Lock()
+
+    def start(self, cfg=None, callback=None):
+        rig = get_rig()
+        cfg = cfg if cfg is not None else config()
+        device = rig.find(cfg._serial) if cfg._serial is not None else rig.devices[0]
+        requested = cfg._streams or [(stream.depth, 0, None, None, format.z16, None),
+                                      (stream.color, 0, None, None, format.bgr8, None)]
+        profiles = []
+        for stream_type, index, width, height, fmt, fps in requested:
+            default = rig.color_resolution if stream_type == stream.color else rig.depth_resolution
+            profiles.append(video_stream_profile(stream_type, index, width or default[0], height or default[1],
+                                                 fmt or STREAM_FORMATS[stream_type], fps or rig.fps))
+        if rig.start_delay_s > 0:
+            time.sleep(rig.start_delay_s)
+        self._source = _FrameSource(device, profiles)
+        self._profile = pipeline_profile(device, profiles)
+        return self._profile
+
+    def stop(self):
+        if self._source is None:
+            raise RuntimeError("stop() cannot be called before start()")
+        self._source = None
+
+    def get_active_profile(self):
+        return self._profile
+
+    def _next(self, n):
+        # Skip the frames that were dropped on the way
+        while self._source._dropped(n):
+            n += 1
+        return n
+
+    def poll_for_frames(self):
+        with self._lock:
+            source = self._source
+            if source is None:
+                raise RuntimeError("poll_for_frames() cannot be called before start()")
+            due = source.due()
+            if due <= source.last or source._dropped(due):
+                return composite_frame([])
+            # Like a one-deep frame queue, a late consumer only sees the newest frame
+            source.last = due
+            return source.frameset(due)
+
+    def wait_for_frames(self, timeout_ms=5000):
+        with self._lock:
+            source = self._source
+            if source is None:
+                raise RuntimeError("wait_for_frames() cannot be called before start()")
+            n = self._next(max(source.last + 1, source.due()))
+            arrival = source.start + n * source.period
+            delay = arrival - time.time()
+            if delay > timeout_ms / 1000:
+                time.sleep(timeout_ms / 1000)
+                raise RuntimeError(f"Frame didn't arrive within {timeout_ms}")
+            if delay > 0:
+                time.sleep(delay)
+            source.last = n
+            return source.frameset(n)
+
+    def try_wait_for_frames(self, timeout_ms=5000):
+        try:
+            return True, self.wait_for_frames(timeout_ms)
+        except RuntimeError:
+            return False, composite_frame([])
+
+
+class align:
+    """
+    Resample depth to the color resolution with a nearest neighbour lookup
+    """
+    def __init__(self, align_to):
+        self.align_to = align_to
+
+    def process(self, frameset):
+        depth = frameset.get_depth_frame()
+        target = frameset.first_or_default(self.align_to)
+        if depth is None or target is None:
+            return frameset
+        target_profile = target.get_profile()
+        width, height = target_profile.width(), target_profile.height()
+        data = np.asarray(depth.get_data())
+        if data.shape != (height, width):
+            data = cv2.resize(data, (width, height), interpolation=cv2.INTER_NEAREST)
+        profile = depth.get_profile().resized(width, height)
+        aligned_depth = frame(data, profile, depth.get_frame_number(), depth.get_timestamp())
+        frames = [aligned_depth if f is depth else f for f in frameset]
+        return composite_frame(frames, frameset.get_frame_number(), frameset.get_timestamp())
+
+
+class _filter:
+    def __init__(self):
+        self._options = {}
+
+    def set_option(self, opt, value):
+        self._options[opt] = value
+
+    def get_option(self, opt):
+        return self._options.get(opt, 0.0)
+
+    def process(self, frame_or_frameset):
+        return frame_or_frameset
+
+
+class decimation_filter(_filter):
+    pass
+
+
+class spatial_filter(_filter):
+    pass
+
+
+class temporal_filter(_filter):
+    pass
@@ -0,0 +1,169 @@
+import socketserver
+import threading
+import time
+
+from frame_writer import save_views
+
+
+class SnapshotService:
+    """
+    Stream continuously and save the newest synchronized set whenever a snapshot is triggered
+
+    A background thread keeps calling get_frames on the device manager, so the pipelines stay warm and
+    the aligned, converted images of the latest set are always at hand. trigger() saves the newest set as
+    soon as the set in progress is done, within about one frame period, instead of polling, aligning and
+    converting a new one on a cold pipeline. Triggers come from any thread: key callbacks, the socket of
+    start_trigger_server or a timer.
+
+    Parameters:
+    -----------
+    manager : MultiDeviceManager
+              Enabled, its writer, recorder, codecs and frame index are used for saving
+    root : str
+    sync_tolerance_ms : float or None
+                        Passed to start_capture_engine when the manager has no engine running yet
+    """
+    def __init__(self, manager, root, sync_tolerance_ms=16.0):
+        self.manager = manager
+        self.root = root
+        self.sync_tolerance_ms = sync_tolerance_ms
+        self.count = 0
+        self.latest_frames = None
+        self.latest_time = None
+        self.error = None
+        self._lock = threading.Lock()  # held while the latest set is replaced or saved
+        self._waiting = 0  # triggers waiting for the lock, the capture thread lets them go first
+        self._waiting_condition = threading.Condition()
+        self._ready = threading.Event()
+        self._running = False
+        self._thread = None
+        self._timers = []
+        self._stop_timers = threading.Event()
+
+    def start(self, timeout=10.0):
+        """
+        Start streaming and wait for the first set
+        """
+        if self.manager.capture_engine is None:
+            self.manager.start_capture_engine(sync_tolerance_ms=self.sync_tolerance_ms)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='snapshot-capture', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"No set arrived within {timeout} s")
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while self._running:
+            with self._waiting_condition:
+                while self._waiting and self._running:
+                    self._waiting_condition.wait(0.1)
+            try:
+                # The lock keeps the buffers of the latest set from being reused while it is saved
+                with self._lock:
+                    previous = self.latest_frames
+                    self.latest_frames = self.manager.get_frames(self.root, save=False, no_count=True)
+                    self.latest_time = time.perf_counter()
+                    if previous is not None:
+                        # Hands the device buffers of the replaced set back to librealsense
+                        previous.release()
+            except Exception as e:
+                self.error = e
+                self._running = False
+            finally:
+                self._ready.set()
+
+    def trigger(self):
+        """
+        Save the latest set
+
+        Return:
+        -----------
+        snapshot : int
+                   Number of the snapshot, the frame number in the saved file names
+        age_ms : float
+                 Time between the arrival of the saved set and the trigger
+        """
+        if self.error is not None:
+            raise RuntimeError("The snapshot capture thread failed") from self.error
+        manager = self.manager
+        with self._waiting_condition:
+            self._waiting += 1
+        try:
+            with self._lock:
+                age_ms = (time.perf_counter() - self.latest_time) * 1000
+                snapshot = self.count
+                depths = manager.last_depths
+                if manager.writer is not None:
+                    # The converter reuses its buffers for the next set, the color is copied by save_views
+                    depths = [depth.copy() if depth is not None else None for depth in depths]
+                save_views(self.root, snapshot, manager.last_colors, depths, manager.last_timestamps,
+                           manager.writer, manager.recorder, manager.color_codec, manager.depth_codec,
+                           manager.profiler, manager.frame_index, cameras=list(manager.enabled_devices),
+                           on_written=manager.count_view_bytes)
+                self.count += 1
+        finally:
+            with self._waiting_condition:
+                self._waiting -= 1
+                self._waiting_condition.notify_all()
+        return snapshot, age_ms
+
+    def start_timer(self, interval_s):
+        """
+        Trigger a snapshot every interval_s seconds from a thread of its own
+        """
+        def run():
+            next_time = time.perf_counter()
+            while not self._stop_timers.is_set():
+                snapshot, age_ms = self.trigger()
+                print(f"Saved snapshot {snapshot} ({age_ms:.1f} ms old)")
+                # Scheduled against the start, the save time does not add up over the snapshots
+                next_time += interval_s
+                self._stop_timers.wait(max(0.0, next_time - time.perf_counter()))
+
+        timer = threading.Thread(target=run, name='snapshot-timer', daemon=True)
+        timer.start()
+        self._timers.append(timer)
+        return timer
+
+    def stop(self):
+        self._stop_timers.set()
+        for timer in self._timers:
+            timer.join()
+        self._timers = []
+        self._running = False
+        with self._waiting_condition:
+            self._waiting_condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def start_trigger_server(service, port, host='127.0.0.1'):
+    """
+    Take a snapshot for every line received on a local TCP socket, e.g. `echo snap | nc 127.0.0.1 port`
+
+    Every line is answered with the snapshot number and the age of the saved set in milliseconds.
+
+    Return:
+    -----------
+    server : ThreadingTCPServer
+             Call server.shutdown() to stop it
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for _ in self.rfile:
+                try:
+                    snapshot, age_ms = service.trigger()
+                    reply = f'{snapshot} {age_ms:.1f}\n'
+                except Exception as e:
+                    reply = f'error {e}\n'
+                self.wfile.write(reply.encode())
+
+    server = socketserver.ThreadingTCPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='snapshot-trigger-server', daemon=True)
+    thread.start()
+    print(f"Snapshot trigger listening on {host}:{server.server_address[1]}")
+    return server
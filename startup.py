@@ -0,0 +1,168 @@
+import time
+
+WARMUP_MODES = ('frames', 'exposure')
+
+
+class CameraReadiness:
+    """
+    Startup progress of one camera, times in seconds since the start of the rig
+    """
+    def __init__(self, view, serial):
+        self.view = view
+        self.serial = serial
+        self.started_s = None  # pipeline started and sensors configured
+        self.ready_s = None  # warm-up done
+        self.warmup_frames = 0
+        self.exposure = None  # last actual exposure of the color frames
+        self.converged = None  # None when the exposure was not checked
+        self.error = None
+
+    @property
+    def ready(self):
+        return self.ready_s is not None and self.error is None
+
+    def describe(self):
+        return {'view': self.view, 'serial': self.serial, 'started_s': self.started_s, 'ready_s': self.ready_s,
+                'warmup_frames': self.warmup_frames, 'exposure': self.exposure, 'converged': self.converged,
+                'error': self.error}
+
+
+class RigStartup:
+    """
+    Bring up every camera of a MultiDeviceManager concurrently and warm it up before the capture starts
+
+    The pipelines are started in parallel. Each camera gets its visual preset and emitter options and is
+    warmed up on the thread that started it, as soon as it is up, instead of waiting for the slowest one.
+    The warm-up discards warmup_frames framesets, or with warmup='exposure' waits until the actual exposure
+    of the color frames changed by less than exposure_tolerance for stable_frames frames in a row, at most
+    max_warmup_frames. Cameras without exposure metadata fall back to the frame count. Must run before
+    start_capture_engine, the warm-up reads the pipelines directly.
+
+    Parameters:
+    -----------
+    manager : MultiDeviceManager
+    warmup : str
+             'frames' or 'exposure'
+    warmup_frames : int
+    max_warmup_frames : int
+    exposure_tolerance : float
+                         Relative change of the exposure between consecutive frames
+    stable_frames : int
+    enable_ir_emitter : bool
+    visual_preset : str
+                    Name of an l500_visual_preset
+    laser_power : float or None
+    timeout_ms : int
+                 Timeout of a single wait_for_frames call during the warm-up
+    """
+    def __init__(self, manager, warmup='exposure', warmup_frames=30, max_warmup_frames=300, exposure_tolerance=0.02,
+                 stable_frames=5, enable_ir_emitter=False, visual_preset='max_range', laser_power=None,
+                 timeout_ms=5000):
+        if warmup not in WARMUP_MODES:
+            raise ValueError(f"warmup must be one of {WARMUP_MODES}, got {warmup}")
+        self.manager = manager
+        self.warmup = warmup
+        self.warmup_frames = warmup_frames
+        self.max_warmup_frames = max(max_warmup_frames, warmup_frames)
+        self.exposure_tolerance = exposure_tolerance
+        self.stable_frames = stable_frames
+        self.enable_ir_emitter = enable_ir_emitter
+        self.visual_preset = visual_preset
+        self.laser_power = laser_power
+        self.timeout_ms = timeout_ms
+        self.readiness = {}
+        self.elapsed_s = None
+        self._start = None
+
+    def _elapsed(self):
+        return time.perf_counter() - self._start
+
+    def _exposure(self, frameset):
+        rs = self.manager.backend
+        color = frameset.first_or_default(rs.stream.color)
+        if not color or not hasattr(color, 'supports_frame_metadata'):
+            return None
+        if not color.supports_frame_metadata(rs.frame_metadata_value.actual_exposure):
+            return None
+        return color.get_frame_metadata(rs.frame_metadata_value.actual_exposure)
+
+    def _warm_up(self, device, readiness):
+        check_exposure = self.warmup == 'exposure'
+        stable = 0
+        previous = None
+        while readiness.warmup_frames < self.max_warmup_frames:
+            frameset = device.pipeline.wait_for_frames(self.timeout_ms)
+            readiness.warmup_frames += 1
+            exposure = self._exposure(frameset) if check_exposure else None
+            if exposure is None:
+                if check_exposure and readiness.warmup_frames == 1:
+                    print(f"No exposure metadata from {readiness.serial}, warming up for {self.warmup_frames} frames")
+                check_exposure = False
+                if readiness.warmup_frames >= self.warmup_frames:
+                    return
+                continue
+            readiness.exposure = exposure
+            if previous is not None and abs(exposure - previous) <= self.exposure_tolerance * max(previous, 1e-6):
+                stable += 1
+            else:
+                stable = 0
+            previous = exposure
+            if stable >= self.stable_frames:
+                readiness.converged = True
+                return
+        if check_exposure:
+            readiness.converged = False
+
+    def _bring_up(self, idx, serial, device):
+        readiness = self.readiness[serial]
+        if self.laser_power is not None:
+            # Otherwise the laser power follows the preset
+            self.manager.configure_sensors(device.pipeline_profile, laser_power=self.laser_power)
+        readiness.started_s = self._elapsed()
+        try:
+            self._warm_up(device, readiness)
+            readiness.ready_s = self._elapsed()
+        except RuntimeError as e:
+            readiness.error = str(e)
+
+    def run(self):
+        """
+        Start, configure and warm up every camera, print the readiness report
+
+        Raises RuntimeError when a camera did not deliver frames during the warm-up.
+
+        Return:
+        -----------
+        readiness : dict
+                    Serial number -> CameraReadiness, in view order
+        """
+        manager = self.manager
+        self._start = time.perf_counter()
+        self.readiness = {serial: CameraReadiness(view, serial)
+                          for view, (serial, _) in enumerate(manager.available_devices)}
+        # The preset and emitter are set by enable_device on the thread that started the device
+        manager.enable_all_devices(self.enable_ir_emitter, visual_preset=self.visual_preset,
+                                   on_enabled=self._bring_up)
+        self.elapsed_s = self._elapsed()
+        self.report()
+        failed = [readiness for readiness in self.readiness.values() if not readiness.ready]
+        if failed:
+            raise RuntimeError("Cameras not ready: " + ", ".join(f"{readiness.serial} ({readiness.error})"
+                                                                 for readiness in failed))
+        return self.readiness
+
+    def report(self):
+        for readiness in self.readiness.values():
+            if readiness.error is not None:
+                print(f"View {readiness.view} ({readiness.serial}): not ready, {readiness.error}")
+                continue
+            if readiness.ready_s is None:
+                print(f"View {readiness.view} ({readiness.serial}): not started")
+                continue
+            exposure = ''
+            if readiness.converged is not None:
+                state = 'converged' if readiness.converged else 'not converged'
+                exposure = f", exposure {readiness.exposure:.0f} {state}"
+            print(f"View {readiness.view} ({readiness.serial}): started after {readiness.started_s:.2f} s, "
+                  f"ready after {readiness.ready_s:.2f} s, {readiness.warmup_frames} warm-up frames{exposure}")
+        print(f"Rig ready in {self.elapsed_s:.2f} s")
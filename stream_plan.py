@@ -0,0 +1,144 @@
+SAVED_STREAMS = ('depth', 'color')  # streams get_frames converts and saves; infrared can only be streamed
+
+
+class StreamSettings:
+    """
+    Profile of one enabled stream and how often it is saved
+
+    Parameters:
+    -----------
+    width, height : int
+    format : str
+             Name of an rs.format, e.g. 'z16', 'bgr8', 'y8'
+    fps : int
+    save : bool
+    save_fps : float or None
+               Save at most this many frames per second, every frame when None. The sets are decimated by their
+               frame timestamps, so the rate holds when the consumer falls behind the camera, and the manager
+               decides once per set, so all views with the same settings save the same sets
+    index : int or None
+            Stream index, e.g. of the infrared imager
+    """
+    def __init__(self, width, height, format, fps, save=True, save_fps=None, index=None):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.fps = fps
+        self.save = save
+        self.save_fps = save_fps
+        self.index = index
+
+    @property
+    def save_period(self):
+        """
+        Milliseconds between saved frames, 0 to save every frame and None when the stream is not saved
+        """
+        if not self.save:
+            return None
+        if self.save_fps is None or self.save_fps >= self.fps:
+            return 0
+        return 1000.0 / self.save_fps
+
+
+class StreamPlan:
+    """
+    Streams enabled on a camera, which of them are saved and at which rate
+
+    Streams missing from the plan are not enabled, so they cost neither USB bandwidth nor host CPU.
+    The manager only aligns and converts the streams that are due to be saved.
+
+    Parameters:
+    -----------
+    streams : dict
+              Stream name ('depth', 'color' or 'infrared') -> StreamSettings
+    """
+    def __init__(self, streams):
+        for name, settings in streams.items():
+            if settings.save and name not in SAVED_STREAMS:
+                raise ValueError(f"The {name} stream cannot be saved, only {SAVED_STREAMS}")
+        self.streams = dict(streams)
+
+    def enabled(self, stream):
+        return stream in self.streams
+
+    def saved_streams(self):
+        return [name for name in SAVED_STREAMS if name in self.streams and self.streams[name].save]
+
+    def due(self, stream, timestamp, last_saved=None):
+        """
+        Whether the stream is saved with the set of this timestamp
+
+        Parameters:
+        -----------
+        stream : str
+        timestamp : float
+                    Frame timestamp of the set in ms
+        last_saved : float or None
+                     What the previous due call returned for the stream, None before the first save
+
+        Return:
+        -----------
+        due : bool
+        last_saved : float or None
+                     Pass it back on the next call. Saves are scheduled a period apart rather than at the saved
+                     timestamps, so jitter does not lower the rate, and restart after a gap of two periods
+        """
+        settings = self.streams.get(stream)
+        period = None if settings is None else settings.save_period
+        if period is None:
+            return False, last_saved
+        if period == 0 or last_saved is None:
+            return True, timestamp
+        elapsed = timestamp - last_saved
+        # Half a camera frame of slack, the frame closest to the scheduled time is saved
+        if elapsed < period - 500.0 / settings.fps:
+            return False, last_saved
+        return True, timestamp if elapsed >= 2 * period or elapsed < 0 else last_saved + period
+
+    def config(self, backend=None):
+        """
+        Fresh rs::config enabling exactly the planned streams
+        """
+        if backend is None:
+            import pyrealsense2 as backend
+        config = backend.config()
+        for name, settings in self.streams.items():
+            stream = getattr(backend.stream, name)
+            stream_format = getattr(backend.format, settings.format)
+            if settings.index is not None:
+                config.enable_stream(stream, settings.index, settings.width, settings.height, stream_format,
+                                     settings.fps)
+            else:
+                config.enable_stream(stream, settings.width, settings.height, stream_format, settings.fps)
+        return config
+
+    def describe(self):
+        return {name: {'width': settings.width, 'height': settings.height, 'format': settings.format,
+                       'fps': settings.fps, 'save': settings.save, 'save_fps': settings.save_fps}
+                for name, settings in self.streams.items()}
+
+    @classmethod
+    def parse(cls, spec, profiles):
+        """
+        Plan from a command line spec, e.g. 'depth:30,color:10' or 'depth,color:10,infrared:off'
+
+        A bare name saves every frame, name:N saves N frames per second, name:0 streams without saving
+        and name:off (or leaving the stream out) disables it.
+
+        Parameters:
+        -----------
+        spec : str
+        profiles : dict
+                   Stream name -> (width, height, format, fps) of the stream when it is enabled
+        """
+        streams = {}
+        for item in spec.split(','):
+            name, _, rate = item.strip().partition(':')
+            if name not in profiles:
+                raise ValueError(f"Unknown stream {name}, choose from {list(profiles)}")
+            if rate == 'off':
+                continue
+            save_fps = float(rate) if rate else None
+            save = name in SAVED_STREAMS and save_fps != 0
+            streams[name] = StreamSettings(*profiles[name], save=save, save_fps=save_fps if save else None)
+        return cls(streams)